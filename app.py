@@ -3,49 +3,71 @@ import streamlit as st
 import pandas as pd
 from collections import defaultdict, Counter
 from openpyxl import load_workbook, Workbook
-from openpyxl.utils import get_column_letter
+from openpyxl.utils import get_column_letter, column_index_from_string
 from openpyxl.styles import Font, Fill, Border, Alignment, Protection
 from copy import copy
+from datetime import date, datetime, time as dt_time, timedelta
 from pathlib import Path
 import os
+import re
+import sys
+import math
+import random
+import json
+import atexit
+import base64
+import codecs
+import csv
+import gc
+import subprocess
+import unicodedata
+import heapq
+import hmac
+import hashlib
+import pickle
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from io import BytesIO, TextIOWrapper
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from functools import partial
+from itertools import groupby
+
+try:
+    # Parquet 내보내기에만 사용 (없으면 CSV/JSON Lines만 제공)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 st.set_page_config(page_title="엑셀 행 재정렬 안전 비교 (전체열 + 색상)", layout="wide")
-st.title("📘 엑셀 행 재정렬 안전 비교 (전체열 + 색상)")
-st.caption("기준 파일과 비교 파일을 선택하면, 행 순서가 달라도 전체 열에서 **값 변경**과 **배경색(채우기) 변경**을 잡아냅니다.")
 
-# 대용량 파일 안내
-with st.expander("ℹ️ 사용 안내 및 성능 정보", expanded=False):
-    st.markdown("""
-    ### 📊 처리 제한 설정
-    
-    **기본 설정 (권장):**
-    - 최대 행 수: 100,000행
-    - 최대 열 수: 200열
-    - 페어링: 제한 모드 (빠름)
-    
-    **설정 조정:**
-    - 설정 메뉴에서 최대 행/열 수를 조정할 수 있습니다
-    - '무제한 페어링' 체크 시 모든 행을 정확히 매칭 (느릴 수 있음)
-    
-    ### ⚡ 페어링 알고리즘
-    
-    **제한 모드 (기본):**
-    - 1단계: 정확히 일치하는 행은 해시 기반으로 빠르게 매칭
-    - 2단계: 일치하지 않는 행은 최대 100,000개 조합까지 유사도 비교
-    - 속도: ⚡⚡⚡ 빠름
-    
-    **무제한 모드:**
-    - 모든 가능한 조합을 전부 확인하여 최적의 매칭 찾기
-    - 매우 정확하지만 시간이 오래 걸릴 수 있음
-    - 속도: 🐌 느림 (행이 많을수록 느려짐)
-    
-    ### 💡 권장 사용법
-    
-    - **일반적인 경우:** 기본 설정 사용
-    - **대용량 파일 (10만 행 이상):** 제한 모드 유지
-    - **정확도가 중요한 경우:** 무제한 페어링 사용
-    - **파일이 매우 큰 경우:** 행/열 제한을 조정하여 필요한 범위만 처리
-    """)
+# ----------------------- 알림 -----------------------
+# 백그라운드 작업 스레드에서는 화면에 직접 출력할 수 없으므로 작업별 메시지 목록에 모읍니다.
+_message_sink = threading.local()
+
+class AnalysisCancelled(Exception):
+    """사용자가 분석 작업을 취소한 경우"""
+
+def _notify(kind, msg):
+    """
+    안내 메시지를 표시합니다. kind는 "info", "warning", "success", "error" 중 하나입니다.
+    """
+    messages = getattr(_message_sink, "messages", None)
+    if messages is not None:
+        messages.append((kind, msg))
+    else:
+        getattr(st, kind)(msg)
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise AnalysisCancelled()
 
 # ----------------------- 셀 스타일 복사 -----------------------
 def copy_cell_style(source_cell, target_cell):
@@ -223,21 +245,23 @@ def fill_to_label(fill) -> str:
     return friendly or hx
 
 # ----------------------- 범위(행/열) 계산 -----------------------
-def compute_used_bounds(ws, max_rows_limit=10000, max_cols_limit=100):
+def compute_used_bounds(ws, max_rows_limit=10000, max_cols_limit=100, column_selection=None):
     """
     실제 사용된 행/열 범위를 계산 (대용량 파일 대응)
+    column_selection이 있으면 선택된 열만 확인합니다.
     """
     try:
         # 제한 적용
         max_possible_r = min(ws.max_row, max_rows_limit)
         max_possible_c = min(ws.max_column, max_cols_limit)
+        candidate_cols = selected_columns(column_selection, max_possible_c)
         
         max_r, max_c = 0, 0
         
         # 역순으로 검색하여 최적화
         for r in range(max_possible_r, 0, -1):
             row_has_any = False
-            for c in range(1, max_possible_c + 1):
+            for c in candidate_cols:
                 try:
                     cell = ws.cell(row=r, column=c)
                     if (cell.value not in (None, "")) or _fill_is_nonempty(cell.fill):
@@ -253,7 +277,7 @@ def compute_used_bounds(ws, max_rows_limit=10000, max_cols_limit=100):
         # 최대 열 확인
         if max_r > 0 and max_c == 0:
             for r in range(1, min(max_r + 1, 100)):  # 샘플링
-                for c in range(1, max_possible_c + 1):
+                for c in candidate_cols:
                     try:
                         cell = ws.cell(row=r, column=c)
                         if (cell.value not in (None, "")) or _fill_is_nonempty(cell.fill):
@@ -265,29 +289,289 @@ def compute_used_bounds(ws, max_rows_limit=10000, max_cols_limit=100):
         if max_r == 0:
             max_r = min(ws.max_row, max_rows_limit)
         if max_c == 0:
-            max_c = min(ws.max_column, max_cols_limit)
+            max_c = candidate_cols[-1] if candidate_cols else 0
         
         return max_r, max_c
     except Exception as e:
-        st.warning(f"범위 계산 중 오류 발생, 기본값 사용: {e}")
+        _notify("warning", f"범위 계산 중 오류 발생, 기본값 사용: {e}")
         return min(ws.max_row, max_rows_limit), min(ws.max_column, max_cols_limit)
 
+# ----------------------- 열 선택 -----------------------
+def parse_column_spec(spec):
+    """
+    "A, C:F, AA" 같은 열 지정 문자열을 열 번호(1부터) 튜플로 바꿉니다. 빈 문자열이면 None.
+    """
+    if not spec or not spec.strip():
+        return None
+    indices = set()
+    for token in re.split(r"[,\s]+", spec.strip().upper()):
+        if not token:
+            continue
+        parts = re.split(r"[:\-~]", token)
+        try:
+            if len(parts) == 1:
+                indices.add(column_index_from_string(parts[0]))
+            elif len(parts) == 2:
+                lo, hi = sorted((column_index_from_string(parts[0]), column_index_from_string(parts[1])))
+                indices.update(range(lo, hi + 1))
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"열 지정을 이해할 수 없습니다: '{token}' (예: A, C:F)")
+    return tuple(sorted(indices))
+
+def parse_column_selection(include_spec, ignore_spec):
+    """
+    비교할 열/무시할 열 지정을 (포함 열 튜플 또는 None, 제외 열 튜플)로 바꿉니다. 둘 다 비어 있으면 None.
+    캐시 키에 그대로 쓸 수 있도록 정렬된 튜플을 사용합니다.
+    """
+    include = parse_column_spec(include_spec)
+    ignore = parse_column_spec(ignore_spec) or ()
+    if include is None and not ignore:
+        return None
+    return (include, ignore)
+
+def selected_columns(column_selection, max_c):
+    """1..max_c 중 선택된 열 번호 목록"""
+    if column_selection is None:
+        return list(range(1, max_c + 1))
+    include, ignore = column_selection
+    ignore = set(ignore)
+    candidates = range(1, max_c + 1) if include is None else (c for c in include if c <= max_c)
+    return [c for c in candidates if c not in ignore]
+
 # ----------------------- 정규화 -----------------------
-def normalize_value(v, trim_spaces=True, case_sensitive=True):
-    if isinstance(v, str):
-        s = v.strip() if trim_spaces else v
-        return s if case_sensitive else s.lower()
+NORMALIZATION_DEFAULTS = {
+    "trim_spaces": True,        # 앞뒤 공백 무시
+    "case_sensitive": True,     # 대소문자 구분
+    "canonical_numbers": True,  # 1 / 1.0 / "1" / "1,000" 같은 숫자 표현 통일
+    "canonical_dates": True,    # 자정 datetime과 date, "2024-01-05" / "2024-01-05 09:30" / "09:30" 문자열과 날짜·시각 값 통일
+    "canonical_bools": True,    # "TRUE" / "FALSE" 문자열(CSV 등)과 논리값 통일
+    "collapse_spaces": False,   # 연속 공백/탭/줄바꿈을 공백 하나로
+    "unicode_nfc": True,        # 유니코드 NFC 정규화 (한글 자모 분리 등)
+}
+NORMALIZER_MEMO_LIMIT = 200000
+
+_SPACE_RUN = re.compile(r"\s+")
+_NUMBER_TEXT = re.compile(r"^[+-]?(?:0|[1-9]\d*|[1-9]\d{0,2}(?:,\d{3})+)(?:\.\d+)?$")
+_DATE_TEXT = re.compile(r"^\d{4}-\d{2}-\d{2}(?:[ T]00:00(?::00)?)?$")
+_DATETIME_TEXT = re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?$")
+_TIME_TEXT = re.compile(r"^\d{1,2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?$")
+_BOOL_TEXT = {"TRUE": True, "FALSE": False}
+
+def normalization_options(options):
+    """설정 딕셔너리에서 정규화 관련 옵션만 골라 기본값을 채웁니다."""
+    return {k: options.get(k, v) for k, v in NORMALIZATION_DEFAULTS.items()}
+
+def _canonical_number(v):
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+def build_normalizer(norm_options=None):
+    """
+    정규화 옵션으로부터 정규화 함수를 한 번만 만들어 반환합니다.
+    반환된 함수는 값 목록(한 열 또는 한 행)을 받아 정규화된 값 목록을 돌려주며,
+    이미 본 값은 다시 계산하지 않습니다.
+    """
+    opts = normalization_options(norm_options or {})
+    str_steps = []
+    if opts["unicode_nfc"]:
+        str_steps.append(partial(unicodedata.normalize, "NFC"))
+    if opts["collapse_spaces"]:
+        str_steps.append(partial(_SPACE_RUN.sub, " "))
+    if opts["trim_spaces"]:
+        str_steps.append(str.strip)
+    if not opts["case_sensitive"]:
+        str_steps.append(str.lower)
+    canonical_numbers = opts["canonical_numbers"]
+    canonical_dates = opts["canonical_dates"]
+    canonical_bools = opts["canonical_bools"]
+
+    def normalize_one(v):
+        if isinstance(v, str):
+            for f in str_steps:
+                v = f(v)
+            if canonical_numbers and _NUMBER_TEXT.match(v):
+                return _canonical_number(float(v.replace(",", "")) if ("." in v or "," in v) else int(v))
+            if canonical_dates and _DATE_TEXT.match(v):
+                try:
+                    return date.fromisoformat(v[:10])
+                except ValueError:
+                    return v
+            # 엑셀의 날짜/시간·시각 셀을 텍스트로 내보낸 값 (자정이 아닌 시각)
+            if canonical_dates and _DATETIME_TEXT.match(v):
+                try:
+                    return datetime.fromisoformat(v)
+                except ValueError:
+                    return v
+            if canonical_dates and _TIME_TEXT.match(v):
+                try:
+                    return dt_time.fromisoformat(v if v.index(":") == 2 else "0" + v)
+                except ValueError:
+                    return v
+            if canonical_bools and v.upper() in _BOOL_TEXT:
+                return _BOOL_TEXT[v.upper()]
+            return v
+        if canonical_numbers and isinstance(v, float):
+            return _canonical_number(v)
+        if canonical_dates and isinstance(v, datetime) and v.tzinfo is None and v.time() == dt_time(0):
+            return v.date()
+        return v
+
+    memo = defaultdict(dict)  # 타입 → {값: 정규화 값} (True/1/1.0 처럼 같다고 비교되는 값이 섞이지 않도록 타입별로 구분)
+
+    def normalize(values):
+        if sum(map(len, memo.values())) > NORMALIZER_MEMO_LIMIT:
+            memo.clear()
+        kinds = set(map(type, values))
+        kinds.discard(type(None))
+        if len(kinds) <= 1:
+            # 한 가지 타입만 있는 열: 서로 다른 값만 한 번씩 정규화
+            table = memo[kinds.pop()] if kinds else {}
+            for v in set(values).difference(table):
+                table[v] = normalize_one(v)
+            return list(map(table.__getitem__, values))
+        out = []
+        for v in values:
+            table = memo[type(v)]
+            r = table.get(v, table)
+            if r is table:
+                r = table[v] = normalize_one(v)
+            out.append(r)
+        return out
+
+    return normalize
+
+def column_option_key(value_types, norm_options=None):
+    """
+    열에 들어 있는 값 타입에 실제로 영향을 주는 정규화 옵션만 모은 키입니다.
+    이 키가 같으면 옵션 전체가 달라도 그 열의 정규화 결과는 같습니다 (문자열은 모든 옵션, 실수는 숫자 통일, 날짜/시간은 날짜 통일).
+    """
+    opts = normalization_options(norm_options or {})
+    relevant = set()
+    for t in value_types:
+        if issubclass(t, str):
+            relevant.update(opts)
+        elif issubclass(t, float):
+            relevant.add("canonical_numbers")
+        elif issubclass(t, datetime):
+            relevant.add("canonical_dates")
+    return tuple((k, opts[k]) for k in sorted(relevant))
+
+def raw_column_values(rows, columns):
+    """원본 행 목록을 열별 값 목록으로 모읍니다 (열 단위로 다시 정규화할 때 행 딕셔너리를 매번 훑지 않도록)."""
+    return {col: [r["orig"].get(col) for r in rows] for col in columns}
+
+def normalize_rows(rows, columns, norm_options=None):
+    """
+    행 목록의 "norm"을 열 단위 일괄 정규화로 채웁니다.
+    """
+    normalize = build_normalizer(norm_options)
+    for col in columns:
+        normed = normalize([r["orig"].get(col) for r in rows])
+        for r, v in zip(rows, normed):
+            r["norm"][col] = v
+    return rows
+
+# ----------------------- 행 필터 -----------------------
+ROW_FILTER_OPS = {"같음": "eq", "목록 중 하나": "in", "범위": "range"}
+
+# 필터 값 비교용 정규화 (화면 설정과 무관하게 공백/숫자/날짜 표현 차이는 무시)
+_filter_normalizer = build_normalizer({**NORMALIZATION_DEFAULTS, "trim_spaces": True})
+
+def parse_row_filter(column_text, op_label, value_text):
+    """
+    행 필터 입력을 (열 번호, 연산, 값 튜플)로 바꿉니다. 열이나 값이 비어 있으면 None.
+    "목록 중 하나"는 쉼표로, "범위"는 '최소~최대'로 구분합니다 (한쪽은 비워도 됨).
+    """
+    column_text = (column_text or "").strip().upper()
+    value_text = (value_text or "").strip()
+    if not column_text or not value_text:
+        return None
+    try:
+        col = column_index_from_string(column_text)
+    except ValueError:
+        raise ValueError(f"필터 열을 이해할 수 없습니다: '{column_text}' (예: C)")
+    op = ROW_FILTER_OPS[op_label]
+    if op == "eq":
+        values = (value_text,)
+    elif op == "in":
+        values = tuple(v.strip() for v in value_text.split(",") if v.strip())
+    else:
+        if "~" not in value_text:
+            raise ValueError("범위는 '최소~최대' 형식으로 입력하세요 (예: 100~200, 2024-01-01~)")
+        lo, hi = (v.strip() for v in value_text.split("~", 1))
+        values = (lo, hi)
+    return (col, op, values)
+
+def _filter_value(v):
+    v = _filter_normalizer([v])[0]
+    if isinstance(v, datetime):
+        return v.date()
+    if isinstance(v, bool):
+        return str(v)
     return v
 
+def _range_comparable(a, b):
+    numeric = (int, float)
+    return (isinstance(a, numeric) and isinstance(b, numeric)) or type(a) is type(b)
+
+def build_row_predicate(row_filter):
+    """
+    행 필터로부터 (열 번호, 셀 값 → 포함 여부 함수)를 만듭니다. 필터가 없으면 None.
+    정규화 전 원본 값에 적용하며, 숫자/날짜 문자열은 같은 값으로 봅니다.
+    """
+    if row_filter is None:
+        return None
+    col, op, values = row_filter
+    if op in ("eq", "in"):
+        targets = {_filter_value(v) for v in values}
+        return col, lambda v: _filter_value(v) in targets
+    lo, hi = (_filter_value(v) if v else None for v in values)
+
+    def in_range(v):
+        v = _filter_value(v)
+        if v is None:
+            return False
+        for bound, ok in ((lo, lambda b: v >= b), (hi, lambda b: v <= b)):
+            if bound is not None and not (_range_comparable(v, bound) and ok(bound)):
+                return False
+        return True
+
+    return col, in_range
+
 # ----------------------- 시트 읽기 -----------------------
-def read_sheet_values_and_fills(file, sheet_name=None, trim_spaces=True, case_sensitive=True, max_rows_limit=100000, max_cols_limit=200):
+def derive_rows(raw_rows, columns, norm_options=None):
+    """
+    원본 행({"_row", "orig"}) 목록에서 정규화 값("norm")을 가진 비교용 행 목록을 만듭니다.
+    "orig" 딕셔너리는 복사하지 않고 원본 행과 공유합니다.
+    """
+    rows = [{"_row": r["_row"], "orig": r["orig"], "norm": {}} for r in raw_rows]
+    return normalize_rows(rows, columns, norm_options)
+
+def _private_stream(file):
+    """
+    업로드 파일은 다른 스레드(화면의 시트 목록 읽기 등)와 읽기 위치를 공유하지 않도록 복사본을 만듭니다.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        return file
+    return BytesIO(file.getvalue())
+
+def read_sheet_raw(file, sheet_name=None, max_rows_limit=100000, max_cols_limit=200, progress=None, cancel_event=None,
+                   column_selection=None, row_filter=None):
     """
-    엑셀 시트의 값과 채우기 정보를 읽어옵니다.
+    엑셀 시트의 원본 값과 채우기 정보만 읽어옵니다 (정규화 옵션과 무관).
+    column_selection으로 제외된 열은 아예 읽지 않고, row_filter에 맞지 않는 행은 필터 열만 읽고 건너뜁니다.
+    progress(0~1)로 읽기 진행률을 알리고, cancel_event가 설정되면 AnalysisCancelled를 발생시킵니다.
+    CSV/TSV 파일은 값만 스트리밍으로 읽습니다 (sheet_name 무시, 채우기 없음).
     """
     wb = None
     try:
+        if text_delimiter(file):
+            return read_text_raw(file, max_rows_limit, max_cols_limit, progress, cancel_event, column_selection, row_filter)
         # read_only=False로 열어야 스타일 정보를 읽을 수 있음
-        wb = load_workbook(file, data_only=True, read_only=False)
+        wb = load_workbook(_private_stream(file), data_only=True, read_only=False)
         ws = wb[sheet_name] if sheet_name else wb.active
         
         if ws is None:
@@ -295,33 +579,42 @@ def read_sheet_values_and_fills(file, sheet_name=None, trim_spaces=True, case_se
         
         # 대용량 파일 정보 표시
         if ws.max_row > max_rows_limit:
-            st.info(f"ℹ️ 파일에 {ws.max_row:,}개의 행이 있습니다. 처음 {max_rows_limit:,}개 행만 처리합니다.")
+            _notify("info", f"ℹ️ 파일에 {ws.max_row:,}개의 행이 있습니다. 처음 {max_rows_limit:,}개 행만 처리합니다.")
         if ws.max_column > max_cols_limit:
-            st.info(f"ℹ️ 파일에 {ws.max_column}개의 열이 있습니다. 처음 {max_cols_limit}개 열만 처리합니다.")
+            _notify("info", f"ℹ️ 파일에 {ws.max_column}개의 열이 있습니다. 처음 {max_cols_limit}개 열만 처리합니다.")
         
-        max_r, max_c = compute_used_bounds(ws, max_rows_limit, max_cols_limit)
+        max_r, max_c = compute_used_bounds(ws, max_rows_limit, max_cols_limit, column_selection)
         
         if max_r == 0 or max_c == 0:
             return [], {}, []
         
-        cols = [get_column_letter(c) for c in range(1, max_c + 1)]
+        col_indices = selected_columns(column_selection, max_c)
+        if not col_indices:
+            return [], {}, []
+        cols = [get_column_letter(c) for c in col_indices]
 
         rows = []
         fills = {}
+        predicate = build_row_predicate(row_filter)
+        skipped = 0
         
         for r in range(1, max_r + 1):
+            if r % 1000 == 0:
+                _check_cancelled(cancel_event)
+                if progress is not None:
+                    progress(r / max_r)
             try:
+                if predicate is not None and not predicate[1](ws.cell(row=r, column=predicate[0]).value):
+                    skipped += 1
+                    continue
                 orig = {}
-                norm = {}
                 empty_all = True
                 
-                for c in range(1, max_c + 1):
+                for c, col in zip(col_indices, cols):
                     try:
                         cell = ws.cell(row=r, column=c)
                         v = cell.value
-                        col = get_column_letter(c)
                         orig[col] = v
-                        norm[col] = normalize_value(v, trim_spaces, case_sensitive)
                         
                         # 채우기 정보
                         try:
@@ -333,21 +626,23 @@ def read_sheet_values_and_fills(file, sheet_name=None, trim_spaces=True, case_se
                             empty_all = False
                     except Exception as e:
                         # 개별 셀 오류는 무시
-                        col = get_column_letter(c)
                         orig[col] = None
-                        norm[col] = None
                         fills[(r, c)] = "No Fill"
                 
                 if not empty_all:
-                    rows.append({"_row": r, "orig": orig, "norm": norm})
+                    rows.append({"_row": r, "orig": orig})
             except Exception as e:
-                st.warning(f"행 {r} 처리 중 오류 발생, 건너뜀: {e}")
+                _notify("warning", f"행 {r} 처리 중 오류 발생, 건너뜀: {e}")
                 continue
         
+        if predicate is not None:
+            _notify("info", f"ℹ️ 행 필터 적용: {max_r:,}행 중 {skipped:,}행 제외")
         return rows, fills, cols
     
+    except AnalysisCancelled:
+        raise
     except Exception as e:
-        st.error(f"파일 읽기 실패: {e}")
+        _notify("error", f"파일 읽기 실패: {e}")
         raise
     finally:
         if wb is not None:
@@ -356,14 +651,236 @@ def read_sheet_values_and_fills(file, sheet_name=None, trim_spaces=True, case_se
             except Exception:
                 pass
 
+# ----------------------- CSV/TSV 읽기 -----------------------
+# CSV/TSV 파일은 엑셀로 변환하지 않고 값만 한 행씩 읽습니다. 채우기 정보가 없으므로 모두 "No Fill"로 다룹니다.
+TEXT_DELIMITERS = {".csv": ",", ".tsv": "\t"}
+TEXT_SHEET_NAME = "(텍스트)"  # CSV/TSV 파일의 유일한 시트 이름
+TEXT_ENCODING = os.environ.get("TEXT_ENCODING")  # 비워 두면 UTF-8, 안 되면 CP949로 읽음
+TEXT_SNIFF_BYTES = 1 << 16
+TEXT_CHECK_BLOCK_BYTES = 1 << 20
+
+_text_decode_errors = threading.local()
+
+def _replace_counting(exc):
+    """해석할 수 없는 바이트를 U+FFFD로 바꾸고 개수를 셉니다 (읽는 도중 UnicodeDecodeError로 중단되지 않도록)."""
+    if not isinstance(exc, UnicodeDecodeError):
+        raise exc
+    _text_decode_errors.count = getattr(_text_decode_errors, "count", 0) + 1
+    return "\ufffd", exc.end
+
+codecs.register_error("excel_compare_replace", _replace_counting)
+
+def text_delimiter(file):
+    """CSV/TSV 파일(경로 또는 업로드 파일 이름 기준)이면 구분자, 아니면 None"""
+    name = os.fspath(file) if isinstance(file, (str, os.PathLike)) else (getattr(file, "name", None) or "")
+    return TEXT_DELIMITERS.get(os.path.splitext(name)[1].lower())
+
+def sheet_names(file):
+    """파일의 시트 이름 목록 (CSV/TSV는 TEXT_SHEET_NAME 하나)"""
+    if text_delimiter(file):
+        return [TEXT_SHEET_NAME]
+    wb = load_workbook(_private_stream(file), read_only=True, data_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def _open_binary(file):
+    if isinstance(file, (str, os.PathLike)):
+        return open(file, "rb")
+    return BytesIO(file.getvalue())
+
+def _decodes(stream, encoding, head_only):
+    """stream 내용이 encoding으로 오류 없이 해석되는지 (head_only면 앞부분만) 확인합니다."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        if head_only:
+            # final=False: 앞부분 끝에서 잘린 글자는 오류로 보지 않음
+            decoder.decode(stream.read(TEXT_SNIFF_BYTES), final=False)
+            return True
+        while True:
+            block = stream.read(TEXT_CHECK_BLOCK_BYTES)
+            decoder.decode(block, final=not block)
+            if not block:
+                return True
+    except UnicodeDecodeError:
+        return False
+    finally:
+        stream.seek(0)
+
+def _text_encoding(stream, head_only=False):
+    """
+    인코딩을 고릅니다. 파일 전체가 UTF-8로 해석되면 UTF-8, CP949(엑셀 한글 CSV 기본값)로 해석되면 CP949,
+    둘 다 아니면 UTF-8입니다 (해석할 수 없는 바이트는 읽을 때 U+FFFD로 바뀜).
+    앞부분만 보면 뒤쪽에 섞인 CP949 글자에서 읽는 도중 실패하므로 전체를 블록 단위로 디코딩해 확인합니다
+    (행 분해보다 훨씬 빠름). head_only는 파일 일부만 읽는 표본 추출용으로 앞부분만 봅니다.
+    """
+    if TEXT_ENCODING:
+        return TEXT_ENCODING
+    if _decodes(stream, "utf-8-sig", head_only):
+        return "utf-8-sig"
+    if _decodes(stream, "cp949", head_only):
+        return "cp949"
+    return "utf-8-sig"
+
+def _text_values(record, max_cols_limit, keep, predicate):
+    """
+    CSV 레코드 하나를 원본 값 목록으로 바꿉니다 (빈 칸은 None, 끝의 빈 칸은 제거).
+    row_filter에 맞지 않으면 None, 값이 모두 빈 행이면 빈 목록입니다.
+    """
+    if predicate is not None:
+        col, matches = predicate
+        if not matches((record[col - 1] or None) if col <= len(record) else None):
+            return None
+    values = [v if v != "" else None for v in record[:max_cols_limit]]
+    if keep is not None:
+        values = [v if c in keep else None for c, v in enumerate(values, start=1)]
+    while values and values[-1] is None:
+        values.pop()
+    return values
+
+def iter_text_rows(file, max_rows_limit=100000, max_cols_limit=200, progress=None, cancel_event=None,
+                   column_selection=None, row_filter=None):
+    """
+    CSV/TSV 파일을 한 행씩 읽어 (행 번호, 원본 값 목록)을 생성합니다. 값은 문자열이고 빈 칸은 None입니다.
+    column_selection으로 제외된 열은 None 자리로 두고(열 위치 유지), 값이 모두 빈 행과 row_filter에 맞지 않는 행은 건너뜁니다.
+    """
+    keep = None
+    if column_selection is not None:
+        keep = set(selected_columns(column_selection, max_cols_limit))
+        max_cols_limit = max(keep, default=0)
+    predicate = build_row_predicate(row_filter)
+    binary = _open_binary(file)
+    try:
+        binary.seek(0, os.SEEK_END)
+        total_bytes = binary.tell() or 1
+        binary.seek(0)
+        encoding = _text_encoding(binary)
+        # 고른 인코딩으로도 해석되지 않는 바이트는 중단하지 않고 U+FFFD로 바꾼 뒤 개수를 알림
+        text = TextIOWrapper(binary, encoding=encoding, errors="excel_compare_replace", newline="")
+        _text_decode_errors.count = 0
+        wide_rows = 0
+        for r, record in enumerate(csv.reader(text, delimiter=text_delimiter(file)), start=1):
+            if r > max_rows_limit:
+                _notify("info", f"ℹ️ 파일에 {max_rows_limit:,}개보다 많은 행이 있습니다. 처음 {max_rows_limit:,}개 행만 처리합니다.")
+                break
+            if r % 10000 == 0:
+                _check_cancelled(cancel_event)
+                if progress is not None:
+                    progress(min(binary.tell() / total_bytes, 1.0))
+            values = _text_values(record, max_cols_limit, keep, predicate)
+            if values is None:
+                continue
+            if len(record) > max_cols_limit:
+                wide_rows += 1
+            if values:
+                yield r, values
+        if wide_rows and column_selection is None:
+            _notify("info", f"ℹ️ {wide_rows:,}개 행이 {max_cols_limit}열보다 넓습니다. 처음 {max_cols_limit}개 열만 처리합니다.")
+        if _text_decode_errors.count:
+            _notify("warning", f"⚠️ {encoding}로 해석할 수 없는 바이트 {_text_decode_errors.count:,}곳을 '\ufffd'로 바꿨습니다. "
+                               "TEXT_ENCODING 환경 변수로 인코딩을 지정할 수 있습니다.")
+        if progress is not None:
+            progress(1.0)
+    finally:
+        binary.close()
+
+def read_text_raw(file, max_rows_limit=100000, max_cols_limit=200, progress=None, cancel_event=None,
+                  column_selection=None, row_filter=None):
+    """CSV/TSV 파일을 read_sheet_raw와 같은 형식 (원본 행 목록, 채우기(빈 딕셔너리), 열 목록)으로 읽습니다."""
+    records = list(iter_text_rows(file, max_rows_limit, max_cols_limit, progress, cancel_event,
+                                  column_selection, row_filter))
+    max_c = max((len(values) for _, values in records), default=0)
+    col_indices = selected_columns(column_selection, max_c)
+    if not col_indices:
+        return [], {}, []
+    cols = [get_column_letter(c) for c in col_indices]
+    rows = [{"_row": r, "orig": {col: (values[c - 1] if c <= len(values) else None) for c, col in zip(col_indices, cols)}}
+            for r, values in records]
+    return rows, {}, cols
+
 # ----------------------- 페어링 -----------------------
 def row_tuple(norm_row, columns):
-    return tuple(norm_row.get(col) for col in columns)
+    return tuple(map(norm_row.get, columns))
 
-def best_pairing(new_rows, old_rows, columns, unlimited=False):
+def min_match_columns(n_columns, min_match_ratio):
+    """최소 일치 열 비율을 열 개수로 변환합니다 (최소 1개)."""
+    return max(1, math.ceil(n_columns * min_match_ratio - 1e-9))
+
+def top_k_candidates(old_vals, new_vals, old_indices, new_indices, n_columns, top_k=5, min_eq=1,
+                     max_pairs=None, progress=None, cancel_event=None, checkpoint=None):
+    """
+    기준 행마다 일치 열 수가 가장 많은 비교 행 top_k개만 유지합니다 (메모리 O(n·k)).
+    현재 k번째 후보를 넘을 수 없는 조합은 열 비교 도중 바로 건너뜁니다.
+    checkpoint가 있으면 기준 행 CHECKPOINT_PARTITION_ROWS개마다 부분 결과를 저장하고, 저장된 구간은 건너뜁니다.
+    top_k가 1보다 작으면 1로 봅니다.
+    반환값: [(일치열수, 기준 인덱스, 비교 인덱스), ...]
+    """
+    top_k = max(1, int(top_k))  # 빈 힙에서 heapreplace를 하지 않도록
+    candidates = []
+    check_count = 0
+    start = 0
+    if checkpoint is not None:
+        for part_start, (part_end, part, checked) in checkpoint.load_partitions("candidates"):
+            if part_start != start:
+                break
+            candidates.extend(part)
+            start, check_count = part_end, checked
+    part_start, part_mark = start, len(candidates)
+    total = len(old_indices) * len(new_indices)
+    for idx in range(start, len(old_indices)):
+        i = old_indices[idx]
+        if checkpoint is not None and idx - part_start >= CHECKPOINT_PARTITION_ROWS:
+            checkpoint.save_partition("candidates", part_start, (idx, candidates[part_mark:], check_count))
+            part_start, part_mark = idx, len(candidates)
+        if idx % 100 == 0:
+            _check_cancelled(cancel_event)
+            if progress is not None and total:
+                progress((idx * len(new_indices)) / total)
+        if max_pairs is not None and check_count >= max_pairs:
+            break
+        ov = old_vals[i]
+        heap = []
+        floor = min_eq  # 후보가 되려면 필요한 최소 일치 열 수
+        for j in new_indices:
+            if max_pairs is not None:
+                if check_count >= max_pairs:
+                    break
+                check_count += 1
+            allowed_miss = n_columns - floor
+            miss = 0
+            for a, b in zip(ov, new_vals[j]):
+                if a != b:
+                    miss += 1
+                    if miss > allowed_miss:
+                        break
+            else:
+                eq = n_columns - miss
+                if len(heap) < top_k:
+                    heapq.heappush(heap, (eq, j))
+                else:
+                    heapq.heapreplace(heap, (eq, j))
+                if len(heap) == top_k:
+                    floor = max(min_eq, heap[0][0] + 1)
+        candidates.extend((eq, i, j) for eq, j in heap)
+    else:
+        idx = len(old_indices)
+    if checkpoint is not None and idx > part_start:
+        checkpoint.save_partition("candidates", part_start, (idx, candidates[part_mark:], check_count))
+    return candidates
+
+def best_pairing(new_rows, old_rows, columns, unlimited=False, progress=None, cancel_event=None,
+                 top_k=5, min_match_ratio=0.0, checkpoint=None):
     """
     최적 페어링 알고리즘 (효율적인 해시 기반 + 유사도 계산)
+    유사도 후보는 기준 행마다 상위 top_k개만 유지하며, 일치 열 비율이 min_match_ratio 미만인 조합은 버립니다.
+    progress(0~1)로 유사도 비교 진행률을 알리고, cancel_event가 설정되면 AnalysisCancelled를 발생시킵니다.
+    checkpoint가 있으면 후보 점수를 구간별로, 최종 배정 결과를 통째로 저장하고 저장된 결과를 이어받습니다.
     """
+    if checkpoint is not None:
+        stored = checkpoint.load("pairs")
+        if stored is not None:
+            return stored
     try:
         # 1단계: 해시 기반 빠른 매칭 (정확히 일치하는 행)
         old_hash_map = defaultdict(list)
@@ -387,48 +904,26 @@ def best_pairing(new_rows, old_rows, columns, unlimited=False):
             unmatched_old.extend(indices)
         
         # 2단계: 유사도 기반 매칭 (일치하지 않는 행들)
-        if not unlimited and len(unmatched_old) * len(unmatched_new) > 100000:
-            # 제한 모드: 샘플링하여 처리
+        total_combinations = len(unmatched_old) * len(unmatched_new)
+        max_pairs_to_check = None
+        if not unlimited and total_combinations > 100000:
+            # 제한 모드: 앞쪽 조합만 확인
             max_pairs_to_check = 100000
-            st.info(f"ℹ️ 유사도 비교: {len(unmatched_old)} x {len(unmatched_new)} = {len(unmatched_old) * len(unmatched_new):,}개 조합")
-            st.warning(f"⚠️ 조합이 많아 상위 {max_pairs_to_check:,}개만 확인합니다. '무제한 페어링'을 체크하면 전체를 처리합니다.")
-            
-            # 효율적인 샘플링
-            candidates = []
-            check_count = 0
-            for i in unmatched_old:
-                for j in unmatched_new:
-                    if check_count >= max_pairs_to_check:
-                        break
-                    try:
-                        eq = sum(1 for col in columns if old_rows[i]["norm"].get(col) == new_rows[j]["norm"].get(col))
-                        if eq > 0:
-                            candidates.append((eq, i, j))
-                        check_count += 1
-                    except Exception:
-                        continue
-                if check_count >= max_pairs_to_check:
-                    break
-        else:
+            _notify("info", f"ℹ️ 유사도 비교: {len(unmatched_old)} x {len(unmatched_new)} = {total_combinations:,}개 조합")
+            _notify("warning", f"⚠️ 조합이 많아 상위 {max_pairs_to_check:,}개만 확인합니다. '무제한 페어링'을 체크하면 전체를 처리합니다.")
+        elif total_combinations > 10000:
             # 무제한 모드: 모든 조합 확인
-            if len(unmatched_old) * len(unmatched_new) > 10000:
-                st.info(f"ℹ️ 전체 페어링 진행 중: {len(unmatched_old)} x {len(unmatched_new)} = {len(unmatched_old) * len(unmatched_new):,}개 조합")
-            
-            candidates = []
-            total_combinations = len(unmatched_old) * len(unmatched_new)
-            
-            for idx, i in enumerate(unmatched_old):
-                if idx % 100 == 0 and total_combinations > 50000:
-                    progress = (idx * len(unmatched_new)) / total_combinations
-                    st.text(f"페어링 진행 중... {progress*100:.1f}%")
-                
-                for j in unmatched_new:
-                    try:
-                        eq = sum(1 for col in columns if old_rows[i]["norm"].get(col) == new_rows[j]["norm"].get(col))
-                        if eq > 0:
-                            candidates.append((eq, i, j))
-                    except Exception:
-                        continue
+            _notify("info", f"ℹ️ 전체 페어링 진행 중: {len(unmatched_old)} x {len(unmatched_new)} = {total_combinations:,}개 조합")
+        
+        old_vals = {i: row_tuple(old_rows[i]["norm"], columns) for i in unmatched_old}
+        new_vals = {j: row_tuple(new_rows[j]["norm"], columns) for j in unmatched_new}
+        candidates = top_k_candidates(
+            old_vals, new_vals, unmatched_old, unmatched_new, len(columns),
+            top_k=top_k, min_eq=min_match_columns(len(columns), min_match_ratio),
+            max_pairs=max_pairs_to_check,
+            progress=progress if total_combinations > 50000 else None,
+            cancel_event=cancel_event, checkpoint=checkpoint
+        )
         
         # 3단계: 최적 매칭 선택
         candidates.sort(reverse=True)
@@ -450,14 +945,18 @@ def best_pairing(new_rows, old_rows, columns, unlimited=False):
         
         # 결과 요약
         if exact_matches:
-            st.success(f"✅ 정확히 일치: {len(exact_matches)}쌍")
+            _notify("success", f"✅ 정확히 일치: {len(exact_matches)}쌍")
         if similarity_pairs:
-            st.info(f"ℹ️ 유사도 매칭: {len(similarity_pairs)}쌍")
+            _notify("info", f"ℹ️ 유사도 매칭: {len(similarity_pairs)}쌍")
         
+        if checkpoint is not None:
+            checkpoint.save("pairs", (all_pairs, leftover_old, leftover_new))
         return all_pairs, leftover_old, leftover_new
     
+    except AnalysisCancelled:
+        raise
     except Exception as e:
-        st.error(f"페어링 중 오류 발생: {e}")
+        _notify("error", f"페어링 중 오류 발생: {e}")
         return [], list(range(len(old_rows))), list(range(len(new_rows)))
 
 # ----------------------- 변경 레코드 -----------------------
@@ -470,12 +969,18 @@ def truncate_value(val, max_len=50):
         return s[:max_len] + "..."
     return s
 
-def build_diff_record(old_row, new_row, old_fills, new_fills, columns):
-    """변경 사항을 기록합니다."""
+CELL_CHANGE_COLUMNS = ["기준행", "비교행", "열", "변경종류", "이전 값", "이후 값", "이전 색", "이후 색"]
+
+def build_diff_record(old_row, new_row, old_fills, new_fills, columns, cell_changes=None):
+    """
+    변경 사항을 기록합니다.
+    cell_changes 목록이 주어지면 바뀐 셀마다 (잘리지 않은 원래 값으로) 한 건씩 추가합니다.
+    """
     changes = []
     try:
-        for idx, col in enumerate(columns, start=1):
+        for col in columns:
             try:
+                idx = column_index_from_string(col)
                 r_old = old_row["_row"]
                 r_new = new_row["_row"]
                 ov = old_row["orig"].get(col)
@@ -487,6 +992,9 @@ def build_diff_record(old_row, new_row, old_fills, new_fills, columns):
                 fill_changed = ofill != nfill
 
                 if value_changed or fill_changed:
+                    if cell_changes is not None:
+                        kind = "값+색" if value_changed and fill_changed else ("값" if value_changed else "색")
+                        cell_changes.append((r_old, r_new, col, kind, ov, nv, ofill, nfill))
                     # 값을 잘라서 표시
                     ov_str = truncate_value(ov, 30)
                     nv_str = truncate_value(nv, 30)
@@ -519,158 +1027,3335 @@ def build_diff_record(old_row, new_row, old_fills, new_fills, columns):
             "변경요약": f"처리 오류: {str(e)[:50]}"
         }
 
-# ----------------------- 로컬 폴더에서 파일 가져오기 -----------------------
-def get_excel_files_in_folder(folder_path):
-    """폴더 내의 모든 엑셀 파일 목록 반환"""
-    try:
-        if not folder_path:
-            return []
-        
-        # 경로 정규화
-        folder_path = os.path.normpath(folder_path)
-        
-        if not os.path.exists(folder_path):
-            return []
-        
-        if not os.path.isdir(folder_path):
-            return []
-        
-        path = Path(folder_path)
-        excel_files = []
-        
-        try:
-            excel_files = list(path.glob("*.xlsx")) + list(path.glob("*.xls"))
-        except Exception as e:
-            st.warning(f"파일 검색 중 오류: {e}")
-            return []
-        
-        # 임시 파일 및 숨김 파일 제외
-        excel_files = [f for f in excel_files if not f.name.startswith("~$") and not f.name.startswith(".")]
-        
-        return sorted([f.name for f in excel_files])
-    except Exception as e:
-        st.error(f"폴더 읽기 오류: {e}")
-        return []
+# ----------------------- 내용 해시 트리 -----------------------
+# 행 해시를 블록으로 묶고 블록 해시로 시트 전체 해시(root)를 만드는 Merkle 방식 요약.
+# 블록 경계는 행 해시 값으로 정하므로(내용 기준 분할) 행이 끼어들거나 빠져도 그 주변 블록만 달라집니다.
+DIGEST_BLOCK_MASK = 0x1F        # 행 해시 첫 바이트가 이 비트들에서 0이면 블록 경계 (평균 32행)
+DIGEST_BLOCK_MAX_ROWS = 256
 
-# ----------------------- UI -----------------------
-with st.expander("⚙️ 설정", expanded=True):
-    col_opt1, col_opt2, col_opt3 = st.columns(3)
-    with col_opt1:
-        trim_spaces = st.checkbox("앞뒤 공백 무시", value=True)
-        case_sensitive = st.checkbox("대소문자 구분", value=True)
-    with col_opt2:
-        # 파일 입력 방식 선택
-        input_mode = st.radio("파일 입력 방식", ["로컬 폴더", "파일 업로드"], horizontal=True)
-    with col_opt3:
-        # 처리 제한 설정
-        st.write("**처리 제한 설정**")
-        max_rows = st.number_input("최대 행 수", min_value=1000, max_value=1000000, value=100000, step=1000, 
-                                    help="처리할 최대 행 수 (기본: 100,000행)")
-        max_cols = st.number_input("최대 열 수", min_value=10, max_value=1000, value=200, step=10,
-                                    help="처리할 최대 열 수 (기본: 200열)")
-        unlimited_pairing = st.checkbox("무제한 페어링", value=False, 
-                                        help="체크 시 모든 행을 페어링합니다 (대용량 파일은 느릴 수 있음)")
+def _row_digest(norm):
+    """값 목록의 내용 해시 (뒤쪽 None은 무시)"""
+    values = list(norm)
+    while values and values[-1] is None:
+        values.pop()
+    return hashlib.blake2b(repr(tuple(values)).encode("utf-8"), digest_size=16).digest()
 
-st.subheader("1️⃣ 기준(이전) 파일 선택")
+class DigestTree:
+    """
+    행 해시를 한 개씩 받아 블록 해시와 시트 전체 해시를 점진적으로 계산합니다.
+    파일을 읽는 도중에 add()를 부르고, 다 읽은 뒤 finish()로 root를 확정합니다.
+    """
+    def __init__(self):
+        self.blocks = []    # (시작 위치, 끝 위치, 블록 해시)
+        self.root = None
+        self._hasher = hashlib.blake2b(digest_size=16)
+        self._start = 0
+        self._count = 0
 
-if input_mode == "로컬 폴더":
-    # 현재 작업 디렉토리를 기본값으로 사용
-    default_folder = os.getcwd()
-    folder_path = st.text_input("📁 폴더 경로", value=default_folder, help="엑셀 파일이 있는 폴더 경로를 입력하세요")
-    
-    if folder_path and os.path.exists(folder_path):
-        excel_files = get_excel_files_in_folder(folder_path)
-        
-        if excel_files:
-            c1, c2 = st.columns(2)
-            with c1:
-                selected_old_file = st.selectbox("기준 파일 선택", options=excel_files, key="old_file_select")
-                file_old = os.path.join(folder_path, selected_old_file) if selected_old_file else None
-            with c2:
-                sheet_old = None
-                if file_old:
-                    wb = None
-                    try:
-                        wb = load_workbook(file_old, read_only=True, data_only=True)
-                        if wb and wb.sheetnames:
-                            sheet_old = st.selectbox("시트 선택(기준)", options=wb.sheetnames, index=0, key="old_sheet")
-                        else:
-                            st.error("시트를 찾을 수 없습니다.")
-                    except Exception as e:
-                        st.error(f"기준 파일 시트 읽기 실패: {e}")
-                    finally:
-                        if wb:
-                            try:
-                                wb.close()
-                            except Exception:
-                                pass
-        else:
-            st.warning("⚠️ 선택한 폴더에 엑셀 파일이 없습니다.")
-            file_old = None
-            sheet_old = None
-    else:
-        st.warning("⚠️ 유효한 폴더 경로를 입력하세요.")
-        file_old = None
-        sheet_old = None
-else:
-    # 파일 업로드 방식
-    c1, c2 = st.columns(2)
-    with c1:
-        file_old = st.file_uploader("기준 엑셀 파일", type=["xlsx"], key="old_allcols")
-    with c2:
-        sheet_old = None
-        if file_old:
-            wb = None
-            try:
-                wb = load_workbook(file_old, read_only=True, data_only=True)
-                if wb and wb.sheetnames:
-                    sheet_old = st.selectbox("시트 선택(기준)", options=wb.sheetnames, index=0)
-                else:
-                    st.error("시트를 찾을 수 없습니다.")
-            except Exception as e:
-                st.error(f"기준 파일 시트 읽기 실패: {e}")
-            finally:
-                if wb:
-                    try:
-                        wb.close()
-                    except Exception:
-                        pass
+    def add(self, row_digest):
+        self._hasher.update(row_digest)
+        self._count += 1
+        if row_digest[0] & DIGEST_BLOCK_MASK == 0 or self._count - self._start >= DIGEST_BLOCK_MAX_ROWS:
+            self._close_block()
 
-if st.button("✅ 기준 데이터 저장", type="primary", disabled=not (file_old and sheet_old)):
-    try:
-        with st.spinner("기준 파일을 읽는 중..."):
-            old_rows, old_fills, cols = read_sheet_values_and_fills(
-                file_old, sheet_old, trim_spaces, case_sensitive, max_rows, max_cols
-            )
-            
-            if not old_rows:
-                st.error("❌ 기준 파일에 데이터가 없습니다.")
-            else:
-                st.session_state["old_rows"] = old_rows
-                st.session_state["old_fills"] = old_fills
-                st.session_state["columns"] = cols
-                st.session_state["trim_spaces"] = trim_spaces
-                st.session_state["case_sensitive"] = case_sensitive
+    def _close_block(self):
+        if self._count > self._start:
+            self.blocks.append((self._start, self._count, self._hasher.digest()))
+            self._hasher = hashlib.blake2b(digest_size=16)
+            self._start = self._count
+
+    def finish(self):
+        self._close_block()
+        root = hashlib.blake2b(digest_size=16)
+        for _, _, block_digest in self.blocks:
+            root.update(block_digest)
+        self.root = root.digest()
+        return self
+
+    def __len__(self):
+        return self._count
+
+def digest_tree(rows, columns):
+    """정규화된 행 목록의 해시 트리"""
+    tree = DigestTree()
+    for r in rows:
+        tree.add(_row_digest(row_tuple(r["norm"], columns)))
+    return tree.finish()
+
+def column_digests(rows, columns):
+    """
+    열별 내용 해시 (행 순서 기준) — 어느 열이 바뀌었는지 좁히는 데 사용
+    열 전체를 한 문자열로 만들지 않고 셀 값을 하나씩 해시에 넣습니다 (값 사이는 구분 바이트, repr은 제어 문자를 이스케이프함).
+    """
+    hashers = [(col, hashlib.blake2b(digest_size=16)) for col in columns]
+    for r in rows:
+        norm = r["norm"]
+        for col, h in hashers:
+            h.update(repr(norm.get(col)).encode("utf-8"))
+            h.update(b"\x1f")
+    return {col: h.digest() for col, h in hashers}
+
+def baseline_digest_tree(baseline):
+    """기준 데이터의 해시 트리 (처음 비교할 때 만들어 두고 재사용)"""
+    tree = baseline.get("digests")
+    if tree is None:
+        tree = baseline["digests"] = digest_tree(baseline["rows"], baseline["columns"])
+    return tree
+
+def baseline_column_digests(baseline):
+    """기준 데이터의 열별 내용 해시 (없는 열만 계산해서 채움)"""
+    digests = baseline["column_digests"]
+    missing = [col for col in baseline["columns"] if col not in digests]
+    if missing:
+        digests.update(column_digests(baseline["rows"], missing))
+    return digests
+
+def matching_blocks(old_tree, new_tree):
+    """
+    두 트리에서 해시가 같은 블록을 앞에서부터 짝지어 (기준 시작, 비교 시작, 행 수) 목록을 반환합니다.
+    해시가 같은 블록은 행 해시 순서까지 같으므로 블록 안의 행은 위치대로 짝지을 수 있습니다.
+    """
+    available = defaultdict(list)
+    for start, end, block_digest in reversed(old_tree.blocks):
+        available[block_digest].append((start, end))
+    matched = []
+    for start, end, block_digest in new_tree.blocks:
+        candidates = available.get(block_digest)
+        if candidates:
+            old_start, old_end = candidates.pop()
+            matched.append((old_start, start, end - start))
+    return matched
+
+# ----------------------- 기준 데이터 공유 캐시 -----------------------
+# 여러 세션이 같은 기준 파일을 쓰는 경우 프로세스 전체에서 한 벌만 유지합니다.
+BASELINE_CACHE_MB = int(os.environ.get("BASELINE_CACHE_MB", "1024"))
+
+def file_content_hash(file):
+    """업로드 파일 또는 로컬 경로의 내용 해시(sha256)를 계산합니다."""
+    h = hashlib.sha256()
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    else:
+        h.update(file.getvalue())
+    return h.hexdigest()
+
+def estimate_rows_bytes(rows, fields, extra_per_row=0):
+    """
+    행 목록 중 fields에 해당하는 딕셔너리들의 대략적인 메모리 사용량을 추정합니다 (일부 행 샘플링).
+    """
+    if not rows:
+        return 0
+    sample = rows[:: max(1, len(rows) // 200)]
+    per_row = 0
+    for r in sample:
+        per_row += sys.getsizeof(r)
+        for field in fields:
+            per_row += sys.getsizeof(r[field])
+            for v in r[field].values():
+                per_row += sys.getsizeof(v)
+    return int(len(rows) * (per_row / len(sample) + extra_per_row))
+
+class BaselineRegistry:
+    """
+    세션 간에 공유되는 기준 데이터 저장소입니다.
+    원본 값(파일 내용 해시, 시트, 범위)과 정규화된 파생 데이터(원본 키 + 정규화 옵션)를 따로 저장하며,
+    메모리 한도를 넘으면 가장 오래 쓰지 않은 항목부터 제거합니다 (파생 항목이 쓰고 있는 원본 항목은 제외).
+    """
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()
+        self._pending = {}  # 계산 중인 키 → Future
+        self._sizes = {}    # 키 → 사용량에 반영한 크기
+        self._shares = {}   # 파생 항목 키 → 고정해 둔 원본 항목 키
+        self._pins = Counter()
+        self._lock = threading.Lock()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            baseline = self._entries.get(key)
+            if baseline is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return baseline
+
+    def put(self, key, baseline):
+        """
+        항목을 추가합니다. 한도보다 큰 항목은 저장하지 않고 False를 반환합니다.
+        원본 항목과 값을 공유하는 파생 항목(baseline["shared"] = (원본 키, 원본 항목))은 그 원본 항목을 고정해 두어
+        먼저 제거되지 않게 하고, 그 원본 항목이 캐시에 없으면 원본 크기까지 이 항목의 크기로 계산합니다.
+        """
+        size = baseline.get("nbytes", 0)
+        shared, shared_entry = baseline.get("shared") or (None, None)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if shared is not None and self._entries.get(shared) is not shared_entry:
+                size += shared_entry.get("nbytes", 0)
+                shared = None
+            if size > self.budget_bytes:
+                return False
+            if shared is not None:
+                self._pins[shared] += 1
+            while self.used_bytes + size > self.budget_bytes:
+                victim = next((k for k in self._entries if not self._pins.get(k)), None)
+                if victim is None:
+                    # 남은 항목이 모두 고정되어 있어 자리를 만들 수 없음
+                    if shared is not None:
+                        self._unpin(shared)
+                    return False
+                self._remove(victim)
+                self.evictions += 1
+            self._entries[key] = baseline
+            self._sizes[key] = size
+            if shared is not None:
+                self._shares[key] = shared
+            self.used_bytes += size
+            return True
+
+    def _remove(self, key):
+        """항목 하나를 지우고 그 항목이 고정해 둔 원본 항목을 풀어 줍니다 (lock을 잡은 상태에서 호출)."""
+        del self._entries[key]
+        self.used_bytes -= self._sizes.pop(key)
+        shared = self._shares.pop(key, None)
+        if shared is not None:
+            self._unpin(shared)
+
+    def _unpin(self, key):
+        self._pins[key] -= 1
+        if self._pins[key] <= 0:
+            del self._pins[key]
+
+    def get_or_compute(self, key, compute, on_wait=None):
+        """
+        키가 없으면 compute()로 만들어 저장합니다. 여러 스레드가 같은 키를 동시에 요청하면 한 번만 계산하고
+        나머지는 그 결과를 기다립니다 (기다리는 동안 on_wait()을 주기적으로 호출).
+        계산하던 쪽이 취소되면 기다리던 쪽 중 하나가 이어받아 다시 계산합니다.
+        반환값: (값, 이번 호출에서 직접 계산했는지 여부)
+        """
+        while True:
+            with self._lock:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, False
+                self.misses += 1
+                pending = self._pending.get(key)
+                owner = pending is None
+                if owner:
+                    pending = self._pending[key] = Future()
+            if owner:
+                break
+            while True:
+                try:
+                    return pending.result(timeout=0.5), False
+                except FutureTimeoutError:
+                    if on_wait is not None:
+                        on_wait()
+                except AnalysisCancelled:
+                    # 계산하던 요청의 취소는 이 요청과 무관하므로 처음부터 다시 (필요하면 직접 계산)
+                    break
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.set_exception(e)
+            raise
+        self.put(key, value)
+        with self._lock:
+            self._pending.pop(key, None)
+        pending.set_result(value)
+        return value, True
+
+    def find_related(self, raw_key):
+        """같은 원본 키로 만든 기준 데이터 중 가장 최근에 쓴 것 (적중 통계와 사용 순서에는 반영하지 않음)"""
+        with self._lock:
+            for key in reversed(self._entries):
+                if isinstance(key, tuple) and len(key) == 2 and key[0] == raw_key:
+                    return self._entries[key]
+        return None
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "used_bytes": self.used_bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pinned": len(self._pins),
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+@st.cache_resource
+def get_baseline_registry():
+    """프로세스 전체에서 하나만 존재하는 기준 데이터 저장소"""
+    return BaselineRegistry(BASELINE_CACHE_MB * 1024 * 1024)
+
+# 작업 스레드에서는 st.cache_resource를 호출할 수 없으므로 스크립트 실행 시점에 한 번 받아 둠
+baseline_registry = get_baseline_registry()
+
+class StaleSourceError(ValueError):
+    """저장해 둔 키의 내용 해시와 지금 파일 내용이 달라 그 키로 다시 읽을 수 없는 경우"""
+
+def raw_cache_key(file, sheet_name, max_rows_limit, max_cols_limit, column_selection=None, row_filter=None):
+    return ("raw", file_content_hash(file), sheet_name, int(max_rows_limit), int(max_cols_limit), column_selection, row_filter)
+
+def norm_options_key(norm_options):
+    return tuple(sorted(normalization_options(norm_options).items()))
+
+def baseline_cache_key(file, sheet_name, norm_options, max_rows_limit, max_cols_limit, column_selection=None,
+                       row_filter=None):
+    return (raw_cache_key(file, sheet_name, max_rows_limit, max_cols_limit, column_selection, row_filter),
+            norm_options_key(norm_options))
+
+def check_raw_key(key, sheet_name, max_rows_limit, max_cols_limit, column_selection=None, row_filter=None):
+    """넘겨받은 원본 키가 이번 읽기 설정을 모두 그대로 담고 있는지 확인합니다 (다른 설정으로 읽은 값을 그 키로 저장하지 않도록)."""
+    if tuple(key[2:]) != (sheet_name, int(max_rows_limit), int(max_cols_limit), column_selection, row_filter):
+        raise ValueError("기준 데이터 키와 읽기 설정(시트/행·열 제한/열 선택/행 필터)이 다릅니다.")
+
+def get_or_build_raw(file, sheet_name, max_rows_limit, max_cols_limit, key=None, progress=None, cancel_event=None,
+                     column_selection=None, row_filter=None, verify_source=True, use_checkpoint=False):
+    """
+    공유 저장소에서 시트의 원본 값(정규화 전)을 찾고, 없으면 읽어서 저장합니다.
+    다른 스레드(미리 읽기 등)가 같은 시트를 읽는 중이면 새로 읽지 않고 끝나기를 기다립니다.
+    key를 넘긴 경우 캐시에서 빠진 항목을 파일에서 다시 읽기 전에 내용 해시를 확인하고,
+    그 사이 파일이 바뀌었으면 StaleSourceError를 발생시킵니다 (다른 내용을 옛 키로 저장하지 않도록).
+    use_checkpoint는 사용자가 직접 실행한 분석/저장에서만 켭니다 (미리 읽기/미리보기 등은 체크포인트를 읽거나 쓰지 않음).
+    반환값: (키, {"rows", "fills", "columns", "column_values", "column_types", "nbytes"})
+    """
+    registry = baseline_registry
+    if key is None:
+        key = raw_cache_key(file, sheet_name, max_rows_limit, max_cols_limit, column_selection, row_filter)
+        verify_source = False  # 방금 계산한 해시
+    else:
+        check_raw_key(key, sheet_name, max_rows_limit, max_cols_limit, column_selection, row_filter)
+
+    def compute():
+        # 재시작 후에는 메모리 캐시가 비어 있으므로 디스크에 저장해 둔 읽기 결과부터 확인
+        checkpoint = open_checkpoint(key) if use_checkpoint else None
+        if checkpoint is not None:
+            raw = checkpoint.load("parse")
+            if raw is not None:
+                return raw
+        if verify_source and file_content_hash(file) != key[1]:
+            raise StaleSourceError("파일 내용이 기준 데이터를 저장한 뒤 바뀌었습니다. 기준 데이터를 다시 저장하세요.")
+        rows, fills, cols = read_sheet_raw(file, sheet_name, max_rows_limit, max_cols_limit, progress, cancel_event,
+                                           column_selection, row_filter)
+        column_values = raw_column_values(rows, cols)
+        raw = {
+            "rows": rows,
+            "fills": fills,
+            "columns": cols,
+            "column_values": column_values,
+            "column_types": {col: frozenset(map(type, values)) - {type(None)} for col, values in column_values.items()},
+            "nbytes": estimate_rows_bytes(rows, ["orig"], extra_per_row=8 * len(cols)) + len(fills) * 150,
+        }
+        if checkpoint is not None and rows:
+            checkpoint.save("parse", raw)
+        return raw
+
+    raw, computed = registry.get_or_compute(key, compute, on_wait=partial(_check_cancelled, cancel_event))
+    if computed and raw["rows"] and key not in registry:
+        _notify("warning", "⚠️ 시트 원본 데이터가 캐시 메모리 한도보다 커서 공유 캐시에 저장하지 않았습니다.")
+    return key, raw
+
+def baseline_from_rows(rows, fills, cols, tuples=None):
+    """
+    읽어 둔 행/채우기로 기준 데이터(해시 인덱스 포함)를 만듭니다.
+    행 위치 인덱스, 해시 트리, 열별 해시는 비교할 때 처음 필요해지면 계산합니다
+    (baseline_tuple_indices, baseline_digest_tree, baseline_column_digests).
+    """
+    if tuples is None:
+        tuples = [row_tuple(r["norm"], cols) for r in rows]
+    return {
+        "rows": rows,
+        "fills": fills,
+        "columns": cols,
+        "multiset": Counter(tuples),
+        "tuple_indices": None,
+        "digests": None,
+        "column_digests": {},
+        # 원본 값/채우기 크기는 빼고 정규화 값과 해시 인덱스/해시 트리 비용만 계산 (원본 공유는 BaselineRegistry.put에서 처리)
+        "nbytes": estimate_rows_bytes(rows, ["norm"], extra_per_row=300),
+    }
+
+def baseline_tuple_indices(baseline):
+    """기준 데이터의 행 내용 → 행 인덱스 목록 (처음 쓸 때 만들어 두고 재사용)"""
+    mapping = baseline.get("tuple_indices")
+    if mapping is None:
+        mapping = defaultdict(list)
+        cols = baseline["columns"]
+        for idx, r in enumerate(baseline["rows"]):
+            mapping[row_tuple(r["norm"], cols)].append(idx)
+        baseline["tuple_indices"] = mapping
+    return mapping
+
+def baseline_from_raw(raw, norm_options, previous=None):
+    """
+    원본 항목으로 기준 데이터를 만듭니다. previous(같은 원본을 다른 옵션으로 정규화한 기준 데이터)가 있으면
+    열 옵션 키(column_option_key)가 같은 열은 다시 정규화하지 않고 그 값과 열 해시를 그대로 씁니다.
+    """
+    raw_rows, cols = raw["rows"], raw["columns"]
+    raw_columns = raw.get("column_values") or raw_column_values(raw_rows, cols)
+    types = raw.get("column_types") or {col: set(map(type, values)) - {type(None)} for col, values in raw_columns.items()}
+    option_keys = {col: column_option_key(types[col], norm_options) for col in cols}
+    previous_keys = previous.get("column_option_keys", {}) if previous is not None else {}
+    changed = [col for col in cols if previous_keys.get(col) != option_keys[col]]
+    if previous_keys and not changed:
+        # 이번 옵션 변경과 무관한 시트: 행/해시 인덱스/해시 트리를 모두 그대로 공유
+        return {**previous, "column_option_keys": option_keys}
+
+    normalize = build_normalizer(norm_options)
+    # 순환 참조가 없는 작은 객체를 대량으로 만드는 동안에는 순환 참조 수집(전체 힙 탐색)을 멈춤
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        norm_columns = {col: normalize(raw_columns[col]) if col in changed else previous["norm_columns"][col] for col in cols}
+        tuples = list(zip(*norm_columns.values())) if cols else [()] * len(raw_rows)
+        if previous_keys:
+            norms = [r["norm"].copy() for r in previous["rows"]]
+            for col in changed:
+                for norm, v in zip(norms, norm_columns[col]):
+                    norm[col] = v
+        else:
+            norms = [dict(zip(cols, t)) for t in tuples]
+        rows = [{"_row": r["_row"], "orig": r["orig"], "norm": norm} for r, norm in zip(raw_rows, norms)]
+        baseline = baseline_from_rows(rows, raw["fills"], cols, tuples)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    baseline["norm_columns"] = norm_columns
+    baseline["column_option_keys"] = option_keys
+    baseline["nbytes"] += 8 * len(cols) * len(rows)
+    if previous_keys:
+        baseline["column_digests"].update((col, digest) for col, digest in previous["column_digests"].items()
+                                          if col not in changed)
+    return baseline
+
+def get_or_build_baseline(file, sheet_name, norm_options, max_rows_limit, max_cols_limit, key=None, column_selection=None,
+                          row_filter=None, use_checkpoint=False):
+    """
+    공유 저장소에서 기준 데이터를 찾고, 없으면 만들어서 저장합니다.
+    원본 값이 캐시에 있으면 파일을 다시 읽지 않고 정규화와 해시 인덱스만 다시 계산하며,
+    같은 원본의 다른 옵션 기준 데이터가 캐시에 있으면 이번 옵션 변경과 무관한 열은 그 결과를 재사용합니다.
+    use_checkpoint는 get_or_build_raw와 같습니다.
+    반환된 데이터는 여러 세션이 함께 쓰므로 읽기 전용으로 다뤄야 합니다.
+    """
+    registry = baseline_registry
+    verify_source = key is not None
+    if key is None:
+        key = baseline_cache_key(file, sheet_name, norm_options, max_rows_limit, max_cols_limit, column_selection, row_filter)
+    elif key[1] != norm_options_key(norm_options):
+        raise ValueError("기준 데이터 키와 정규화 옵션이 다릅니다.")
+
+    def compute():
+        _, raw = get_or_build_raw(file, sheet_name, max_rows_limit, max_cols_limit, key=key[0],
+                                  column_selection=column_selection, row_filter=row_filter, verify_source=verify_source,
+                                  use_checkpoint=use_checkpoint)
+        baseline = baseline_from_raw(raw, norm_options, previous=registry.find_related(key[0]))
+        # 원본 값/채우기는 원본 항목과 공유 (원본 항목이 캐시에 없으면 그 크기까지 이 항목에 계산)
+        baseline["shared"] = (key[0], raw)
+        return baseline
+
+    baseline, computed = registry.get_or_compute(key, compute)
+    if computed and baseline["rows"] and key not in registry:
+        _notify("warning", "⚠️ 기준 데이터가 캐시 메모리 한도보다 커서 공유 캐시에 저장하지 않았습니다.")
+    return key, baseline
+
+# ----------------------- 미리 읽기 -----------------------
+# 파일/시트를 고르는 즉시 백그라운드에서 원본 값을 읽어 공유 저장소에 넣어 둡니다.
+# 분석 버튼을 누를 때는 아직 끝나지 않은 쪽만 기다리면 됩니다.
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "2"))
+
+def file_identity(file):
+    """내용 해시를 계산하지 않고 파일을 구분하는 가벼운 식별자"""
+    if isinstance(file, (str, os.PathLike)):
+        st_ = os.stat(file)
+        return ("path", os.path.abspath(file), st_.st_size, st_.st_mtime_ns)
+    return ("upload", getattr(file, "file_id", None) or id(file), getattr(file, "size", None))
+
+class Prefetcher:
+    """시트 원본 값 미리 읽기 작업 관리 (프로세스 전체 공유, 같은 파일/시트는 한 번만 실행)"""
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, ident, fn):
+        with self._lock:
+            future = self._futures.get(ident)
+            if future is None or (future.done() and future.exception() is not None):
+                if len(self._futures) > 256:
+                    self._futures = {k: f for k, f in self._futures.items() if not f.done()}
+                future = self._futures[ident] = self._executor.submit(fn)
+            return future
+
+@st.cache_resource
+def get_prefetcher():
+    """프로세스 전체에서 하나만 존재하는 미리 읽기 관리자"""
+    return Prefetcher(PREFETCH_WORKERS)
+
+prefetcher = get_prefetcher()
+
+def _prefetch_raw(file, sheet_name, max_rows_limit, max_cols_limit, column_selection=None, row_filter=None):
+    # 미리 읽기 중 안내 메시지는 표시할 곳이 없으므로 버림
+    _message_sink.messages = []
+    try:
+        return get_or_build_raw(file, sheet_name, max_rows_limit, max_cols_limit,
+                                column_selection=column_selection, row_filter=row_filter)[0]
+    finally:
+        _message_sink.messages = None
+
+def prefetch_sheet(file, sheet_name, max_rows_limit, max_cols_limit, column_selection=None, row_filter=None):
+    """
+    시트 원본 값 미리 읽기를 시작하고 Future를 반환합니다 (이미 시작했으면 기존 Future).
+    """
+    ident = (file_identity(file), sheet_name, int(max_rows_limit), int(max_cols_limit), column_selection, row_filter)
+    return prefetcher.submit(ident, partial(_prefetch_raw, file, sheet_name, max_rows_limit, max_cols_limit,
+                                            column_selection, row_filter))
+
+def show_prefetch_status(future):
+    if not future.done():
+        st.caption("⏳ 백그라운드에서 미리 읽는 중...")
+    elif future.exception() is not None:
+        st.caption(f"⚠️ 미리 읽기 실패: {future.exception()}")
+    else:
+        st.caption("⚡ 미리 읽기 완료")
+
+# ----------------------- 디스크 사용 모드 (대용량) -----------------------
+# 행/채우기/후보 쌍과 결과 표를 SQLite 파일에 청크 단위로 저장하고, 매칭과 변경 내역 생성을 청크 단위 쿼리로 처리합니다.
+SPILL_DIR = os.environ.get("SPILL_DIR") or None  # 비공개 작업 폴더를 만들 위치 (None = 시스템 임시 폴더)
+SPILL_INSERT_BATCH = 5000
+SPILL_DISPLAY_ROWS = int(os.environ.get("SPILL_DISPLAY_ROWS", "100000"))  # 표마다 화면에 올리는 최대 행 수
+SPILL_BASELINE_LIMIT = 16  # 프로세스가 보관하는 기준 파일 DB 수
+SPILL_RESULT_TTL_S = float(os.environ.get("SPILL_RESULT_TTL_S", "86400"))
+
+class SpillStore:
+    """
+    디스크 사용 모드의 SQLite 파일을 두는 곳입니다 (프로세스 전체 공유).
+    tempfile.mkdtemp로 이 프로세스만 접근할 수 있는(0700) 폴더를 새로 만들어 쓰며,
+    기준 파일 DB는 이 프로세스가 만든 것만 키로 찾아 재사용합니다 (폴더에 미리 있던 파일은 읽지 않음).
+    """
+    def __init__(self, root=None, baseline_limit=SPILL_BASELINE_LIMIT):
+        if root:
+            os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix="excel_compare_spill-", dir=root)
+        self.baseline_limit = baseline_limit
+        self._baselines = OrderedDict()  # 키 → (파일 경로, 메타 정보)
+        self._lock = threading.Lock()
+        atexit.register(shutil.rmtree, self.path, True)
+
+    def new_path(self, kind, suffix=".sqlite"):
+        return os.path.join(self.path, f"{kind}-{uuid.uuid4().hex}{suffix}")
+
+    def baseline(self, key):
+        """이 프로세스가 key로 만든 기준 파일 DB의 (경로, 메타 정보). 없으면 None"""
+        with self._lock:
+            entry = self._baselines.get(key)
+            if entry is None:
+                return None
+            if not os.path.exists(entry[0]):
+                del self._baselines[key]
+                return None
+            self._baselines.move_to_end(key)
+            return entry
+
+    def add_baseline(self, key, path, meta):
+        with self._lock:
+            previous = self._baselines.pop(key, None)
+            self._baselines[key] = (path, meta)
+            stale = [previous[0]] if previous is not None else []
+            while len(self._baselines) > self.baseline_limit:
+                stale.append(self._baselines.popitem(last=False)[1][0])
+        # 이미 열려 있는 연결은 지운 뒤에도 그대로 읽을 수 있음
+        for stale_path in stale:
+            _remove_quietly(stale_path)
+
+    def prune_results(self, max_age_s=SPILL_RESULT_TTL_S):
+        """만든 지 max_age_s가 지난 결과 파일을 지웁니다."""
+        cutoff = time.time() - max_age_s
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                if name.startswith("result-") and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+@st.cache_resource
+def get_spill_store():
+    """프로세스 전체에서 하나만 존재하는 디스크 사용 모드 파일 저장소"""
+    return SpillStore(SPILL_DIR)
+
+spill_store = get_spill_store()
+
+def iter_sheet_rows(file, sheet_name=None, norm_options=None, max_rows_limit=100000, max_cols_limit=200,
+                    progress=None, cancel_event=None, column_selection=None, row_filter=None):
+    """
+    iter_raw_sheet_rows의 각 행에 정규화 값을 붙여 (행 번호, 원본 값, 정규화 값, 채우기 라벨)을 생성합니다.
+    """
+    normalize = build_normalizer(norm_options)
+    for r, orig, fills in iter_raw_sheet_rows(file, sheet_name, max_rows_limit, max_cols_limit, progress,
+                                              cancel_event, column_selection, row_filter):
+        yield r, orig, normalize(orig), fills
+
+def iter_raw_sheet_rows(file, sheet_name=None, max_rows_limit=100000, max_cols_limit=200,
+                        progress=None, cancel_event=None, column_selection=None, row_filter=None):
+    """
+    read_only 모드로 시트를 한 행씩 읽어 (행 번호, 원본 값, 채우기 라벨) 목록을 생성합니다.
+    전체 워크북을 메모리에 올리지 않으며, 값/채우기가 모두 빈 행과 row_filter에 맞지 않는 행은 건너뜁니다.
+    column_selection으로 제외된 열은 값을 꺼내지 않고 None / "No Fill" 자리로 둡니다 (열 위치 유지).
+    """
+    if text_delimiter(file):
+        for r, orig in iter_text_rows(file, max_rows_limit, max_cols_limit, progress, cancel_event,
+                                      column_selection, row_filter):
+            yield r, orig, ["No Fill"] * len(orig)
+        return
+    wb = load_workbook(_private_stream(file), data_only=True, read_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name else wb.active
+        if ws is None:
+            raise ValueError("시트를 찾을 수 없습니다.")
+        total = min(ws.max_row or max_rows_limit, max_rows_limit)
+        keep = None
+        if column_selection is not None:
+            keep = set(selected_columns(column_selection, max_cols_limit))
+            max_cols_limit = max(keep, default=0)
+        predicate = build_row_predicate(row_filter)
+        # 필터 열이 비교 범위 밖이어도 판정을 위해서는 읽어야 함
+        read_cols = max_cols_limit if predicate is None else max(max_cols_limit, predicate[0])
+        for r, cells in enumerate(ws.iter_rows(min_row=1, max_row=max_rows_limit, max_col=read_cols), start=1):
+            if r % 1000 == 0:
+                _check_cancelled(cancel_event)
+                if progress is not None:
+                    progress(min(r / total, 1.0))
+            if predicate is not None:
+                col, matches = predicate
+                if not matches(cells[col - 1].value if col <= len(cells) else None):
+                    continue
+            orig = []
+            fills = []
+            empty_all = True
+            for c, cell in enumerate(cells[:max_cols_limit], start=1):
+                if keep is not None and c not in keep:
+                    orig.append(None)
+                    fills.append("No Fill")
+                    continue
+                v = cell.value
+                fill = getattr(cell, "fill", None)
+                nonempty_fill = _fill_is_nonempty(fill)
+                orig.append(v)
+                fills.append(fill_to_label(fill) if nonempty_fill else "No Fill")
+                if (v not in (None, "")) or nonempty_fill:
+                    empty_all = False
+            if empty_all:
+                continue
+            # 뒤쪽의 값/채우기 없는 열은 저장하지 않음 (비교 시 None으로 채움)
+            while orig and orig[-1] is None and fills[-1] == "No Fill":
+                orig.pop()
+                fills.pop()
+            yield r, orig, fills
+    finally:
+        try:
+            wb.close()
+        except Exception:
+            pass
+
+def _pad(values, n_columns):
+    values = tuple(values)
+    return values + (None,) * (n_columns - len(values))
+
+# 셀 값은 pickle 대신 JSON 텍스트로 저장 (날짜/시각은 태그를 붙인 객체로)
+def _json_default(v):
+    if isinstance(v, datetime):
+        return {"$dt": v.isoformat()}
+    if isinstance(v, date):
+        return {"$d": v.isoformat()}
+    if isinstance(v, dt_time):
+        return {"$t": v.isoformat()}
+    if isinstance(v, timedelta):
+        return {"$td": v.total_seconds()}
+    return str(v)
+
+def _json_hook(obj):
+    if len(obj) == 1:
+        (tag, v), = obj.items()
+        if tag == "$dt":
+            return datetime.fromisoformat(v)
+        if tag == "$d":
+            return date.fromisoformat(v)
+        if tag == "$t":
+            return dt_time.fromisoformat(v)
+        if tag == "$td":
+            return timedelta(seconds=v)
+    return obj
+
+def _dump_values(values):
+    return json.dumps(values, default=_json_default, ensure_ascii=False)
+
+def _load_values(text):
+    return json.loads(text, object_hook=_json_hook)
+
+_SPILL_ROWS_SCHEMA = "(idx INTEGER PRIMARY KEY, row_no INTEGER, digest BLOB, orig TEXT, norm TEXT, fills TEXT)"
+
+def _spill_rows(conn, table, row_iter):
+    """
+    행을 SPILL_INSERT_BATCH개씩 테이블에 기록하고 (행 수, 최대 열 수, 시트 해시)를 반환합니다.
+    """
+    n_rows = 0
+    n_cols = 0
+    batch = []
+    tree = DigestTree()
+    for row_no, orig, norm, fills in row_iter:
+        n_cols = max(n_cols, len(orig))
+        digest = _row_digest(norm)
+        tree.add(digest)
+        batch.append((n_rows, row_no, digest, _dump_values(orig), _dump_values(norm), _dump_values(fills)))
+        n_rows += 1
+        if len(batch) >= SPILL_INSERT_BATCH:
+            conn.executemany(f"INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany(f"INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?)", batch)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_digest ON {table} (digest, idx)")
+    conn.commit()
+    return n_rows, n_cols, tree.finish().root.hex()
+
+def get_or_build_spill_baseline(file, sheet_name, norm_options, max_rows_limit, max_cols_limit, key=None,
+                                progress=None, cancel_event=None, column_selection=None, row_filter=None):
+    """
+    기준 파일을 SQLite 파일로 저장합니다. 이 프로세스가 같은 키로 이미 만든 파일이 있으면 그대로 재사용합니다.
+    반환값: (키, 파일 경로, 메타 정보 {"rows", "n_cols", "root"})
+    """
+    verify_source = key is not None
+    if key is None:
+        key = baseline_cache_key(file, sheet_name, norm_options, max_rows_limit, max_cols_limit, column_selection, row_filter)
+        verify_source = False  # 방금 계산한 해시
+    else:
+        check_raw_key(key[0], sheet_name, max_rows_limit, max_cols_limit, column_selection, row_filter)
+        if key[1] != norm_options_key(norm_options):
+            raise ValueError("기준 데이터 키와 정규화 옵션이 다릅니다.")
+    found = spill_store.baseline(key)
+    if found is not None:
+        return (key, *found)
+    if verify_source and file_content_hash(file) != key[0][1]:
+        raise StaleSourceError("파일 내용이 기준 데이터를 저장한 뒤 바뀌었습니다. 기준 데이터를 다시 저장하세요.")
+
+    path = spill_store.new_path("baseline")
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(f"CREATE TABLE rows {_SPILL_ROWS_SCHEMA}")
+        n_rows, n_cols, root = _spill_rows(conn, "rows", iter_sheet_rows(
+            file, sheet_name, norm_options, max_rows_limit, max_cols_limit,
+            progress=progress, cancel_event=cancel_event, column_selection=column_selection, row_filter=row_filter
+        ))
+    except BaseException:
+        conn.close()
+        _remove_quietly(path)
+        raise
+    conn.close()
+    meta = {"rows": n_rows, "n_cols": n_cols, "root": root}
+    spill_store.add_baseline(key, path, meta)
+    return key, path, meta
+
+def _iter_unmatched(conn, table, exact_column, n_columns, chunk_rows):
+    """
+    정확히 일치하지 않은 행을 chunk_rows개씩 {인덱스: 정규화 튜플}로 읽어옵니다 (키셋 페이지네이션).
+    """
+    last = -1
+    while True:
+        chunk = conn.execute(
+            f"SELECT r.idx, r.norm FROM {table} r WHERE r.idx > ? "
+            f"AND NOT EXISTS (SELECT 1 FROM exact e WHERE e.{exact_column} = r.idx) ORDER BY r.idx LIMIT ?",
+            (last, chunk_rows)
+        ).fetchall()
+        if not chunk:
+            return
+        last = chunk[-1][0]
+        yield {idx: _pad(_load_values(norm), n_columns) for idx, norm in chunk}
+
+# 결과 표 이름 → (결과 파일의 테이블, 열 정의). 테이블 열 이름은 결과 표의 열 이름과 같음
+SPILL_RESULT_TABLES = {
+    "df_unchanged": ("unchanged", '"기준행" INTEGER, "비교행" INTEGER, "상태" TEXT'),
+    "df_changes": ("changes", '"기준행" INTEGER, "비교행" INTEGER, "일치열수" INTEGER, "변경요약" TEXT, "상태" TEXT'),
+    "df_cell_changes": ("cell_changes", ", ".join(f'"{c}"' for c in CELL_CHANGE_COLUMNS)),
+    "df_removed": ("removed", '"기준행" INTEGER, "상태" TEXT'),
+    "df_added": ("added", '"비교행" INTEGER, "상태" TEXT'),
+}
+_SPILL_VALUE_COLUMNS = ("이전 값", "이후 값")  # 셀 단위 변경 내역 중 JSON으로 저장하는 열
+
+def _decode_result_values(name, df):
+    if name == "df_cell_changes":
+        for col in _SPILL_VALUE_COLUMNS:
+            df[col] = df[col].map(_load_values)
+    return df
+
+def spill_result_frames(path, limit=SPILL_DISPLAY_ROWS):
+    """
+    결과 파일에서 표마다 처음 limit행만 읽어 결과 표들을 만듭니다.
+    전체 건수는 "result_counts", 결과 파일 경로는 "result_store"에 담습니다.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        frames = {"result_store": path, "result_counts": {}}
+        for name, (table, _) in SPILL_RESULT_TABLES.items():
+            frames["result_counts"][name] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            frames[name] = _decode_result_values(
+                name, pd.read_sql_query(f"SELECT * FROM {table} ORDER BY rowid LIMIT ?", conn, params=(limit,)))
+    finally:
+        conn.close()
+    return frames
+
+def iter_spill_result(path, name, chunk_rows):
+    """결과 파일에서 결과 표 하나를 chunk_rows행씩 차례로 읽습니다."""
+    conn = sqlite3.connect(path)
+    try:
+        table = SPILL_RESULT_TABLES[name][0]
+        for chunk in pd.read_sql_query(f"SELECT * FROM {table} ORDER BY rowid", conn, chunksize=chunk_rows):
+            yield _decode_result_values(name, chunk)
+    finally:
+        conn.close()
+
+def run_comparison_spill(old_file, old_sheet, baseline_key, new_file, new_sheet, options, report=None, cancel_event=None):
+    """
+    디스크 사용 모드의 비교. run_comparison과 같은 결과 표를 반환하지만,
+    메모리에는 설정한 예산 안의 청크만 올리고 결과는 결과 파일에 차례로 기록합니다.
+    결과 표에는 표마다 처음 SPILL_DISPLAY_ROWS행만 담습니다 (전체는 "result_store" 파일).
+    """
+    def step(pct, text):
+        _check_cancelled(cancel_event)
+        if report is not None:
+            report(pct, text)
+
+    budget_bytes = int(options.get("memory_budget_mb", 512)) * 1024 * 1024
+
+    step(5, "📦 기준 데이터 준비 중...")
+    _, base_path, base_meta = get_or_build_spill_baseline(
+        old_file, old_sheet, options,
+        options["max_rows"], options["max_cols"], key=baseline_key, cancel_event=cancel_event,
+        column_selection=options.get("column_selection"), row_filter=options.get("row_filter")
+    )
+
+    spill_store.prune_results()
+    work_path = spill_store.new_path("work")
+    result_path = spill_store.new_path("result")
+    conn = sqlite3.connect(work_path)
+    finished = False
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        # SQLite 페이지 캐시도 예산의 1/4 이내로 제한 (음수 = KiB 단위)
+        conn.execute(f"PRAGMA cache_size=-{max(2048, budget_bytes // 4 // 1024)}")
+        conn.execute("ATTACH DATABASE ? AS base", (base_path,))
+        conn.execute("ATTACH DATABASE ? AS res", (result_path,))
+        conn.execute("PRAGMA res.journal_mode=OFF")
+        for table, schema in SPILL_RESULT_TABLES.values():
+            conn.execute(f"CREATE TABLE res.{table} ({schema})")
+        conn.execute(f"CREATE TABLE new_rows {_SPILL_ROWS_SCHEMA}")
+
+        step(10, "📖 비교 파일을 읽는 중...")
+        n_new, new_cols, new_root = _spill_rows(conn, "new_rows", iter_sheet_rows(
+            new_file, new_sheet, options, options["max_rows"], options["max_cols"],
+            progress=lambda f: step(10 + int(f * 15), f"📖 비교 파일을 읽는 중... {f*100:.0f}%"),
+            cancel_event=cancel_event, column_selection=options.get("column_selection"), row_filter=options.get("row_filter")
+        ))
+        if not n_new:
+            raise ValueError("비교 파일에 데이터가 없습니다.")
+        if base_meta.get("root") == new_root and base_meta["rows"] == n_new:
+            _notify("info", "ℹ️ 기준 데이터와 내용이 같습니다 (시트 해시 일치) — 행 비교를 건너뜁니다.")
+            conn.execute("INSERT INTO res.unchanged SELECT o.row_no, n.row_no, ? FROM new_rows n "
+                         "JOIN base.rows o ON o.idx = n.idx ORDER BY n.idx", ("동일(재정렬만)",))
+            conn.commit()
+            finished = True
+            step(100, "✅ 분석 완료!")
+            return spill_result_frames(result_path)
+        n_columns = max(base_meta["n_cols"], new_cols)
+        columns = [get_column_letter(c) for c in range(1, n_columns + 1)]
+        # 제외된 열은 양쪽 모두 None 자리라 항상 일치로 세어지므로, 일치 열 수에서 그만큼 보정
+        active_columns = [get_column_letter(c) for c in selected_columns(options.get("column_selection"), n_columns)]
+        n_ignored = n_columns - len(active_columns)
+
+        step(30, "🔄 동일한 행 매칭 중...")
+        # 같은 해시끼리 순서대로 짝지음 (메모리 모드의 멀티셋 매칭과 동일)
+        conn.execute("""
+            CREATE TABLE exact AS
+            WITH o AS (SELECT idx, digest, ROW_NUMBER() OVER (PARTITION BY digest ORDER BY idx) AS rn FROM base.rows),
+                 n AS (SELECT idx, digest, ROW_NUMBER() OVER (PARTITION BY digest ORDER BY idx) AS rn FROM new_rows)
+            SELECT o.idx AS old_idx, n.idx AS new_idx FROM n JOIN o ON o.digest = n.digest AND o.rn = n.rn
+        """)
+        conn.execute("CREATE INDEX exact_old ON exact (old_idx)")
+        conn.execute("CREATE INDEX exact_new ON exact (new_idx)")
+        conn.execute("CREATE TABLE cand (eq INTEGER, old_idx INTEGER, new_idx INTEGER)")
+        conn.commit()
+
+        step(40, "🔍 변경된 행 매칭 중...")
+        n_old_left = conn.execute("SELECT COUNT(*) FROM base.rows r WHERE NOT EXISTS (SELECT 1 FROM exact e WHERE e.old_idx = r.idx)").fetchone()[0]
+        n_new_left = conn.execute("SELECT COUNT(*) FROM new_rows r WHERE NOT EXISTS (SELECT 1 FROM exact e WHERE e.new_idx = r.idx)").fetchone()[0]
+        total_combinations = n_old_left * n_new_left
+        max_pairs = None
+        if not options["unlimited_pairing"] and total_combinations > 100000:
+            max_pairs = 100000
+            _notify("warning", f"⚠️ 조합이 많아 상위 {max_pairs:,}개만 확인합니다. '무제한 페어링'을 체크하면 전체를 처리합니다.")
+        elif total_combinations > 10000:
+            _notify("info", f"ℹ️ 전체 페어링 진행 중: {n_old_left} x {n_new_left} = {total_combinations:,}개 조합")
+
+        # 기준/비교 청크 두 개가 예산 안에 들어가도록 청크 크기 결정
+        row_bytes = 200 + n_columns * 80
+        chunk_rows = max(500, budget_bytes // (2 * row_bytes))
+        top_k = int(options.get("pairing_top_k", 5))
+        min_eq = min_match_columns(len(active_columns), options.get("min_match_ratio", 0.0)) + n_ignored
+        checked = 0
+        done_old = 0
+        for old_chunk in _iter_unmatched(conn, "base.rows", "old_idx", n_columns, chunk_rows):
+            if max_pairs is not None and checked >= max_pairs:
+                break
+            heaps = defaultdict(list)
+            for new_chunk in _iter_unmatched(conn, "new_rows", "new_idx", n_columns, chunk_rows):
+                remaining = None if max_pairs is None else max_pairs - checked
+                if remaining is not None and remaining <= 0:
+                    break
+                found = top_k_candidates(
+                    old_chunk, new_chunk, list(old_chunk), list(new_chunk), n_columns,
+                    top_k=top_k, min_eq=min_eq, max_pairs=remaining, cancel_event=cancel_event
+                )
+                if remaining is not None:
+                    checked += min(remaining, len(old_chunk) * len(new_chunk))
+                # 청크별 상위 k개를 합쳐 행별 전체 상위 k개 유지
+                for eq, i, j in found:
+                    heap = heaps[i]
+                    if len(heap) < top_k:
+                        heapq.heappush(heap, (eq, j))
+                    elif (eq, j) > heap[0]:
+                        heapq.heapreplace(heap, (eq, j))
+            conn.executemany("INSERT INTO cand VALUES (?, ?, ?)", [(eq, i, j) for i, heap in heaps.items() for eq, j in heap])
+            conn.commit()
+            done_old += len(old_chunk)
+            if n_old_left:
+                step(40 + int(done_old / n_old_left * 25), f"🔍 변경된 행 매칭 중... {done_old / n_old_left * 100:.1f}%")
+
+        step(65, "🔗 최적 매칭 선택 중...")
+        conn.execute("CREATE TABLE pairs (old_idx INTEGER, new_idx INTEGER, eq INTEGER)")
+        # 배정 여부는 행마다 1바이트 (집합 대신), 배정한 쌍은 SPILL_INSERT_BATCH개씩 바로 기록
+        used_old = bytearray(base_meta["rows"])
+        used_new = bytearray(n_new)
+        batch = []
+        for eq, i, j in conn.execute("SELECT eq, old_idx, new_idx FROM cand ORDER BY eq DESC, old_idx DESC, new_idx DESC"):
+            if used_old[i] or used_new[j]:
+                continue
+            used_old[i] = used_new[j] = 1
+            batch.append((i, j, eq))
+            if len(batch) >= SPILL_INSERT_BATCH:
+                conn.executemany("INSERT INTO pairs VALUES (?, ?, ?)", batch)
+                batch = []
+        conn.executemany("INSERT INTO pairs VALUES (?, ?, ?)", batch)
+        del used_old, used_new, batch
+        conn.execute("CREATE INDEX pairs_old ON pairs (old_idx)")
+        conn.execute("CREATE INDEX pairs_new ON pairs (new_idx)")
+        conn.commit()
+        _notify("info", f"ℹ️ 정확히 일치 {conn.execute('SELECT COUNT(*) FROM exact').fetchone()[0]:,}쌍, "
+                        f"유사도 매칭 {conn.execute('SELECT COUNT(*) FROM pairs').fetchone()[0]:,}쌍 (디스크 사용 모드)")
+
+        step(70, "📊 변경 내역 생성 중...")
+        cursor = conn.execute("""
+            SELECT p.eq, o.row_no, o.orig, o.norm, o.fills, n.row_no, n.orig, n.norm, n.fills
+            FROM pairs p JOIN base.rows o ON o.idx = p.old_idx JOIN new_rows n ON n.idx = p.new_idx
+            ORDER BY p.eq DESC, p.old_idx DESC, p.new_idx DESC
+        """)
+        while True:
+            chunk = cursor.fetchmany(SPILL_INSERT_BATCH)
+            if not chunk:
+                break
+            _check_cancelled(cancel_event)
+            changes_records = []
+            cell_records = [] if options.get("collect_cell_changes") else None
+            for eq, o_no, o_orig, o_norm, o_fills, n_no, n_orig, n_norm, n_fills in chunk:
+                old_row = {"_row": o_no, "orig": dict(zip(columns, _load_values(o_orig))), "norm": dict(zip(columns, _load_values(o_norm)))}
+                new_row = {"_row": n_no, "orig": dict(zip(columns, _load_values(n_orig))), "norm": dict(zip(columns, _load_values(n_norm)))}
+                old_fills = {(o_no, c): label for c, label in enumerate(_load_values(o_fills), start=1)}
+                new_fills = {(n_no, c): label for c, label in enumerate(_load_values(n_fills), start=1)}
+                rec = build_diff_record(old_row, new_row, old_fills, new_fills, active_columns, cell_records)
+                changes_records.append((rec["기준행"], rec["비교행"], eq - n_ignored, rec["변경요약"], "변경"))
+            conn.executemany("INSERT INTO res.changes VALUES (?, ?, ?, ?, ?)", changes_records)
+            if cell_records:
+                conn.executemany("INSERT INTO res.cell_changes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+                    (r_old, r_new, col, kind, _dump_values(ov), _dump_values(nv), ofill, nfill)
+                    for r_old, r_new, col, kind, ov, nv, ofill, nfill in cell_records
+                ])
+
+        step(85, "✨ 결과 정리 중...")
+        conn.execute("INSERT INTO res.unchanged SELECT o.row_no, n.row_no, ? FROM exact e "
+                     "JOIN base.rows o ON o.idx = e.old_idx JOIN new_rows n ON n.idx = e.new_idx ORDER BY e.new_idx",
+                     ("동일(재정렬만)",))
+        conn.execute("INSERT INTO res.removed SELECT r.row_no, ? FROM base.rows r "
+                     "WHERE NOT EXISTS (SELECT 1 FROM exact e WHERE e.old_idx = r.idx) "
+                     "AND NOT EXISTS (SELECT 1 FROM pairs p WHERE p.old_idx = r.idx) ORDER BY r.idx", ("제거됨",))
+        conn.execute("INSERT INTO res.added SELECT r.row_no, ? FROM new_rows r "
+                     "WHERE NOT EXISTS (SELECT 1 FROM exact e WHERE e.new_idx = r.idx) "
+                     "AND NOT EXISTS (SELECT 1 FROM pairs p WHERE p.new_idx = r.idx) ORDER BY r.idx", ("추가됨",))
+        conn.commit()
+        finished = True
+        step(100, "✅ 분석 완료!")
+        return spill_result_frames(result_path)
+    finally:
+        conn.close()
+        _remove_quietly(work_path)
+        if not finished:
+            _remove_quietly(result_path)
+
+# ----------------------- 분석 체크포인트 -----------------------
+# 단계별 중간 결과를 디스크에 저장해 두어, 세션이 다시 실행되거나 컨테이너가 재시작되어도
+# 같은 입력(파일 내용 해시)과 옵션으로 다시 분석하면 마지막으로 끝난 단계부터 이어서 진행합니다.
+# 파일은 pickle이므로 이 사용자만 접근할 수 있는(0700) 폴더에 두고, 비밀 키로 만든 HMAC이 맞는 파일만 읽습니다.
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR") or os.path.join(os.path.expanduser("~"), ".excel_compare", "checkpoints")
+CHECKPOINT_KEY_FILE = (os.environ.get("CHECKPOINT_KEY_FILE")
+                       or os.path.join(os.path.expanduser("~"), ".excel_compare", "checkpoint.key"))
+CHECKPOINT_ENABLED = os.environ.get("CHECKPOINT_ENABLED", "1") != "0"
+CHECKPOINT_KEEP_HOURS = float(os.environ.get("CHECKPOINT_KEEP_HOURS", "48"))
+CHECKPOINT_PARTITION_ROWS = 2000  # 유사도 비교 중 기준 행 이만큼마다 부분 결과 저장
+CHECKPOINT_PENDING_LIMIT = 8      # 백그라운드 쓰기를 기다리는 최대 파일 수 (넘으면 분석 스레드가 기다림)
+CHECKPOINT_STAGES = {
+    "parse": "파일 읽기",
+    "exact": "동일 행 매칭",
+    "candidates": "후보 점수 계산",
+    "pairs": "행 배정",
+    "frames": "변경 내역 생성",
+}
+
+def _private_dir(path):
+    """path 폴더를 이 사용자 전용(0700)으로 만들거나 확인합니다. 다른 사용자가 소유한 폴더면 PermissionError"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if hasattr(os, "getuid"):
+        st_ = os.stat(path)
+        if st_.st_uid != os.getuid():
+            raise PermissionError(f"다른 사용자가 소유한 폴더입니다: {path}")
+        if st_.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    return path
+
+def _checkpoint_secret():
+    """체크포인트 HMAC 키 (CHECKPOINT_KEY_FILE, 없으면 0600으로 새로 만듦)"""
+    _private_dir(os.path.dirname(CHECKPOINT_KEY_FILE) or ".")
+    try:
+        fd = os.open(CHECKPOINT_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        if hasattr(os, "getuid"):
+            st_ = os.stat(CHECKPOINT_KEY_FILE)
+            if st_.st_uid != os.getuid() or st_.st_mode & 0o077:
+                raise PermissionError(f"체크포인트 키 파일의 소유자/권한이 안전하지 않습니다: {CHECKPOINT_KEY_FILE}")
+        with open(CHECKPOINT_KEY_FILE, "rb") as f:
+            secret = f.read()
+        if len(secret) < 32:
+            raise ValueError(f"체크포인트 키 파일이 올바르지 않습니다: {CHECKPOINT_KEY_FILE}")
+        return secret
+    secret = os.urandom(32)
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    return secret
+
+class CheckpointWriter:
+    """
+    체크포인트 파일을 백그라운드 스레드 하나에서 순서대로 씁니다 (프로세스 전체 공유).
+    분석 스레드는 직렬화만 하고 넘기며, 밀린 파일이 CHECKPOINT_PENDING_LIMIT개를 넘으면 그때만 기다립니다.
+    """
+    def __init__(self, max_pending=CHECKPOINT_PENDING_LIMIT):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.failures = 0
+        threading.Thread(target=self._run, name="checkpoint-writer", daemon=True).start()
+
+    def submit(self, path, data):
+        self._queue.put((path, data))
+
+    def flush(self):
+        """지금까지 넘긴 파일을 모두 쓸 때까지 기다립니다."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            path, data = self._queue.get()
+            try:
+                _private_dir(os.path.dirname(path))
+                tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+                with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                # 체크포인트는 없어도 분석 결과에는 영향이 없으므로 건너뜀
+                self.failures += 1
+            finally:
+                self._queue.task_done()
+
+@st.cache_resource
+def get_checkpoint_writer():
+    """프로세스 전체에서 하나만 존재하는 체크포인트 쓰기 스레드"""
+    return CheckpointWriter()
+
+checkpoint_writer = get_checkpoint_writer()
+
+class AnalysisCheckpoint:
+    """
+    분석 한 건의 단계별 중간 결과 저장소입니다 (단계마다 파일 하나: HMAC 32바이트 + pickle).
+    디렉터리 이름은 입력 키(파일 내용 해시 + 옵션)에서 정해지므로 입력/옵션이 같은 실행만 이어받습니다.
+    HMAC은 디렉터리와 단계 이름까지 포함해 계산하므로 다른 실행/단계의 파일로 바꿔 넣어도 읽지 않습니다.
+    """
+    def __init__(self, run_key, secret, root=None):
+        self.name = hashlib.sha1(repr(run_key).encode("utf-8")).hexdigest()
+        self.path = os.path.join(root or CHECKPOINT_DIR, self.name)
+        self._secret = secret
+        self.resumed = []  # 이번 실행에서 불러온 단계
+
+    def _file(self, stage):
+        return os.path.join(self.path, f"{stage}.pickle")
+
+    def _mac(self, stage, payload):
+        return hmac.new(self._secret, f"{self.name}/{stage}\0".encode("utf-8") + payload, hashlib.sha256).digest()
+
+    def load(self, stage):
+        """저장된 단계 결과를 반환합니다. 없거나 읽을 수 없거나 HMAC이 맞지 않으면 None"""
+        try:
+            with open(self._file(stage), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        mac, payload = data[:32], data[32:]
+        if not hmac.compare_digest(mac, self._mac(stage, payload)):
+            return None
+        try:
+            value = pickle.loads(payload)
+        except Exception:
+            return None
+        self.resumed.append(stage.split(".")[0])
+        return value
+
+    def save(self, stage, value):
+        # 이후에 값이 바뀌어도 저장 내용이 섞이지 않도록 직렬화는 여기서, 파일 쓰기는 백그라운드에서
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        checkpoint_writer.submit(self._file(stage), self._mac(stage, payload) + payload)
+
+    def save_partition(self, stage, start, value):
+        self.save(f"{stage}.{start:010d}", value)
+
+    def load_partitions(self, stage):
+        """stage의 부분 결과들을 시작 위치 순으로 [(시작, 값), ...] 반환합니다."""
+        try:
+            names = sorted(n for n in os.listdir(self.path) if n.startswith(f"{stage}.") and n.endswith(".pickle"))
+        except FileNotFoundError:
+            return []
+        parts = []
+        for name in names:
+            value = self.load(name[:-len(".pickle")])
+            if value is None:
+                break
+            parts.append((int(name[len(stage) + 1:-len(".pickle")]), value))
+        return parts
+
+    def resumed_labels(self):
+        return [CHECKPOINT_STAGES.get(s, s) for s in dict.fromkeys(self.resumed)]
+
+def open_checkpoint(run_key):
+    """
+    체크포인트를 쓰도록 설정된 경우에만 저장소를 반환합니다.
+    전용 폴더나 키를 안전하게 준비할 수 없으면 경고하고 체크포인트 없이 진행합니다.
+    """
+    if not CHECKPOINT_ENABLED:
+        return None
+    try:
+        _private_dir(CHECKPOINT_DIR)
+        return AnalysisCheckpoint(run_key, _checkpoint_secret())
+    except (OSError, ValueError) as e:
+        _notify("warning", f"⚠️ 체크포인트를 사용하지 않습니다: {e}")
+        return None
+
+def prune_checkpoints(max_age_hours=CHECKPOINT_KEEP_HOURS, root=None):
+    """마지막 수정 후 max_age_hours가 지난 체크포인트를 지웁니다. 지운 개수를 반환합니다."""
+    root = root or CHECKPOINT_DIR
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+def checkpoint_usage(root=None):
+    """(체크포인트 개수, 전체 크기 바이트)"""
+    root = root or CHECKPOINT_DIR
+    count = total = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        if dirpath == root:
+            count = len(dirnames)
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return count, total
+
+# ----------------------- 분석 실행 -----------------------
+def run_comparison(old_file, old_sheet, baseline_key, new_file, new_sheet, options, report=None, cancel_event=None):
+    """
+    기준 데이터와 비교 파일을 비교하여 결과 표(DataFrame)들을 반환합니다.
+    report(진행률 0~100, 단계 설명)로 진행 상황을 알리고, cancel_event가 설정되면 중단합니다.
+    """
+    if options.get("spill_mode"):
+        return run_comparison_spill(old_file, old_sheet, baseline_key, new_file, new_sheet, options, report, cancel_event)
+
+    def step(pct, text):
+        _check_cancelled(cancel_event)
+        if report is not None:
+            report(pct, text)
+
+    prune_checkpoints()
+    step(5, "📦 기준 데이터 준비 중...")
+    baseline_key, baseline = get_or_build_baseline(
+        old_file, old_sheet, options,
+        options["max_rows"], options["max_cols"], key=baseline_key,
+        column_selection=options.get("column_selection"), row_filter=options.get("row_filter"), use_checkpoint=True
+    )
+
+    step(10, "📖 비교 파일을 읽는 중...")
+    # 비교 파일도 원본 값을 캐시해 두어, 옵션만 바꿔 다시 분석할 때는 정규화만 다시 함
+    new_key, new_raw = get_or_build_raw(
+        new_file, new_sheet, options["max_rows"], options["max_cols"],
+        progress=lambda f: step(10 + int(f * 15), f"📖 비교 파일을 읽는 중... {f*100:.0f}%"),
+        cancel_event=cancel_event, column_selection=options.get("column_selection"), row_filter=options.get("row_filter"),
+        use_checkpoint=True
+    )
+    new_fills, cols_new = new_raw["fills"], new_raw["columns"]
+    new_rows = derive_rows(new_raw["rows"], cols_new, options)
+    if not new_rows:
+        raise ValueError("비교 파일에 데이터가 없습니다.")
+    # 두 입력의 키(내용 해시 + 읽기/정규화 옵션)와 페어링 옵션이 같을 때만 이전 실행의 단계를 이어받음
+    checkpoint = open_checkpoint((
+        "run", baseline_key, new_key, bool(options["unlimited_pairing"]),
+        int(options.get("pairing_top_k", 5)), float(options.get("min_match_ratio", 0.0)),
+        bool(options.get("collect_cell_changes"))
+    ))
+    frames = compare_with_baseline(baseline, new_rows, new_fills, cols_new, options, step, cancel_event, checkpoint)
+    if checkpoint is not None and checkpoint.resumed:
+        _notify("info", f"♻️ 저장된 체크포인트에서 이어서 분석했습니다 (불러온 단계: {', '.join(checkpoint.resumed_labels())})")
+    return frames
+
+def identical_frames(df_unchanged):
+    """모든 행이 그대로인 경우의 결과 표 (df_unchanged: 기준행/비교행 열)"""
+    df_unchanged["상태"] = "동일(재정렬만)"
+    return {
+        "df_unchanged": df_unchanged,
+        "df_changes": pd.DataFrame([], columns=["기준행","비교행","일치열수","변경요약","상태"]),
+        "df_cell_changes": pd.DataFrame([], columns=CELL_CHANGE_COLUMNS),
+        "df_removed": pd.DataFrame([]),
+        "df_added": pd.DataFrame([]),
+        "result_store": None,
+        "result_counts": None,
+    }
+
+def result_count(frames, name):
+    """결과 표의 전체 건수 (디스크 사용 모드는 표에 처음 일부만 담으므로 결과 파일의 건수)"""
+    counts = frames.get("result_counts") or {}
+    return counts.get(name, len(frames[name]))
+
+def _match_exact_rows(baseline, old_tree, new_tree, new_rows, cols_new, columns, cancel_event=None):
+    """
+    해시가 같은 블록과 내용이 완전히 같은 행을 짝지어
+    (exact_pairs [(기준 인덱스, 비교 인덱스)], 남은 기준 인덱스 집합, 남은 비교 인덱스 집합)을 반환합니다.
+    """
+    old_rows = baseline["rows"]
+    old_multiset = baseline["multiset"]
+    exact_pairs = []
+    for old_start, new_start, length in matching_blocks(old_tree, new_tree):
+        exact_pairs.extend((old_start + k, new_start + k) for k in range(length))
+    remaining_old_indices = set(range(len(old_rows))).difference(i for i, _ in exact_pairs)
+    remaining_new_indices = set(range(len(new_rows))).difference(j for _, j in exact_pairs)
+
+    if exact_pairs:
+        _notify("info", f"ℹ️ 해시가 같은 블록의 {len(exact_pairs):,}행은 건너뛰고 "
+                        f"나머지 {len(remaining_new_indices):,}행만 비교합니다.")
+        if len(old_rows) == len(new_rows):
+            new_column_digests = column_digests(new_rows, cols_new)
+            changed_cols = [col for col in columns
+                            if baseline_column_digests(baseline).get(col) != new_column_digests.get(col)]
+            if changed_cols:
+                _notify("info", f"ℹ️ 내용이 다른 열: {', '.join(changed_cols)}")
+        # 남은 기준 행만으로 해시 인덱스를 다시 구성
+        temp_multiset = Counter()
+        temp_tuple_to_indices = defaultdict(list)
+        for i in sorted(remaining_old_indices):
+            t = row_tuple(old_rows[i]["norm"], columns)
+            temp_multiset[t] += 1
+            temp_tuple_to_indices[t].append(i)
+    else:
+        temp_multiset = old_multiset.copy()
+        temp_tuple_to_indices = {k: v.copy() for k, v in baseline_tuple_indices(baseline).items()}
+
+    for j in sorted(remaining_new_indices):
+        nr = new_rows[j]
+        if j % 10000 == 0:
+            _check_cancelled(cancel_event)
+        t = row_tuple(nr["norm"], columns)
+        if temp_multiset.get(t, 0) > 0:
+            i = temp_tuple_to_indices[t].pop(0)
+            temp_multiset[t] -= 1
+            exact_pairs.append((i, j))
+            remaining_old_indices.discard(i)
+            remaining_new_indices.discard(j)
+    return exact_pairs, remaining_old_indices, remaining_new_indices
+
+def compare_with_baseline(baseline, new_rows, new_fills, cols_new, options, step, cancel_event=None, checkpoint=None):
+    """
+    이미 읽어 둔 기준 데이터와 비교 행들을 비교하여 결과 표들을 반환합니다.
+    step(진행률, 단계 설명)은 진행 상황 보고와 취소 확인을 함께 합니다.
+    해시 트리가 같으면 바로 "동일"로 끝내고, 해시가 같은 블록의 행은 매칭 단계에서 제외합니다.
+    checkpoint(AnalysisCheckpoint)가 있으면 단계마다 결과를 저장하고, 이미 끝난 단계는 저장된 결과를 씁니다.
+    """
+    if checkpoint is not None:
+        frames = checkpoint.load("frames")
+        if frames is not None:
+            step(100, "✅ 분석 완료!")
+            return frames
+    old_rows = baseline["rows"]
+    old_fills = baseline["fills"]
+    columns_old = baseline["columns"]
+
+    # 열 범위: 기준/비교 중 더 넓은 범위를 사용 (기존 columns_old는 유지)
+    all_columns = list(set(columns_old + cols_new))
+    all_columns.sort(key=lambda x: (len(x), x))  # A, B, ... Z, AA, AB ...
+    columns = all_columns
+
+    step(25, "🌳 내용 해시 비교 중...")
+    old_tree = baseline_digest_tree(baseline)
+    new_tree = digest_tree(new_rows, cols_new)
+    if old_tree.root == new_tree.root and len(old_tree) == len(new_tree):
+        _notify("info", "ℹ️ 기준 데이터와 내용이 같습니다 (시트 해시 일치) — 행 비교를 건너뜁니다.")
+        step(100, "✅ 분석 완료!")
+        return identical_frames(pd.DataFrame({
+            "기준행": [r["_row"] for r in old_rows],
+            "비교행": [r["_row"] for r in new_rows],
+        }))
+
+    step(30, "🔄 동일한 행 매칭 중...")
+    exact = checkpoint.load("exact") if checkpoint is not None else None
+    if exact is None:
+        exact = _match_exact_rows(baseline, old_tree, new_tree, new_rows, cols_new, columns, cancel_event)
+        if checkpoint is not None:
+            checkpoint.save("exact", exact)
+    exact_pairs, remaining_old_indices, remaining_new_indices = exact
+
+    step(40, "🔍 변경된 행 매칭 중...")
+    old_left = [old_rows[i] for i in sorted(remaining_old_indices)]
+    new_left = [new_rows[j] for j in sorted(remaining_new_indices)]
+    pairs, leftover_old_idx, leftover_new_idx = best_pairing(
+        new_left, old_left, columns, options["unlimited_pairing"],
+        progress=lambda f: step(40 + int(f * 30), f"🔍 변경된 행 매칭 중... {f*100:.1f}%"),
+        cancel_event=cancel_event,
+        top_k=int(options.get("pairing_top_k", 5)), min_match_ratio=options.get("min_match_ratio", 0.0),
+        checkpoint=checkpoint
+    )
+
+    step(70, "📊 변경 내역 생성 중...")
+    best_pairs = []
+    sorted_old_left = sorted(remaining_old_indices)
+    sorted_new_left = sorted(remaining_new_indices)
+    for eq, i, j in sorted([(p[2], p[0], p[1]) for p in pairs], reverse=True):
+        old_idx_global = sorted_old_left[i]
+        new_idx_global = sorted_new_left[j]
+        best_pairs.append((old_idx_global, new_idx_global, eq))
+
+    exact_pairs.sort(key=lambda p: p[1])
+    unchanged_records = [{
+        "기준행": old_rows[i]["_row"],
+        "비교행": new_rows[j]["_row"],
+        "상태": "동일(재정렬만)"
+    } for i, j in exact_pairs]
+
+    changes_records = []
+    # 셀 단위 변경 내역은 내보내기용으로 요청한 경우에만 모음
+    cell_records = [] if options.get("collect_cell_changes") else None
+    for n, (i, j, eq) in enumerate(best_pairs):
+        if n % 1000 == 0:
+            _check_cancelled(cancel_event)
+        rec = build_diff_record(old_rows[i], new_rows[j], old_fills, new_fills, columns, cell_records)
+        rec["일치열수"] = eq
+        rec["상태"] = "변경"
+        changes_records.append(rec)
+
+    step(85, "✨ 결과 정리 중...")
+    used_old = set([i for i, _, _ in best_pairs] + [i for i, _ in exact_pairs])
+    used_new = set([j for _, j, _ in best_pairs] + [j for _, j in exact_pairs])
+
+    removed_records = [{"기준행": old_rows[i]["_row"], "상태": "제거됨"} for i in range(len(old_rows)) if i not in used_old]
+    added_records = [{"비교행": new_rows[j]["_row"], "상태": "추가됨"} for j in range(len(new_rows)) if j not in used_new]
+
+    frames = {
+        "df_unchanged": pd.DataFrame(unchanged_records),
+        "df_changes": pd.DataFrame(changes_records, columns=["기준행","비교행","일치열수","변경요약","상태"]),
+        "df_cell_changes": pd.DataFrame(cell_records or [], columns=CELL_CHANGE_COLUMNS),
+        "df_removed": pd.DataFrame(removed_records),
+        "df_added": pd.DataFrame(added_records),
+        "result_store": None,
+        "result_counts": None,
+    }
+    if checkpoint is not None:
+        checkpoint.save("frames", frames)
+    step(100, "✅ 분석 완료!")
+    return frames
+
+# ----------------------- 표본 미리보기 -----------------------
+# 비교 파일의 일부 행만 읽으면서 표본을 뽑아 기준 데이터의 정확 일치 인덱스와 희귀 값 인덱스에 조회하여,
+# 전체 분석 전에 동일/변경/추가 비율(95% 신뢰구간)과 페어링 모드별 예상 건수, 전체 실행 시간을 추정합니다.
+PREVIEW_SAMPLE_ROWS = int(os.environ.get("PREVIEW_SAMPLE_ROWS", "400"))
+PREVIEW_SCAN_ROWS = int(os.environ.get("PREVIEW_SCAN_ROWS", "50000"))  # 엑셀 시트에서 표본을 위해 읽는 최대 행 수
+PREVIEW_PROBE_ROWS = 200          # 유사 행 조회/비용 측정에 쓰는 불일치 표본 행 수
+PREVIEW_BASELINE_SAMPLE = 2000    # 후보 경쟁(top_k) 추정에 쓰는 기준 행 표본 수
+PREVIEW_RARE_LIMIT = 50           # 기준 데이터에 이 횟수 이하로 나오는 값만 짝 후보 인덱스에 넣음
+PREVIEW_CANDIDATES = 5            # 불일치 표본 행마다 인덱스에서 확인하는 짝 후보 수
+PREVIEW_TEXT_FULL_BYTES = 8 << 20 # 이보다 작은 CSV/TSV는 전체를 훑어 표본 추출
+PREVIEW_TEXT_HEAD_BYTES = 1 << 18 # 큰 CSV/TSV에서 레코드당 바이트를 구할 때 읽는 앞부분 크기
+PREVIEW_READ_FACTOR = 4.0         # 값만 읽기(read_only) 대비 스타일 포함 읽기의 대략적인 시간 배율
+PREVIEW_UNLIMITED_BUDGET_S = float(os.environ.get("PREVIEW_UNLIMITED_BUDGET_S", "60"))
+LIMITED_MAX_PAIRS = 100000        # best_pairing 제한 모드의 조합 수
+
+def wilson_interval(successes, n, z=1.96, population=None):
+    """비율의 Wilson 신뢰구간 (표본이 모집단 전체이면 구간 폭 0)"""
+    if n == 0:
+        return 0.0, 0.0, 1.0
+    p = successes / n
+    if population is not None and n >= population:
+        return p, p, p
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return p, max(0.0, center - half), min(1.0, center + half)
+
+def _sample_text_blocks(file, sample_size, options, rng):
+    """
+    큰 CSV/TSV 파일의 무작위 위치 sample_size곳에서 한 행씩 읽어 표본을 만듭니다 (파일 전체를 읽지 않음).
+    각 위치에서는 다음 줄바꿈부터 레코드 몇 개 길이만 읽으며, 전체 행 수와 전체 읽기 시간은 읽은 바이트당 행 수/시간으로 추정합니다.
+    반환값: (표본 (추정 행 번호, 값 목록) 목록, 추정 행 수, 추정 읽기 시간(초))
+    """
+    max_rows, max_cols = options["max_rows"], options["max_cols"]
+    column_selection = options.get("column_selection")
+    keep = None
+    if column_selection is not None:
+        keep = set(selected_columns(column_selection, max_cols))
+        max_cols = max(keep, default=0)
+    predicate = build_row_predicate(options.get("row_filter"))
+    delimiter = text_delimiter(file)
+    started = time.time()
+    binary = _open_binary(file)
+    try:
+        total_bytes = binary.seek(0, os.SEEK_END)
+        binary.seek(0)
+        encoding = _text_encoding(binary, head_only=True)
+        # 파일 앞부분으로 레코드당 바이트를 구해 max_rows행까지의 범위에서만 위치를 고름
+        head = binary.read(PREVIEW_TEXT_HEAD_BYTES)
+        bytes_per_record = len(head) / max(1, head.count(b"\n"))
+        span = min(total_bytes, int(max_rows * bytes_per_record))
+        block_bytes = max(4096, int(bytes_per_record * 8))
+        picked = []
+        read_bytes = read_records = passed = 0
+        for offset in sorted(rng.randrange(span) for _ in range(sample_size)):
+            binary.seek(offset)
+            binary.readline()  # 중간에서 시작한 줄은 버림
+            start = binary.tell()
+            chunk = binary.read(block_bytes)
+            end = chunk.rfind(b"\n")
+            if end < 0:
+                continue
+            chunk = chunk[:end + 1]
+            read_bytes += len(chunk)
+            taken = False
+            for k, record in enumerate(csv.reader(chunk.decode(encoding, errors="replace").splitlines(), delimiter=delimiter)):
+                read_records += 1
+                values = _text_values(record, max_cols, keep, predicate)
+                if not values:
+                    continue
+                passed += 1
+                if not taken:
+                    picked.append((int(start / bytes_per_record) + k + 1, values))
+                    taken = True
+    finally:
+        binary.close()
+    if not read_bytes:
+        return [], 0, time.time() - started
+    total_records = min(max_rows, total_bytes * read_records / read_bytes)
+    n_rows = round(total_records * passed / max(1, read_records))
+    read_s = (time.time() - started) * span / read_bytes
+    return picked, n_rows, read_s
+
+def sample_sheet_rows(file, sheet_name, sample_size, options, seed=None):
+    """
+    비교 시트에서 읽으면서 행 표본을 뽑습니다. 원본 값이 캐시에 있으면 캐시에서 뽑습니다.
+    CSV/TSV는 작은 파일이면 전체를 훑는 무작위(저수지) 표본, 크면 파일 안의 무작위 위치 여러 곳에서 읽은 구간 표본입니다.
+    엑셀은 read_only로 값만 훑는 저수지 표본이며, 처음 PREVIEW_SCAN_ROWS행까지만 읽고 전체 행 수는 시트 크기 정보로 추정합니다
+    (이 경우 뒤쪽에만 있는 변화는 표본에 덜 반영됨).
+    반환값: (표본 행 목록, 전체 행 수(추정), 열 목록, 전체 분석의 예상 읽기 시간(초), 방식)
+    """
+    rng = random.Random(seed)
+    column_selection, row_filter = options.get("column_selection"), options.get("row_filter")
+    key = raw_cache_key(file, sheet_name, options["max_rows"], options["max_cols"], column_selection, row_filter)
+    if key in baseline_registry:
+        raw = baseline_registry.get(key)
+        if raw is not None:
+            rows = raw["rows"]
+            picked = rows if len(rows) <= sample_size else rng.sample(rows, sample_size)
+            return picked, len(rows), raw["columns"], 0.0, "캐시"
+
+    def reservoir(picked, seen, item):
+        slot = seen - 1 if len(picked) < sample_size else rng.randrange(seen)
+        if slot < sample_size:
+            picked[slot:slot + 1] = [item]
+
+    started = time.time()
+    if text_delimiter(file):
+        binary = _open_binary(file)
+        try:
+            total_bytes = binary.seek(0, os.SEEK_END)
+        finally:
+            binary.close()
+        if total_bytes > PREVIEW_TEXT_FULL_BYTES:
+            picked, n_rows, read_s = _sample_text_blocks(file, sample_size, options, rng)
+            method = "구간 표본"
+        else:
+            picked = []
+            n_rows = 0
+            for r, values in iter_text_rows(file, options["max_rows"], options["max_cols"],
+                                            column_selection=column_selection, row_filter=row_filter):
+                n_rows += 1
+                reservoir(picked, n_rows, (r, values))
+            read_s, method = time.time() - started, "무작위 표본"
+        max_c = max((len(values) for _, values in picked), default=0)
+        col_indices = selected_columns(column_selection, max_c)
+        cols = [get_column_letter(c) for c in col_indices]
+        picked = [{"_row": r, "orig": {col: (values[c - 1] if c <= len(values) else None) for c, col in zip(col_indices, cols)}}
+                  for r, values in sorted(picked)]
+        return picked, n_rows, cols, read_s, method
+    wb = load_workbook(_private_stream(file), read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name else wb.active
+        # 시트 크기 정보가 없으면 전체 행 수를 추정할 수 없으므로 끝까지 읽음
+        max_rows = min(ws.max_row or options["max_rows"], options["max_rows"])
+        scan_rows = min(max_rows, PREVIEW_SCAN_ROWS) if ws.max_row else max_rows
+        col_indices = selected_columns(column_selection, min(ws.max_column or options["max_cols"], options["max_cols"]))
+        cols = [get_column_letter(c) for c in col_indices]
+        predicate = build_row_predicate(row_filter)
+        read_cols = max(col_indices + ([predicate[0]] if predicate else []), default=0)
+        picked = []
+        n_rows = 0
+        for r, values in enumerate(ws.iter_rows(min_row=1, max_row=scan_rows, max_col=read_cols, values_only=True), start=1):
+            if predicate is not None and not predicate[1](values[predicate[0] - 1] if predicate[0] <= len(values) else None):
+                continue
+            orig = {col: (values[c - 1] if c <= len(values) else None) for c, col in zip(col_indices, cols)}
+            if all(v in (None, "") for v in orig.values()):
+                continue
+            n_rows += 1
+            reservoir(picked, n_rows, {"_row": r, "orig": orig})
+    finally:
+        wb.close()
+    picked.sort(key=lambda row: row["_row"])
+    read_s = (time.time() - started) * PREVIEW_READ_FACTOR
+    if scan_rows < max_rows:
+        scale = max_rows / scan_rows
+        return picked, round(n_rows * scale), cols, read_s * scale, "앞부분 표본"
+    return picked, n_rows, cols, read_s, "무작위 표본"
+
+def preview_value_index(baseline_key, baseline):
+    """
+    기준 데이터에서 PREVIEW_RARE_LIMIT번 이하로 나오는 (열, 값)마다 행 번호 목록을 만듭니다 (공유 캐시에 기준 데이터별로 한 번).
+    불일치 표본 행의 짝 후보(값 일부만 바뀐 원래 행)를 기준 행 전체와 비교하지 않고 찾는 데 씁니다.
+    """
+    def compute():
+        postings = {}
+        for col in baseline["columns"]:
+            counts = Counter(r["norm"].get(col) for r in baseline["rows"])
+            rare = {v for v, n in counts.items() if v is not None and n <= PREVIEW_RARE_LIMIT}
+            for i, r in enumerate(baseline["rows"]):
+                v = r["norm"].get(col)
+                if v in rare:
+                    postings.setdefault((col, v), []).append(i)
+        n_refs = sum(len(p) for p in postings.values())
+        return {"postings": postings, "nbytes": n_refs * 40 + len(postings) * 200}
+
+    index, _ = baseline_registry.get_or_compute(("preview_index", baseline_key), compute)
+    return index
+
+def _estimate_pairs(probe, old_rows, columns, index, min_eq, top_k, new_left, old_left, rng):
+    """
+    불일치 표본 행(probe)으로 유사도 매칭(top_k 후보 + 탐욕 배정)에서 짝을 찾을 비교 행 수를 모드별로 추정합니다.
+    - 강한 짝: 희귀 값 인덱스로 찾은 후보 중, 그 후보 기준 행의 top_k 안에 드는 행 (값 일부만 바뀐 행)
+    - 약한 짝: 기준 행 표본에서 top_k 안에 넣어 줄 남는 기준 행의 기대 수 λ로 1 - e^-λ (흔한 값만 겹치는 행)
+    기준 행의 top_k 순위는 불일치 표본과의 일치 열 수 분포를 남은 비교 행 수로 늘려 추정합니다.
+    반환값: (불일치 행 중 짝을 찾을 비율, 무제한 페어링 예상 변경 수, 제한 모드 예상 변경 수)
+    """
+    p = len(probe)
+    scale = new_left / p  # 표본 행 하나가 나타내는 남은 비교 행 수
+    new_vals = [row_tuple(r["norm"], columns) for r in probe]
+    probe_index = defaultdict(list)
+    for t, vals in enumerate(new_vals):
+        for c, v in enumerate(vals):
+            probe_index[(c, v)].append(t)
+
+    def ranked(old_row):
+        """기준 행과 표본 행별 일치 열 수, 일치 열 수별 top_k 안 포함 여부"""
+        eqs = [0] * p
+        for c, v in enumerate(row_tuple(old_row["norm"], columns)):
+            for t in probe_index.get((c, v), ()):
+                eqs[t] += 1
+        hist = Counter(eqs)
+        admits, above = {}, 0
+        for e in sorted(hist, reverse=True):
+            # 같은 일치 수끼리는 평균적으로 가운데 순위
+            admits[e] = e >= min_eq and (above + (hist[e] - 1) / 2) * scale < top_k
+            above += hist[e]
+        return eqs, admits
+
+    strong = [False] * p
+    postings = index["postings"]
+    for t, r in enumerate(probe):
+        hits = Counter()
+        for col in columns:
+            hits.update(postings.get((col, r["norm"].get(col)), ()))
+        for i, _ in hits.most_common(PREVIEW_CANDIDATES):
+            eqs, admits = ranked(old_rows[i])
+            if admits[eqs[t]]:
+                strong[t] = True
+                break
+    n_strong = sum(strong)
+
+    # 남는 기준 행(정확 일치/강한 짝에 쓰이지 않은 행)이 약한 짝을 받아 줄 기대 수
+    old_sample = old_rows if len(old_rows) <= PREVIEW_BASELINE_SAMPLE else rng.sample(old_rows, PREVIEW_BASELINE_SAMPLE)
+    free_share = max(0.0, old_left - n_strong * scale) / len(old_rows)
+    weight = free_share * len(old_rows) / len(old_sample)
+    lam = [0.0] * p
+    reach = 0.0  # 기준 행이 후보를 하나라도 가질 확률의 합 (제한 모드 추정용)
+    for old_row in old_sample:
+        eqs, admits = ranked(old_row)
+        reach += 1 - math.exp(-scale * sum(1 for e in eqs if e >= min_eq))
+        for t, e in enumerate(eqs):
+            if not strong[t] and admits[e]:
+                lam[t] += weight
+    weak = sum(1 - math.exp(-lam[t]) for t in range(p) if not strong[t])
+    weak = min(weak, max(0.0, old_left - n_strong * scale) / scale)
+    share = (n_strong + weak) / p
+    unlimited = min(round(share * new_left), new_left, old_left)
+    # 제한 모드: 앞쪽 기준 행 LIMITED_MAX_PAIRS / 남은 비교 행 수개만 후보를 찾으므로 그 행들만 짝을 가질 수 있음
+    limited = unlimited
+    if new_left * old_left > LIMITED_MAX_PAIRS:
+        limited = min(unlimited, round(LIMITED_MAX_PAIRS / new_left * reach / len(old_sample)))
+    return share, unlimited, limited
+
+def preview_comparison(old_file, old_sheet, baseline_key, new_file, new_sheet, options,
+                       sample_size=PREVIEW_SAMPLE_ROWS, seed=None):
+    """
+    표본으로 전체 분석 결과와 실행 시간을 추정합니다 (메모리 모드 기준 데이터 사용).
+    반환값: 표본 크기, 비율 추정(값, 하한, 상한), 모드별 예상 건수, 예상 시간, 페어링 모드 추천 등을 담은 딕셔너리
+    """
+    started = time.time()
+    rng = random.Random(seed)
+    baseline_key, baseline = get_or_build_baseline(
+        old_file, old_sheet, options, options["max_rows"], options["max_cols"], key=baseline_key,
+        column_selection=options.get("column_selection"), row_filter=options.get("row_filter")
+    )
+    old_rows, cols_old = baseline["rows"], baseline["columns"]
+    sample, n_new, cols_new, read_s, method = sample_sheet_rows(new_file, new_sheet, sample_size, options, seed)
+    if not sample:
+        raise ValueError("비교 파일에 데이터가 없습니다.")
+    sample = derive_rows(sample, cols_new, options)
+    columns = sorted(set(cols_old) | set(cols_new), key=lambda x: (len(x), x))
+    extra_cols = [c for c in cols_new if c not in set(cols_old)]
+
+    # 1) 정확 일치: 기준 데이터의 멀티셋 인덱스에 조회 (기준에 없는 열은 비어 있어야 일치)
+    exact = [
+        row_tuple(r["norm"], cols_old) in baseline["multiset"] and all(r["norm"].get(c) is None for c in extra_cols)
+        for r in sample
+    ]
+    misses = [r for r, hit in zip(sample, exact) if not hit]
+    n = len(sample)
+    n_exact = sum(exact)
+    unchanged = min(round(n_exact / n * n_new), len(old_rows))
+    new_left = n_new - unchanged
+    old_left = len(old_rows) - unchanged
+
+    # 2) 불일치 행 중 유사도 매칭으로 짝을 찾을 비율과 모드별 변경 수
+    min_eq = min_match_columns(len(columns), options.get("min_match_ratio", 0.0))
+    top_k = int(options.get("pairing_top_k", 5))
+    probe = misses if len(misses) <= PREVIEW_PROBE_ROWS else rng.sample(misses, PREVIEW_PROBE_ROWS)
+    changed = {"무제한 페어링": 0, "제한 모드": 0}
+    n_near = 0
+    if probe and old_rows and new_left > 0:
+        share, changed["무제한 페어링"], changed["제한 모드"] = _estimate_pairs(
+            probe, old_rows, columns, preview_value_index(baseline_key, baseline), min_eq, top_k, new_left, old_left, rng
+        )
+        n_near = round(len(misses) * share)
+    fractions = {
+        "동일": wilson_interval(n_exact, n, population=n_new),
+        "변경 후보": wilson_interval(n_near, n, population=n_new),
+        "추가 후보": wilson_interval(n - n_exact - n_near, n, population=n_new),
+    }
+
+    # 3) 예상 건수: 정확 일치는 기준 행을 1:1로 소비, 변경은 모드별 추정
+    estimates = {
+        mode: {"동일": unchanged, "변경": count, "추가": new_left - count, "제거": old_left - count}
+        for mode, count in changed.items()
+    }
+
+    # 4) 비용: 불일치 표본과 기준 표본으로 조합당 비교 시간을 측정해 전체 조합 수에 곱함
+    per_pair = 0.0
+    if probe and old_rows:
+        old_probe = rng.sample(old_rows, min(len(old_rows), PREVIEW_PROBE_ROWS))
+        old_vals = [row_tuple(r["norm"], columns) for r in old_probe]
+        new_vals = [row_tuple(r["norm"], columns) for r in probe]
+        t0 = time.perf_counter()
+        top_k_candidates(old_vals, new_vals, list(range(len(old_vals))), list(range(len(new_vals))), len(columns),
+                         top_k=top_k, min_eq=min_eq)
+        per_pair = (time.perf_counter() - t0) / (len(old_vals) * len(new_vals))
+    pairs = new_left * old_left
+    cost = {
+        "읽기": read_s,
+        "제한 모드": read_s + min(pairs, LIMITED_MAX_PAIRS) * per_pair,
+        "무제한 페어링": read_s + pairs * per_pair,
+    }
+    return {
+        "method": method,
+        "sample_rows": n,
+        "new_rows": n_new,
+        "baseline_rows": len(old_rows),
+        "fractions": fractions,
+        "estimates": estimates,
+        "pairs": pairs,
+        "per_pair_us": per_pair * 1e6,
+        "cost": cost,
+        # 무제한 페어링이 제한 모드와 결과가 다를 수 있고(조합이 제한보다 많음) 예상 시간이 예산 안이면 무제한 추천
+        "recommend_unlimited": pairs > LIMITED_MAX_PAIRS and cost["무제한 페어링"] <= PREVIEW_UNLIMITED_BUDGET_S,
+        "elapsed_s": time.time() - started,
+    }
+
+# ----------------------- 여러 파일 일괄 비교 -----------------------
+# 기준 데이터는 한 번만 읽고, 비교 파일들을 작업 프로세스 여러 개에 나눠 처리합니다.
+# 작업 프로세스는 fork 대신 새 인터프리터로 띄워(여러 스레드가 도는 서버를 fork하지 않도록) 기준 원본 값을 파일로 받습니다.
+BATCH_WORKERS = max(1, int(os.environ.get("BATCH_WORKERS") or os.cpu_count() or 2))
+BATCH_STOP_TIMEOUT_S = 30  # 취소 후 작업 프로세스가 스스로 끝나기를 기다리는 최대 시간
+BATCH_SUMMARY_COLUMNS = ["파일", "시트", "동일(재정렬만)", "변경", "제거", "추가", "소요(초)", "오류"]
+
+def _batch_sheet_name(path, sheet_name):
+    """비교 파일에 기준 시트와 같은 이름의 시트가 있으면 그 시트, 없으면 첫 시트"""
+    names = sheet_names(path)
+    return sheet_name if sheet_name in names else names[0]
+
+def _batch_compare_file(baseline, path, sheet_name, options, cancel_event=None):
+    """기준 데이터(읽기 전용)와 비교 파일 하나를 비교하여 (사용한 시트, 결과 표들)을 반환합니다."""
+    sheet = _batch_sheet_name(path, sheet_name)
+    raw_rows, fills, cols = read_sheet_raw(
+        path, sheet, options["max_rows"], options["max_cols"], cancel_event=cancel_event,
+        column_selection=options.get("column_selection"), row_filter=options.get("row_filter")
+    )
+    new_rows = derive_rows(raw_rows, cols, options)
+    if not new_rows:
+        raise ValueError("비교 파일에 데이터가 없습니다.")
+    frames = compare_with_baseline(baseline, new_rows, fills, cols, options,
+                                   lambda pct, text: _check_cancelled(cancel_event), cancel_event)
+    return sheet, frames
+
+def _batch_worker_main(spec_path):
+    """
+    `python app.py --batch-worker <설정 파일>`로 띄운 일괄 비교 작업 프로세스입니다.
+    설정 파일의 기준 원본 값으로 기준 데이터를 한 번 만든 뒤, 표준 입력으로 받은 비교 파일 경로를 하나씩 비교하여
+    (시트, 결과 표들, 오류, 안내 메시지, 소요 시간)을 표준 출력으로 돌려줍니다.
+    표준 입력이 닫히면 (끝 또는 취소) 진행 중인 비교를 다음 취소 확인 지점에서 멈추고 끝냅니다.
+    """
+    results = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)  # 다른 출력(print 등)이 결과 스트림에 섞이지 않도록
+    stop = threading.Event()
+    tasks = queue.Queue()
+
+    def read_tasks():
+        try:
+            while True:
+                tasks.put(pickle.load(sys.stdin.buffer))
+        except Exception:
+            pass
+        stop.set()
+        tasks.put(None)
+
+    threading.Thread(target=read_tasks, daemon=True).start()
+    with open(spec_path, "rb") as f:
+        spec = pickle.load(f)
+    options = spec["options"]
+    baseline = baseline_from_rows(derive_rows(spec["rows"], spec["columns"], options), spec["fills"], spec["columns"])
+    while True:
+        path = tasks.get()
+        if path is None or stop.is_set():
+            break
+        started = time.time()
+        _message_sink.messages = []
+        try:
+            sheet, frames = _batch_compare_file(baseline, path, spec["sheet"], options, stop)
+            reply = (sheet, frames, None, _message_sink.messages, time.time() - started)
+        except AnalysisCancelled:
+            break
+        except Exception as e:
+            reply = (None, None, str(e), _message_sink.messages, time.time() - started)
+        pickle.dump(reply, results, protocol=pickle.HIGHEST_PROTOCOL)
+        results.flush()
+
+class _BatchWorkerProcess:
+    """일괄 비교 작업 프로세스 하나 (새 인터프리터로 시작하므로 서버 프로세스의 스레드/메모리를 물려받지 않음)"""
+    def __init__(self, spec_path):
+        self.proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--batch-worker", spec_path],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def compare(self, path):
+        """비교 파일 하나를 맡기고 (시트, 결과 표들, 오류, 안내 메시지, 소요 시간)을 기다립니다."""
+        try:
+            pickle.dump(path, self.proc.stdin)
+            self.proc.stdin.flush()
+            return pickle.load(self.proc.stdout)
+        except (EOFError, OSError, ValueError, pickle.UnpicklingError):
+            return None, None, "일괄 비교 작업 프로세스가 비정상 종료되었습니다.", [], 0.0
+
+    def stop(self):
+        """입력을 닫아 끝내라고 알립니다 (진행 중인 비교는 작업 프로세스가 스스로 취소)."""
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+
+    def join(self, timeout):
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            # 취소 확인 지점에 오래 도달하지 못하는 경우에만 강제 종료
+            self.proc.kill()
+            self.proc.wait()
+        self.proc.stdout.close()
+
+def _batch_summary_row(path, sheet, frames, error, elapsed):
+    counts = [result_count(frames, k) for k in ("df_unchanged", "df_changes", "df_removed", "df_added")] if frames else [None] * 4
+    return [os.path.basename(path), sheet, *counts, round(elapsed, 2), error or ""]
+
+def run_batch_comparison(old_file, old_sheet, baseline_key, new_files, options, report=None, cancel_event=None):
+    """
+    기준 데이터 하나를 여러 비교 파일과 비교합니다.
+    반환값: {"summary": 파일별 요약 표, "results": {파일 경로: {"sheet": 시트, "frames": 결과 표들}}}
+    작업 프로세스(`--batch-worker`)들이 파일을 나눠 처리하며, 디스크 사용 모드이면 스레드로 나눠 처리합니다.
+    """
+    def step(pct, text):
+        _check_cancelled(cancel_event)
+        if report is not None:
+            report(pct, text)
+
+    step(2, "📦 기준 데이터 준비 중...")
+    use_processes = not options.get("spill_mode")
+    baseline = None
+    if use_processes:
+        _, baseline = get_or_build_baseline(
+            old_file, old_sheet, options, options["max_rows"], options["max_cols"], key=baseline_key,
+            column_selection=options.get("column_selection"), row_filter=options.get("row_filter")
+        )
+
+    n_workers = min(BATCH_WORKERS, len(new_files))
+    summary = [None] * len(new_files)
+    results = {}
+
+    def collect(idx, sheet, frames, error, messages, elapsed):
+        path = new_files[idx]
+        name = os.path.basename(path)
+        for kind, msg in messages:
+            if kind in ("warning", "error"):
+                _notify(kind, f"[{name}] {msg}")
+        if error:
+            _notify("error", f"❌ [{name}] 비교 실패: {error}")
+        else:
+            results[path] = {"sheet": sheet, "frames": frames}
+        summary[idx] = _batch_summary_row(path, sheet, frames, error, elapsed)
+        done = sum(1 for row in summary if row is not None)
+        step(5 + int(done / len(new_files) * 90), f"📚 일괄 비교 중... {done}/{len(new_files)}개 파일 완료")
+
+    step(5, f"📚 일괄 비교 중... 0/{len(new_files)}개 파일 완료 (작업 {n_workers}개)")
+    workers = []
+    spec_path = None
+    if use_processes:
+        # 기준 원본 값은 파일로 한 번 넘기고, 작업 프로세스마다 그 파일에서 기준 데이터를 만듦
+        spec_path = spill_store.new_path("batch", suffix=".pickle")
+        with open(spec_path, "wb") as f:
+            pickle.dump({
+                "rows": [{"_row": r["_row"], "orig": r["orig"]} for r in baseline["rows"]],
+                "fills": baseline["fills"], "columns": baseline["columns"], "sheet": old_sheet, "options": options,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        workers = [_BatchWorkerProcess(spec_path) for _ in range(n_workers)]
+        idle = queue.Queue()
+        for worker in workers:
+            idle.put(worker)
+
+        def compare_one(path):
+            worker = idle.get()
+            try:
+                return worker.compare(path)
+            finally:
+                idle.put(worker)
+    else:
+        def compare_one(path):
+            started = time.time()
+            messages = _message_sink.messages = []
+            try:
+                sheet = _batch_sheet_name(path, old_sheet)
+                frames = run_comparison(old_file, old_sheet, baseline_key, path, sheet, options, cancel_event=cancel_event)
+                return sheet, frames, None, messages, time.time() - started
+            except AnalysisCancelled:
+                raise
+            except Exception as e:
+                return None, None, str(e), messages, time.time() - started
+            finally:
+                _message_sink.messages = None
+
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="batch-compare") as pool:
+            futures = {pool.submit(compare_one, path): idx for idx, path in enumerate(new_files)}
+            pending = set(futures)
+            try:
+                while pending:
+                    _check_cancelled(cancel_event)
+                    for future in list(pending):
+                        if not future.done():
+                            continue
+                        pending.discard(future)
+                        collect(futures[future], *future.result())
+                    if pending:
+                        time.sleep(0.2)
+            finally:
+                # 취소/오류 시 아직 시작하지 않은 파일은 버리고, 작업 프로세스에 끝내라고 알린 뒤 스레드가 돌아오기를 기다림
+                pool.shutdown(wait=False, cancel_futures=True)
+                for worker in workers:
+                    worker.stop()
+    finally:
+        for worker in workers:
+            worker.join(BATCH_STOP_TIMEOUT_S)
+        if spec_path is not None:
+            _remove_quietly(spec_path)
+
+    step(100, "✅ 일괄 분석 완료!")
+    df_summary = pd.DataFrame(summary, columns=BATCH_SUMMARY_COLUMNS)
+    df_summary[BATCH_SUMMARY_COLUMNS[2:6]] = df_summary[BATCH_SUMMARY_COLUMNS[2:6]].astype("Int64")
+    return {
+        "summary": df_summary,
+        "results": results,
+    }
+
+if __name__ == "__main__" and "--batch-worker" in sys.argv[:-1]:
+    _batch_worker_main(sys.argv[sys.argv.index("--batch-worker") + 1])
+    sys.exit(0)
+
+# ----------------------- 버전 이력 저장소 -----------------------
+# 같은 보고서의 여러 버전을 행 내용 해시로 저장합니다. 이미 있는 행 내용은 다시 저장하지 않으므로
+# 저장 용량은 파일 크기가 아니라 버전 간 변경량에 비례합니다.
+HISTORY_DB = os.environ.get("HISTORY_DB") or os.path.join(os.path.expanduser("~"), ".excel_compare", "history.sqlite")
+HISTORY_QUERY_BATCH = 500
+HISTORY_BLOB_FORMAT = "json"
+
+def open_history_store(path=None):
+    """버전 이력 SQLite 파일을 열고 (없으면 만들고) 연결을 반환합니다."""
+    path = path or HISTORY_DB
+    _private_dir(os.path.dirname(os.path.abspath(path)))
+    conn = sqlite3.connect(path, timeout=30)
+    # 행 내용은 JSON 텍스트로 저장 (이전 형식의 row_blobs/fill_blobs 표는 읽지 않음)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS row_values (digest BLOB PRIMARY KEY, orig TEXT) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS fill_values (digest BLOB PRIMARY KEY, labels TEXT) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, sheet TEXT, source_hash TEXT,
+            created_at REAL, n_rows INTEGER, n_cols INTEGER, max_rows INTEGER, max_cols INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS version_rows (
+            version_id INTEGER, pos INTEGER, row_no INTEGER, row_digest BLOB, fill_digest BLOB,
+            PRIMARY KEY (version_id, pos)
+        ) WITHOUT ROWID;
+    """)
+    # 읽기 범위/저장 형식 열이 없던 이전 형식의 저장소 (기존 버전은 목록과 재사용 대상에서 빠짐)
+    known = {row[1] for row in conn.execute("PRAGMA table_info(versions)")}
+    for column, kind in (("max_rows", "INTEGER"), ("max_cols", "INTEGER"), ("blob_format", "TEXT")):
+        if column not in known:
+            conn.execute(f"ALTER TABLE versions ADD COLUMN {column} {kind}")
+    return conn
+
+def save_version(file, sheet_name, name, max_rows_limit=100000, max_cols_limit=200, progress=None, cancel_event=None, path=None):
+    """
+    시트를 버전 이력에 저장합니다. 같은 파일 내용/시트/읽기 범위로 저장한 버전이 이미 있으면 그대로 씁니다.
+    반환값: (버전 ID, 새로 저장된 행 내용 수)
+    """
+    source_hash = file_content_hash(file)
+    max_rows_limit, max_cols_limit = int(max_rows_limit), int(max_cols_limit)
+    conn = open_history_store(path)
+    try:
+        existing = conn.execute(
+            "SELECT id FROM versions WHERE source_hash = ? AND sheet IS ? AND max_rows = ? AND max_cols = ? AND blob_format = ?",
+            (source_hash, sheet_name, max_rows_limit, max_cols_limit, HISTORY_BLOB_FORMAT)
+        ).fetchone()
+        if existing:
+            return existing[0], 0
+
+        version_id = conn.execute(
+            "INSERT INTO versions (name, sheet, source_hash, created_at, n_rows, n_cols, max_rows, max_cols, blob_format) "
+            "VALUES (?, ?, ?, ?, 0, 0, ?, ?, ?)",
+            (name, sheet_name, source_hash, time.time(), max_rows_limit, max_cols_limit, HISTORY_BLOB_FORMAT)
+        ).lastrowid
+        n_rows = 0
+        n_cols = 0
+        new_blobs = 0
+        refs, blobs, fill_blobs = [], [], []
+
+        def flush():
+            nonlocal new_blobs
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO row_values VALUES (?, ?)", blobs)
+            new_blobs += conn.total_changes - before
+            conn.executemany("INSERT OR IGNORE INTO fill_values VALUES (?, ?)", fill_blobs)
+            conn.executemany("INSERT INTO version_rows VALUES (?, ?, ?, ?, ?)", refs)
+            refs.clear()
+            blobs.clear()
+            fill_blobs.clear()
+
+        # 원본 값 그대로 저장 (정규화는 비교할 때 현재 옵션으로 적용)
+        for row_no, orig, fills in iter_raw_sheet_rows(file, sheet_name, max_rows_limit, max_cols_limit,
+                                                       progress=progress, cancel_event=cancel_event):
+            row_digest = _row_digest(orig)
+            fill_digest = _row_digest(fills)
+            refs.append((version_id, n_rows, row_no, row_digest, fill_digest))
+            blobs.append((row_digest, _dump_values(orig)))
+            fill_blobs.append((fill_digest, _dump_values(fills)))
+            n_rows += 1
+            n_cols = max(n_cols, len(orig))
+            if len(refs) >= SPILL_INSERT_BATCH:
+                flush()
+        flush()
+        conn.execute("UPDATE versions SET n_rows = ?, n_cols = ? WHERE id = ?", (n_rows, n_cols, version_id))
+        conn.commit()
+        return version_id, new_blobs
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def list_versions(path=None):
+    """저장된 버전 목록을 최신순 DataFrame으로 반환합니다."""
+    conn = open_history_store(path)
+    try:
+        df = pd.read_sql_query(
+            'SELECT id AS "버전", name AS "이름", sheet AS "시트", created_at, n_rows AS "행 수", n_cols AS "열 수" '
+            "FROM versions WHERE blob_format = ? ORDER BY id DESC", conn, params=(HISTORY_BLOB_FORMAT,))
+    finally:
+        conn.close()
+    df.insert(3, "저장 시각", pd.to_datetime(df.pop("created_at"), unit="s").dt.floor("s"))
+    return df
+
+def _fetch_blobs(conn, table, column, digests):
+    """해시 목록에 해당하는 내용을 {해시: 값 목록}으로 읽어옵니다."""
+    digests = list(set(digests))
+    result = {}
+    for start in range(0, len(digests), HISTORY_QUERY_BATCH):
+        part = digests[start:start + HISTORY_QUERY_BATCH]
+        placeholders = ",".join("?" * len(part))
+        for digest, blob in conn.execute(f"SELECT digest, {column} FROM {table} WHERE digest IN ({placeholders})", part):
+            result[digest] = _load_values(blob)
+    return result
+
+def _materialize_version_rows(conn, refs, columns, options):
+    """
+    버전 행 참조 (pos, 행 번호, 행 해시, 채우기 해시) 목록을 비교용 행/채우기 구조로 만듭니다.
+    """
+    origs = _fetch_blobs(conn, "row_values", "orig", [r[2] for r in refs])
+    fill_lists = _fetch_blobs(conn, "fill_values", "labels", [r[3] for r in refs])
+    rows = []
+    fills = {}
+    positions = [column_index_from_string(col) - 1 for col in columns]
+    for _, row_no, row_digest, fill_digest in refs:
+        values = origs[row_digest]
+        orig = {col: (values[p] if p < len(values) else None) for col, p in zip(columns, positions)}
+        rows.append({"_row": row_no, "orig": orig, "norm": {}})
+        for c, label in enumerate(fill_lists[fill_digest], start=1):
+            if label != "No Fill":
+                fills[(row_no, c)] = label
+    normalize_rows(rows, columns, options)
+    return rows, fills
+
+def _filter_version_refs(conn, refs, row_filter):
+    """행 필터에 맞는 버전 행 참조만 남깁니다 (필터 열 값만 확인)."""
+    predicate = build_row_predicate(row_filter)
+    if predicate is None:
+        return refs
+    col, matches = predicate
+    origs = _fetch_blobs(conn, "row_values", "orig", [r[2] for r in refs])
+    return [r for r in refs if matches(origs[r[2]][col - 1] if col <= len(origs[r[2]]) else None)]
+
+def diff_versions(old_version_id, new_version_id, options, report=None, cancel_event=None, path=None):
+    """
+    저장된 두 버전을 엑셀 파일을 다시 읽지 않고 비교합니다. run_comparison과 같은 결과 표를 반환합니다.
+    원본 내용 해시가 같은 행은 바로 짝짓고, 나머지 행만 내용을 꺼내 일반 비교 과정을 거칩니다.
+    """
+    def step(pct, text):
+        _check_cancelled(cancel_event)
+        if report is not None:
+            report(pct, text)
+
+    step(5, "🗂️ 버전 이력 읽는 중...")
+    conn = open_history_store(path)
+    try:
+        n_cols = conn.execute("SELECT MAX(n_cols) FROM versions WHERE id IN (?, ?)", (old_version_id, new_version_id)).fetchone()[0] or 0
+        # 버전에는 모든 열이 저장되어 있으므로 열 선택은 비교 시점에 적용
+        columns = [get_column_letter(c) for c in selected_columns(options.get("column_selection"), n_cols)]
+        ref_query = "SELECT pos, row_no, row_digest, fill_digest FROM version_rows WHERE version_id = ? ORDER BY pos"
+        old_refs = conn.execute(ref_query, (old_version_id,)).fetchall()
+        new_refs = conn.execute(ref_query, (new_version_id,)).fetchall()
+        if options.get("row_filter") is not None:
+            old_refs = _filter_version_refs(conn, old_refs, options["row_filter"])
+            new_refs = _filter_version_refs(conn, new_refs, options["row_filter"])
+
+        step(15, "🔄 내용이 같은 행 매칭 중...")
+        by_digest = defaultdict(list)
+        for ref in reversed(old_refs):
+            by_digest[ref[2]].append(ref)
+        raw_pairs = []
+        new_left = []
+        for ref in new_refs:
+            candidates = by_digest.get(ref[2])
+            if candidates:
+                raw_pairs.append((candidates.pop()[1], ref[1]))
+            else:
+                new_left.append(ref)
+        old_left = sorted((ref for refs in by_digest.values() for ref in refs), key=lambda r: r[0])
+
+        step(25, "📦 바뀐 행 내용 불러오는 중...")
+        old_rows, old_fills = _materialize_version_rows(conn, old_left, columns, options)
+        new_rows, new_fills = _materialize_version_rows(conn, new_left, columns, options)
+    finally:
+        conn.close()
+
+    frames = compare_with_baseline(baseline_from_rows(old_rows, old_fills, columns), new_rows, new_fills, columns, options, step, cancel_event)
+    if raw_pairs:
+        df_raw = pd.DataFrame(raw_pairs, columns=["기준행", "비교행"])
+        df_raw["상태"] = "동일(재정렬만)"
+        frames["df_unchanged"] = pd.concat([df_raw, frames["df_unchanged"]], ignore_index=True).sort_values("비교행", ignore_index=True)
+    return frames
+
+def version_timeline(last_n=12, path=None):
+    """
+    최근 last_n개 버전을 한 번의 스캔으로 훑어 직전 버전 대비 행 내용 변화량을 요약합니다.
+    (값이 바뀐 행은 '새 내용'과 '사라진 내용'에 한 번씩 잡힙니다.)
+    """
+    conn = open_history_store(path)
+    try:
+        versions = conn.execute(
+            "SELECT id, name, created_at, n_rows FROM versions WHERE blob_format = ? ORDER BY id DESC LIMIT ?",
+            (HISTORY_BLOB_FORMAT, int(last_n))
+        ).fetchall()[::-1]
+        if not versions:
+            return pd.DataFrame()
+        ids = [v[0] for v in versions]
+        cursor = conn.execute(
+            f"SELECT version_id, row_digest FROM version_rows WHERE version_id IN ({','.join('?' * len(ids))}) ORDER BY version_id, pos",
+            ids
+        )
+        counters = groupby(cursor, key=lambda r: r[0])
+        pending = next(counters, None)
+        records = []
+        prev = None
+        for version_id, name, created_at, n_rows in versions:
+            current = Counter()
+            if pending is not None and pending[0] == version_id:
+                current = Counter(digest for _, digest in pending[1])
+                pending = next(counters, None)
+            record = {"버전": version_id, "이름": name, "저장 시각": pd.to_datetime(created_at, unit="s").floor("s"), "행 수": n_rows}
+            if prev is not None:
+                kept = sum((current & prev).values())
+                record["유지"] = kept
+                record["새 내용"] = sum(current.values()) - kept
+                record["사라진 내용"] = sum(prev.values()) - kept
+            records.append(record)
+            prev = current
+    finally:
+        conn.close()
+    return pd.DataFrame(records, columns=["버전", "이름", "저장 시각", "행 수", "유지", "새 내용", "사라진 내용"])
+
+# ----------------------- 결과 내보내기 -----------------------
+# 결과 표들을 하나의 형식("구분" 열로 종류 표시)으로 맞춰 청크 단위로 파일에 씁니다.
+# 전체를 합친 표나 메모리상의 파일 내용을 만들지 않으므로 결과 크기와 무관하게 메모리 사용량이 일정합니다.
+EXPORT_DIR = os.environ.get("EXPORT_DIR") or None  # None = 이 프로세스의 비공개 작업 폴더(SpillStore) 안
+EXPORT_KEEP_HOURS = float(os.environ.get("EXPORT_KEEP_HOURS", "24"))
+EXPORT_CHUNK_ROWS = 50000
+EXPORT_COLUMNS = ["구분", "기준행", "비교행", "일치열수", "변경요약", "열", "변경종류", "이전 값", "이후 값", "이전 색", "이후 색"]
+EXPORT_KINDS = [
+    ("df_unchanged", "동일"),
+    ("df_changes", "변경"),
+    ("df_removed", "제거"),
+    ("df_added", "추가"),
+    ("df_cell_changes", "셀변경"),
+]
+EXPORT_FORMATS = {"CSV": "csv", "JSON Lines": "jsonl"}
+if pq is not None:
+    EXPORT_FORMATS["Parquet"] = "parquet"
+    EXPORT_PARQUET_SCHEMA = pa.schema(
+        [(c, pa.int64()) if c in ("기준행", "비교행", "일치열수") else (c, pa.string()) for c in EXPORT_COLUMNS]
+    )
+
+def _iter_frame_chunks(df, chunk_rows):
+    if df is None or df.empty:
+        return
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+def iter_export_chunks(frames, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    결과 표들을 EXPORT_COLUMNS 형식의 청크로 차례로 내보냅니다.
+    디스크 사용 모드 결과("result_store")는 화면용 일부가 아니라 결과 파일의 전체 행을 청크 단위로 읽습니다.
+    """
+    store = frames.get("result_store")
+    if store is not None and not os.path.exists(store):
+        raise ValueError("디스크 사용 모드 결과 파일이 만료되어 지워졌습니다. 분석을 다시 실행하세요.")
+    for key, kind in EXPORT_KINDS:
+        chunks = iter_spill_result(store, key, chunk_rows) if store is not None else _iter_frame_chunks(frames.get(key), chunk_rows)
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            chunk = chunk.reindex(columns=EXPORT_COLUMNS)
+            chunk["구분"] = kind
+            for col in ("기준행", "비교행", "일치열수"):
+                chunk[col] = chunk[col].astype("Int64")
+            yield chunk
+
+def _parquet_text(v):
+    if v is None or (isinstance(v, float) and math.isnan(v)) or v is pd.NA:
+        return None
+    return v.isoformat() if isinstance(v, (date, datetime)) else str(v)
+
+def export_root():
+    """내보내기 파일을 두는 이 사용자 전용(0700) 폴더"""
+    return _private_dir(EXPORT_DIR) if EXPORT_DIR else spill_store.path
+
+def _export_prefix():
+    # 작업 폴더 이름은 프로세스마다 다르므로 파일 이름에 넣어 이 프로세스가 만든 파일만 구분
+    return f"excel_compare_{os.path.basename(spill_store.path).rsplit('-', 1)[-1]}_"
+
+def new_export_path(fmt):
+    """이 프로세스의 새 내보내기 파일 경로"""
+    return os.path.join(export_root(), f"{_export_prefix()}{uuid.uuid4().hex[:8]}.{fmt}")
+
+def prune_exports(max_age_hours=EXPORT_KEEP_HOURS, root=None):
+    """
+    이 프로세스가 만든 내보내기 파일 중 마지막 수정 후 max_age_hours가 지난 것을 지웁니다. 지운 개수를 반환합니다.
+    (EXPORT_DIR을 다른 프로세스와 함께 써도 다른 프로세스의 파일은 건드리지 않음)
+    """
+    root = root or export_root()
+    prefix = _export_prefix()
+    try:
+        names = [name for name in os.listdir(root) if name.startswith(prefix)]
+    except FileNotFoundError:
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+def export_results(frames, fmt, path, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    결과 표들을 fmt("csv", "jsonl", "parquet") 형식으로 path에 청크 단위로 씁니다. 쓴 행 수를 반환합니다.
+    Parquet은 셀 값의 타입이 섞여 있으므로 값/색 열을 문자열로 저장합니다.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    n_rows = 0
+    try:
+        if fmt == "csv":
+            # 엑셀에서 바로 열어도 한글이 깨지지 않도록 BOM 포함
+            with open(tmp_path, "w", encoding="utf-8-sig", newline="") as f:
+                pd.DataFrame(columns=EXPORT_COLUMNS).to_csv(f, index=False)
+                for chunk in iter_export_chunks(frames, chunk_rows):
+                    chunk.to_csv(f, header=False, index=False)
+                    n_rows += len(chunk)
+        elif fmt == "jsonl":
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for chunk in iter_export_chunks(frames, chunk_rows):
+                    text = chunk.to_json(orient="records", lines=True, force_ascii=False, date_format="iso",
+                                         default_handler=str)
+                    f.write(text if text.endswith("\n") else text + "\n")
+                    n_rows += len(chunk)
+        elif fmt == "parquet":
+            if pq is None:
+                raise ValueError("Parquet 내보내기에는 pyarrow 패키지가 필요합니다.")
+            writer = pq.ParquetWriter(tmp_path, EXPORT_PARQUET_SCHEMA)
+            try:
+                for chunk in iter_export_chunks(frames, chunk_rows):
+                    for col in ("변경요약", "열", "변경종류", "이전 값", "이후 값", "이전 색", "이후 색"):
+                        chunk[col] = chunk[col].map(_parquet_text).astype(object)
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=EXPORT_PARQUET_SCHEMA, preserve_index=False))
+                    n_rows += len(chunk)
+            finally:
+                writer.close()
+        else:
+            raise ValueError(f"지원하지 않는 내보내기 형식입니다: {fmt}")
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return n_rows
+
+# ----------------------- 백그라운드 분석 작업 -----------------------
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "2"))
+JOB_RESULT_TTL_S = float(os.environ.get("JOB_RESULT_TTL_S", "900"))  # 끝난 뒤 아무도 가져가지 않은 결과 보관 시간
+JOB_FINISHED_LIMIT = 16  # 가져가지 않은 끝난 작업 최대 보관 수 (오래된 것부터 제거)
+
+class AnalysisJob:
+    """백그라운드 분석 작업 한 건의 상태"""
+    def __init__(self, job_id, meta):
+        self.id = job_id
+        self.meta = meta
+        self.status = "queued"  # queued → running → done | failed | cancelled
+        self.progress = 0
+        self.stage = "⏳ 대기 중..."
+        self.messages = []
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.created_at = time.time()
+        self.finished_at = None
+        self.started_at = None
+        self.done = threading.Event()  # 끝나면(성공/실패/취소) 설정
+
+class JobManager:
+    """
+    분석 작업을 작업 스레드 풀에서 실행하고 작업 ID로 상태를 조회합니다 (프로세스 전체 공유).
+    결과를 가져가면(pop) 바로 지우고, 세션이 닫혀 아무도 가져가지 않은 결과는 JOB_RESULT_TTL_S 뒤
+    또는 JOB_FINISHED_LIMIT개를 넘으면 오래된 것부터 지웁니다.
+    """
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, target, meta=None):
+        """target(job)을 백그라운드에서 실행하고 작업을 반환합니다."""
+        job = AnalysisJob(uuid.uuid4().hex[:12], meta or {})
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(target, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def pop(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def _prune(self):
+        """(잠금 안에서 호출) 오래되었거나 한도를 넘은 끝난 작업을 지웁니다."""
+        cutoff = time.time() - JOB_RESULT_TTL_S
+        finished = sorted((job.finished_at, job_id) for job_id, job in self._jobs.items() if job.done.is_set())
+        for i, (finished_at, job_id) in enumerate(finished):
+            if finished_at < cutoff or len(finished) - i > JOB_FINISHED_LIMIT:
+                del self._jobs[job_id]
+
+@st.cache_resource
+def get_job_manager():
+    """프로세스 전체에서 하나만 존재하는 분석 작업 관리자"""
+    return JobManager(ANALYSIS_WORKERS)
+
+job_manager = get_job_manager()
+
+def _execute_job(fn, args, job):
+    """
+    작업 스레드에서 fn(*args)를 실행하고 결과/오류/취소 상태를 작업에 기록합니다.
+    """
+    if job.cancel_event.is_set():
+        job.status = "cancelled"
+        job.finished_at = time.time()
+        job.done.set()
+        return
+    job.status = "running"
+    job.started_at = time.time()
+    _message_sink.messages = job.messages
+
+    def report(pct, text):
+        job.progress = pct
+        job.stage = text
+
+    try:
+        job.result = fn(*args, report=report, cancel_event=job.cancel_event)
+        job.status = "done"
+    except AnalysisCancelled:
+        job.status = "cancelled"
+    except Exception as e:
+        job.error = e
+        job.status = "failed"
+    finally:
+        _message_sink.messages = None
+        job.finished_at = time.time()
+        job.done.set()
+
+# ----------------------- 로컬 폴더에서 파일 가져오기 -----------------------
+def get_excel_files_in_folder(folder_path):
+    """폴더 내의 모든 엑셀/CSV/TSV 파일 목록 반환"""
+    try:
+        if not folder_path:
+            return []
+        
+        # 경로 정규화
+        folder_path = os.path.normpath(folder_path)
+        
+        if not os.path.exists(folder_path):
+            return []
+        
+        if not os.path.isdir(folder_path):
+            return []
+        
+        path = Path(folder_path)
+        excel_files = []
+        
+        try:
+            excel_files = list(path.glob("*.xlsx")) + list(path.glob("*.xls"))
+            excel_files += [f for ext in TEXT_DELIMITERS for f in path.glob(f"*{ext}")]
+        except Exception as e:
+            st.warning(f"파일 검색 중 오류: {e}")
+            return []
+        
+        # 임시 파일 및 숨김 파일 제외
+        excel_files = [f for f in excel_files if not f.name.startswith("~$") and not f.name.startswith(".")]
+        
+        return sorted([f.name for f in excel_files])
+    except Exception as e:
+        st.error(f"폴더 읽기 오류: {e}")
+        return []
+
+# ----------------------- HTTP 서비스 모드 -----------------------
+# `python app.py --serve` 로 실행하면 화면 없이 비교 기능만 JSON HTTP API로 제공합니다.
+# 실제 비교는 분석 작업 스레드 풀(ANALYSIS_WORKERS)에서 실행하고, 대기 중인 요청까지 포함해
+# SERVICE_QUEUE_LIMIT개를 넘으면 바로 503으로 거절합니다.
+SERVICE_HOST = os.environ.get("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("SERVICE_PORT", "8765"))
+SERVICE_QUEUE_LIMIT = int(os.environ.get("SERVICE_QUEUE_LIMIT", "16"))
+SERVICE_TIMEOUT = float(os.environ.get("SERVICE_TIMEOUT", "600"))
+SERVICE_MAX_BODY_MB = int(os.environ.get("SERVICE_MAX_BODY_MB", "200"))
+# {"path": ...}로 지정할 수 있는 파일의 최상위 폴더 (비워 두면 경로 지정을 받지 않고 업로드만 허용)
+SERVICE_FILE_ROOT = os.environ.get("SERVICE_FILE_ROOT")
+SERVICE_BASELINE_LIMIT = 100
+SERVICE_METRICS_WINDOW = 1000
+SERVICE_DEFAULT_OPTIONS = {
+    **NORMALIZATION_DEFAULTS,
+    "max_rows": 100000,
+    "max_cols": 200,
+    "unlimited_pairing": False,
+    "pairing_top_k": 5,
+    "min_match_ratio": 0.0,
+    "spill_mode": False,
+    "memory_budget_mb": 512,
+    "collect_cell_changes": False,
+}
+# 옵션별 (허용 타입, 최솟값, 최댓값) — 범위가 없는 쪽은 None
+SERVICE_OPTION_RULES = {
+    **{k: (bool, None, None) for k in NORMALIZATION_DEFAULTS},
+    "max_rows": (int, 1, None),
+    "max_cols": (int, 1, None),
+    "unlimited_pairing": (bool, None, None),
+    "pairing_top_k": (int, 1, 100),
+    "min_match_ratio": (float, 0.0, 1.0),
+    "spill_mode": (bool, None, None),
+    "memory_budget_mb": (int, 1, None),
+    "collect_cell_changes": (bool, None, None),
+    "include_columns": (str, None, None),
+    "ignore_columns": (str, None, None),
+}
+_SERVICE_RESULT_TABLES = {
+    "unchanged": "df_unchanged",
+    "changes": "df_changes",
+    "removed": "df_removed",
+    "added": "df_added",
+    "cell_changes": "df_cell_changes",
+}
+
+class ServiceError(Exception):
+    """HTTP 상태 코드와 함께 클라이언트에 돌려줄 오류"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ServiceMetrics:
+    """엔드포인트별 요청 수/오류 수와 최근 요청의 지연 시간(대기/실행/전체) 분포"""
+    def __init__(self, window=SERVICE_METRICS_WINDOW):
+        self._window = window
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.in_flight = 0
+        self.started_at = time.time()
+
+    def record(self, endpoint, status, timing):
+        with self._lock:
+            stat = self._stats.setdefault(endpoint, {
+                "count": 0, "errors": 0, "rejected": 0,
+                "samples": {k: deque(maxlen=self._window) for k in ("queue_ms", "run_ms", "total_ms")},
+            })
+            stat["count"] += 1
+            if status == 503:
+                stat["rejected"] += 1
+            elif status >= 400:
+                stat["errors"] += 1
+            for k, v in timing.items():
+                if k in stat["samples"] and v is not None:
+                    stat["samples"][k].append(v)
+
+    @staticmethod
+    def _summary(samples):
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+        return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1], 1),
+                "mean": round(sum(ordered) / len(ordered), 1)}
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {
+                name: {
+                    "count": stat["count"], "errors": stat["errors"], "rejected": stat["rejected"],
+                    **{k: self._summary(v) for k, v in stat["samples"].items()},
+                }
+                for name, stat in self._stats.items()
+            }
+            return {"uptime_s": round(time.time() - self.started_at, 1), "in_flight": self.in_flight,
+                    "workers": ANALYSIS_WORKERS, "queue_limit": SERVICE_QUEUE_LIMIT, "endpoints": endpoints}
+
+def _service_file(spec, field):
+    """
+    요청의 파일 지정({"path": ...} 또는 {"content_base64": ..., "name": ...})을 파일 경로로 바꿉니다.
+    경로는 SERVICE_FILE_ROOT 안의 파일만 받습니다. 업로드 내용은 메모리에 두지 않고 비공개 작업 폴더의 파일로 저장하며,
+    반환값은 (경로, 업로드로 만든 파일인지 여부)입니다 (업로드 파일은 다 쓴 쪽에서 지움).
+    """
+    if not isinstance(spec, dict):
+        raise ServiceError(400, f"'{field}'에는 path 또는 content_base64가 필요합니다.")
+    if spec.get("path"):
+        if not SERVICE_FILE_ROOT:
+            raise ServiceError(403, "경로 지정이 허용되지 않습니다 (SERVICE_FILE_ROOT 미설정). content_base64로 보내세요.")
+        root = os.path.realpath(SERVICE_FILE_ROOT)
+        path = os.path.realpath(os.path.join(root, str(spec["path"])))
+        try:
+            inside = os.path.commonpath([root, path]) == root
+        except ValueError:  # 다른 드라이브
+            inside = False
+        if not inside:
+            raise ServiceError(403, f"SERVICE_FILE_ROOT 밖의 파일입니다: {spec['path']}")
+        if not os.path.isfile(path):
+            raise ServiceError(404, f"파일을 찾을 수 없습니다: {spec['path']}")
+        return path, False
+    if spec.get("content_base64"):
+        try:
+            content = base64.b64decode(spec["content_base64"], validate=True)
+        except (ValueError, TypeError):
+            raise ServiceError(400, f"'{field}.content_base64'를 해석할 수 없습니다.")
+        # 확장자로 형식을 판별하므로 알려진 확장자만 유지
+        suffix = os.path.splitext(str(spec.get("name") or ""))[1].lower()
+        path = spill_store.new_path("upload", suffix=suffix if suffix in (".xlsx", ".csv", ".tsv") else ".xlsx")
+        with open(path, "wb") as f:
+            f.write(content)
+        return path, True
+    raise ServiceError(400, f"'{field}'에는 path 또는 content_base64가 필요합니다.")
+
+def _service_object(value, field):
+    """요청의 field 값이 JSON 객체(없으면 빈 객체)인지 확인합니다."""
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ServiceError(400, f"'{field}'는 JSON 객체여야 합니다.")
+    return value
+
+def _service_number(value, field, kind, low=None, high=None):
+    """
+    요청 값이 kind(int/float) 숫자이고 [low, high] 범위 안인지 확인합니다 (논리값은 숫자로 받지 않음).
+    float 자리에는 정수도 받습니다.
+    """
+    kinds = (int, float) if kind is float else (int,)
+    if isinstance(value, bool) or not isinstance(value, kinds):
+        raise ServiceError(400, f"'{field}'는 {'숫자' if kind is float else '정수'}여야 합니다: {value!r}")
+    if (low is not None and value < low) or (high is not None and value > high):
+        bounds = f"{low} 이상이어야" if high is None else f"{low}~{high} 범위여야"
+        raise ServiceError(400, f"'{field}'는 {bounds} 합니다: {value!r}")
+    return value
+
+def _check_service_options(raw):
+    """요청 옵션 값의 타입과 범위를 SERVICE_OPTION_RULES로 확인합니다."""
+    for name, value in raw.items():
+        kind, low, high = SERVICE_OPTION_RULES[name]
+        field = f"options.{name}"
+        if kind in (int, float):
+            _service_number(value, field, kind, low, high)
+        elif not isinstance(value, kind):
+            raise ServiceError(400, f"'{field}'는 {'true/false여야' if kind is bool else '문자열이어야'} 합니다: {value!r}")
+
+def _service_row_filter(value):
+    """요청의 row_filter 객체({"column", "op", "value"})를 parse_row_filter 형식으로 바꿉니다."""
+    row_filter = _service_object(value, "options.row_filter")
+    if not row_filter:
+        return None
+    unknown = set(row_filter) - {"column", "op", "value"}
+    if unknown:
+        raise ServiceError(400, f"'options.row_filter'의 알 수 없는 항목: {', '.join(sorted(unknown))}")
+    op_labels = {code: label for label, code in ROW_FILTER_OPS.items()}
+    op = row_filter.get("op", "eq")
+    if op not in op_labels:
+        raise ServiceError(400, f"'options.row_filter.op'는 {', '.join(op_labels)} 중 하나여야 합니다: {op!r}")
+    column, filter_value = row_filter.get("column"), row_filter.get("value")
+    if not isinstance(column, str) or not column.strip():
+        raise ServiceError(400, "'options.row_filter.column'에는 열 문자(예: \"C\")가 필요합니다.")
+    if isinstance(filter_value, bool) or not isinstance(filter_value, (str, int, float)) or not str(filter_value).strip():
+        raise ServiceError(400, "'options.row_filter.value'에는 문자열 또는 숫자 값이 필요합니다.")
+    try:
+        return parse_row_filter(column, op_labels[op], str(filter_value))
+    except ValueError as e:
+        raise ServiceError(400, f"'options.row_filter' 오류: {e}")
+
+def service_options(raw):
+    """요청 옵션을 분석 옵션으로 바꿉니다 (화면 설정과 같은 키, 열/행 선택은 화면과 같은 형식의 문자열)."""
+    raw = dict(_service_object(raw, "options"))
+    row_filter = raw.pop("row_filter", None)
+    unknown = set(raw) - set(SERVICE_OPTION_RULES)
+    if unknown:
+        raise ServiceError(400, f"알 수 없는 옵션: {', '.join(sorted(unknown))}")
+    _check_service_options(raw)
+    options = {**SERVICE_DEFAULT_OPTIONS, **{k: v for k, v in raw.items() if k in SERVICE_DEFAULT_OPTIONS}}
+    try:
+        options["column_selection"] = parse_column_selection(raw.get("include_columns", ""), raw.get("ignore_columns", ""))
+    except ValueError as e:
+        raise ServiceError(400, f"옵션 오류: {e}")
+    options["row_filter"] = _service_row_filter(row_filter)
+    return options
+
+def prepare_baseline(file, sheet_name, options, report=None, cancel_event=None):
+    """기준 파일을 읽어 공유 캐시(또는 디스크 사용 모드의 SQLite 파일)에 올리고 (키, 행 수, 열 목록)을 반환합니다."""
+    if report is not None:
+        report(5, "📦 기준 데이터 준비 중...")
+    if options.get("spill_mode"):
+        key, _, meta = get_or_build_spill_baseline(
+            file, sheet_name, options, options["max_rows"], options["max_cols"], cancel_event=cancel_event,
+            column_selection=options.get("column_selection"), row_filter=options.get("row_filter")
+        )
+        return key, meta["rows"], [get_column_letter(c) for c in selected_columns(options.get("column_selection"), meta["n_cols"])]
+    key, baseline = get_or_build_baseline(
+        file, sheet_name, options, options["max_rows"], options["max_cols"],
+        column_selection=options.get("column_selection"), row_filter=options.get("row_filter")
+    )
+    return key, len(baseline["rows"]), baseline["columns"]
+
+def frames_to_json(frames, limit=None):
+    """결과 표들을 JSON으로 보낼 수 있는 {"summary": 건수, "results": 레코드 목록}으로 바꿉니다."""
+    summary = {}
+    results = {}
+    for name, key in _SERVICE_RESULT_TABLES.items():
+        df = frames.get(key)
+        if df is None:
+            continue
+        summary[name] = result_count(frames, key)
+        if limit is not None:
+            df = df.head(limit)
+        results[name] = json.loads(df.to_json(orient="records", force_ascii=False, date_format="iso", default_handler=str))
+    return {"summary": summary, "results": results}
+
+class CompareService:
+    """
+    HTTP 요청을 분석 작업으로 바꿔 실행합니다. 동시에 받아 두는 요청 수를 제한하고 지연 시간을 기록합니다.
+    """
+    def __init__(self, jobs, queue_limit=SERVICE_QUEUE_LIMIT, timeout=SERVICE_TIMEOUT):
+        self.jobs = jobs
+        self.timeout = timeout
+        self.metrics = ServiceMetrics()
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._baselines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def run(self, fn, args, cleanup=None):
+        """
+        fn(*args)를 작업 풀에서 실행하고 (결과, 메시지, 대기 ms, 실행 ms)를 반환합니다.
+        cleanup(성공 여부)은 작업이 실제로 끝난 뒤 한 번 호출합니다. 시간 초과로 취소한 작업도 취소를 확인하고
+        멈출 때까지는 요청 자리를 계속 차지하므로, 자리 반환과 cleanup은 그때까지 미룹니다.
+        """
+        if not self._slots.acquire(blocking=False):
+            if cleanup is not None:
+                cleanup(False)
+            raise ServiceError(503, "요청이 많아 처리할 수 없습니다. 잠시 후 다시 시도하세요.")
+        with self._lock:
+            self.metrics.in_flight += 1
+        try:
+            job = self.jobs.submit(partial(_execute_job, fn, args), meta={"source": "service"})
+        except BaseException:
+            self._release(None, cleanup, False)
+            raise
+        if not job.done.wait(self.timeout):
+            job.cancel_event.set()
+            threading.Thread(target=self._release_when_done, args=(job, cleanup), name="service-cancel", daemon=True).start()
+            raise ServiceError(504, f"{self.timeout:.0f}초 안에 끝나지 않아 취소했습니다.")
+        self._release(job, cleanup, job.status == "done")
+        queue_ms = ((job.started_at or job.finished_at) - job.created_at) * 1000
+        run_ms = (job.finished_at - (job.started_at or job.finished_at)) * 1000
+        if job.status == "failed":
+            if isinstance(job.error, ServiceError):
+                raise job.error
+            raise ServiceError(422 if isinstance(job.error, (ValueError, KeyError)) else 500, str(job.error))
+        if job.status == "cancelled":
+            raise ServiceError(504, "작업이 취소되었습니다.")
+        return job.result, job.messages, queue_ms, run_ms
+
+    def _release(self, job, cleanup, succeeded):
+        """끝난 작업의 요청 자리를 돌려주고 cleanup을 호출합니다."""
+        try:
+            if job is not None:
+                self.jobs.pop(job.id)
+            if cleanup is not None:
+                cleanup(succeeded)
+        finally:
+            with self._lock:
+                self.metrics.in_flight -= 1
+            self._slots.release()
+
+    def _release_when_done(self, job, cleanup):
+        job.done.wait()
+        self._release(job, cleanup, False)
+
+    def create_baseline(self, body):
+        options = service_options(body.get("options"))
+        file, uploaded = _service_file(body.get("file"), "file")
+        sheet = body.get("sheet")
+
+        def cleanup(succeeded):
+            # 등록하지 못한 기준 데이터의 업로드 파일만 지움 (등록된 파일은 기준 데이터를 지울 때 정리)
+            if uploaded and not succeeded:
+                _remove_quietly(file)
+
+        (key, n_rows, columns), messages, queue_ms, run_ms = self.run(prepare_baseline, (file, sheet, options), cleanup)
+        baseline_id = uuid.uuid4().hex[:12]
+        evicted = []
+        with self._lock:
+            self._baselines[baseline_id] = {"file": file, "uploaded": uploaded, "sheet": sheet, "options": options, "key": key}
+            while len(self._baselines) > SERVICE_BASELINE_LIMIT:
+                evicted.append(self._baselines.popitem(last=False)[1])
+        for base in evicted:
+            self._discard(base)
+        return {"baseline_id": baseline_id, "rows": n_rows, "columns": columns, "messages": messages}, queue_ms, run_ms
+
+    def delete_baseline(self, baseline_id):
+        with self._lock:
+            base = self._baselines.pop(baseline_id, None)
+        if base is None:
+            raise ServiceError(404, f"기준 데이터가 없습니다: {baseline_id}")
+        self._discard(base)
+        return {"deleted": baseline_id}, None, None
+
+    @staticmethod
+    def _discard(base):
+        # 이미 읽어 둔 기준 데이터는 캐시에 남지만, 캐시에서 빠진 뒤 다시 읽을 파일은 없어짐 (업로드 파일만 지움)
+        if base["uploaded"]:
+            _remove_quietly(base["file"])
+
+    def compare(self, body):
+        limit = body.get("limit")
+        if limit is not None:
+            _service_number(limit, "limit", int, 0)
+        if body.get("baseline_id"):
+            with self._lock:
+                base = self._baselines.get(body["baseline_id"])
+            if base is None:
+                raise ServiceError(404, f"기준 데이터가 없습니다: {body['baseline_id']}")
+            # 정규화/범위 옵션은 기준 데이터를 만들 때의 값을 쓰고, 페어링 옵션만 요청 값으로 덮어씀
+            pairing = {k: v for k, v in _service_object(body.get("options"), "options").items()
+                       if k in ("unlimited_pairing", "pairing_top_k", "min_match_ratio", "memory_budget_mb", "collect_cell_changes")}
+            _check_service_options(pairing)
+            options = {**base["options"], **pairing}
+            old_file, old_sheet, key = base["file"], base["sheet"], base["key"]
+            uploads = []
+        else:
+            options = service_options(body.get("options"))
+            old_file, old_uploaded = _service_file(body.get("old"), "old")
+            old_sheet, key = body.get("old_sheet"), None
+            uploads = [old_file] if old_uploaded else []
+        try:
+            new_file, new_uploaded = _service_file(body.get("new"), "new")
+        except BaseException:
+            for path in uploads:
+                _remove_quietly(path)
+            raise
+        if new_uploaded:
+            uploads.append(new_file)
+
+        def compare_job(report=None, cancel_event=None):
+            baseline_key = key
+            if baseline_key is None:
+                baseline_key = prepare_baseline(old_file, old_sheet, options, report, cancel_event)[0]
+            return run_comparison(old_file, old_sheet, baseline_key, new_file, body.get("new_sheet"), options,
+                                  report, cancel_event)
+
+        def cleanup(succeeded):
+            for path in uploads:
+                _remove_quietly(path)
+
+        frames, messages, queue_ms, run_ms = self.run(compare_job, (), cleanup)
+        return {**frames_to_json(frames, limit), "messages": messages}, queue_ms, run_ms
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    service = None  # serve_http()에서 설정
+    server_version = "ExcelCompare/1.0"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > SERVICE_MAX_BODY_MB * 1024 * 1024:
+            raise ServiceError(413, f"요청 본문이 {SERVICE_MAX_BODY_MB}MB를 넘습니다.")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise ServiceError(400, "요청 본문이 올바른 JSON이 아닙니다.")
+        if not isinstance(body, dict):
+            raise ServiceError(400, "요청 본문은 JSON 객체여야 합니다.")
+        return body
+
+    def log_request(self, code="-", size="-"):
+        # 접근 로그에 요청별 처리 시간 포함
+        self.log_message('"%s" %s %.1fms', self.requestline, str(code), (time.time() - self._started) * 1000)
+
+    def _dispatch(self, method):
+        started = self._started = time.time()
+        path = self.path.split("?", 1)[0].rstrip("/")
+        endpoint = f"{method} {path}"
+        queue_ms = run_ms = None
+        try:
+            if method == "GET" and path == "/health":
+                payload = {"status": "ok"}
+            elif method == "GET" and path == "/metrics":
+                payload = self.service.metrics.snapshot()
+            elif method == "POST" and path == "/baselines":
+                payload, queue_ms, run_ms = self.service.create_baseline(self._read_json())
+            elif method == "DELETE" and path.startswith("/baselines/"):
+                endpoint = f"{method} /baselines/{{id}}"
+                payload, queue_ms, run_ms = self.service.delete_baseline(path.rsplit("/", 1)[1])
+            elif method == "POST" and path == "/compare":
+                payload, queue_ms, run_ms = self.service.compare(self._read_json())
+            else:
+                raise ServiceError(404, f"알 수 없는 경로: {method} {path}")
+            status = 200
+        except ServiceError as e:
+            status, payload = e.status, {"error": str(e)}
+        except Exception as e:
+            status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+        timing = {"queue_ms": queue_ms, "run_ms": run_ms, "total_ms": (time.time() - started) * 1000}
+        if path != "/metrics":
+            self.service.metrics.record(endpoint, status, timing)
+        if isinstance(payload, dict) and endpoint not in ("GET /health", "GET /metrics"):
+            payload["timing"] = {k: (round(v, 1) if v is not None else None) for k, v in timing.items()}
+        self._send_json(status, payload)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+def serve_http(host=SERVICE_HOST, port=SERVICE_PORT):
+    """비교 HTTP 서비스를 실행합니다 (Ctrl+C로 종료)."""
+    _ServiceHandler.service = CompareService(job_manager)
+    server = ThreadingHTTPServer((host, port), _ServiceHandler)
+    print(f"엑셀 비교 서비스: http://{host}:{port} (작업 {ANALYSIS_WORKERS}개, 대기 한도 {SERVICE_QUEUE_LIMIT}개)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__" and "--serve" in sys.argv:
+    _port_arg = sys.argv[sys.argv.index("--port") + 1] if "--port" in sys.argv[:-1] else SERVICE_PORT
+    serve_http(port=int(_port_arg))
+    sys.exit(0)
+
+# ----------------------- 폴더 감시 -----------------------
+# 새 버전이 주기적으로 들어오는 공유 폴더를 백그라운드에서 감시하여, 파일이 도착하면 바로 읽고
+# 직전 버전과 비교해 둡니다. 화면을 열었을 때는 이미 끝난 결과만 보여주면 됩니다.
+WATCH_INTERVAL_S = float(os.environ.get("WATCH_INTERVAL_S", "10"))
+WATCH_DEBOUNCE_S = float(os.environ.get("WATCH_DEBOUNCE_S", "15"))
+WATCH_FOLDERS = [p for p in os.environ.get("WATCH_FOLDERS", "").split(os.pathsep) if p]
+WATCH_HISTORY = 5  # 폴더마다 보관할 최근 비교 결과 수
+
+def folder_snapshot(folder_path):
+    """폴더의 엑셀 파일별 (크기, 수정 시각)을 반환합니다."""
+    snapshot = {}
+    for name in get_excel_files_in_folder(folder_path):
+        path = os.path.join(folder_path, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue  # 목록을 만든 뒤 지워진 파일
+        snapshot[path] = (stat.st_size, stat.st_mtime)
+    return snapshot
+
+class FolderWatch:
+    """폴더 하나의 감시 상태"""
+    def __init__(self, folder_path, sheet_name, options):
+        self.folder_path = folder_path
+        self.sheet_name = sheet_name
+        self.options = options
+        self.status = "watching"  # watching → comparing → watching ... → stopped
+        self.stage = ""
+        self.pending = {}     # 경로 → ((크기, 수정 시각), 처음 본 시각): 아직 쓰는 중일 수 있는 파일
+        self.versions = []    # 읽기를 마친 버전 {"path", "name", "sheet", "key", "signature"} (도착 순)
+        self.skipped = {}     # 감시 시작 전부터 있던 오래된 파일 → (크기, 수정 시각)
+        self.failed = {}      # 경로 → ((크기, 수정 시각), 오류 메시지)
+        self.diffs = deque(maxlen=WATCH_HISTORY)
+        self.last_scan = None
+        self.error = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+def _watch_ingest(watch, path, signature):
+    """도착한 파일을 읽어 기준 데이터로 만들고, 직전 버전이 있으면 비교 결과를 남깁니다."""
+    options = watch.options
+    name = os.path.basename(path)
+    watch.status = "comparing"
+    watch.stage = f"📖 {name} 읽는 중..."
+    messages = []
+    _message_sink.messages = messages
+    try:
+        sheet = _batch_sheet_name(path, watch.sheet_name)
+        # 다음 버전의 기준이 되므로 공유 캐시(디스크 사용 모드면 SQLite)에 기준 데이터로 만들어 둠
+        if options.get("spill_mode"):
+            key, _, _ = get_or_build_spill_baseline(
+                path, sheet, options, options["max_rows"], options["max_cols"], cancel_event=watch.stop_event,
+                column_selection=options.get("column_selection"), row_filter=options.get("row_filter")
+            )
+        else:
+            key, _ = get_or_build_baseline(
+                path, sheet, options, options["max_rows"], options["max_cols"],
+                column_selection=options.get("column_selection"), row_filter=options.get("row_filter")
+            )
+        version = {"path": path, "name": name, "sheet": sheet, "key": key, "signature": signature}
+        previous = watch.versions[-1] if watch.versions else None
+        if previous is not None:
+            started = time.time()
+
+            def report(pct, text):
+                watch.stage = f"{previous['name']} → {name}: {text}"
+
+            # 같은 경로에 덮어쓴 경우에도 이전 버전은 저장해 둔 키(내용 해시)로 캐시/체크포인트에서 찾음
+            try:
+                frames = run_comparison(previous["path"], previous["sheet"], previous["key"], path, sheet, options,
+                                        report=report, cancel_event=watch.stop_event)
+            except StaleSourceError:
+                # 이전 버전이 캐시에서 빠진 뒤 덮어써져 내용을 더 볼 수 없음: 비교 없이 새 버전부터 다시 시작
+                watch.versions.append(version)
+                watch.failed[path] = (signature, f"이전 버전({previous['name']}) 내용을 찾을 수 없어 비교하지 않았습니다.")
+                return
+            watch.diffs.append({
+                "old": previous,
+                "new": version,
+                "frames": frames,
+                "messages": messages,
+                "elapsed": time.time() - started,
+                "finished_at": time.time(),
+            })
+        watch.versions.append(version)
+        watch.failed.pop(path, None)
+    except AnalysisCancelled:
+        raise
+    except Exception as e:
+        # 잘못된 파일은 내용이 바뀔 때까지 다시 시도하지 않음
+        watch.failed[path] = (signature, str(e))
+    finally:
+        _message_sink.messages = None
+        watch.status = "watching"
+        watch.stage = ""
+
+def _watch_scan(watch):
+    """
+    폴더를 한 번 확인합니다. 크기/수정 시각이 WATCH_DEBOUNCE_S 동안 그대로인 파일만 다 쓴 것으로 보고
+    수정 시각 순서대로 읽어 비교합니다.
+    """
+    now = time.time()
+    snapshot = folder_snapshot(watch.folder_path)
+    known = {v["path"]: v["signature"] for v in watch.versions}
+    known.update(watch.skipped)
+    arrivals = []
+    for path, signature in snapshot.items():
+        if known.get(path) == signature or watch.failed.get(path, (None,))[0] == signature:
+            continue
+        seen = watch.pending.get(path)
+        if seen is None or seen[0] != signature:
+            watch.pending[path] = (signature, now)  # 처음 보았거나 아직 쓰는 중이면 대기 시간을 다시 시작
+        elif now - seen[1] >= WATCH_DEBOUNCE_S and now - signature[1] >= WATCH_DEBOUNCE_S:
+            arrivals.append((signature[1], path, signature))
+    for path in [p for p in watch.pending if p not in snapshot]:
+        del watch.pending[path]
+
+    arrivals.sort()
+    if not watch.versions and len(arrivals) > 2:
+        # 처음 시작할 때는 가장 최근 두 버전만 비교하고 나머지 기존 파일은 건너뜀
+        for _, path, signature in arrivals[:-2]:
+            watch.skipped[path] = signature
+            del watch.pending[path]
+        arrivals = arrivals[-2:]
+    for _, path, signature in arrivals:
+        _check_cancelled(watch.stop_event)
+        del watch.pending[path]
+        _watch_ingest(watch, path, signature)
+    watch.last_scan = now
+
+def _watch_loop(watch):
+    while not watch.stop_event.is_set():
+        try:
+            _watch_scan(watch)
+            watch.error = None
+        except AnalysisCancelled:
+            break
+        except Exception as e:
+            watch.error = str(e)
+        watch.stop_event.wait(WATCH_INTERVAL_S)
+    watch.status = "stopped"
+
+class FolderWatcher:
+    """폴더별 감시 스레드를 관리합니다 (프로세스 전체 공유)."""
+    def __init__(self):
+        self._watches = {}
+        self._lock = threading.Lock()
+
+    def start(self, folder_path, sheet_name, options):
+        """감시를 시작합니다. 같은 폴더를 이미 감시 중이면 새 설정으로 다시 시작합니다."""
+        folder_path = os.path.normpath(os.path.abspath(folder_path))
+        self.stop(folder_path)
+        watch = FolderWatch(folder_path, sheet_name, dict(options))
+        watch.thread = threading.Thread(target=_watch_loop, args=(watch,), daemon=True,
+                                        name=f"watch-{os.path.basename(folder_path)}")
+        with self._lock:
+            self._watches[folder_path] = watch
+        watch.thread.start()
+        return watch
+
+    def stop(self, folder_path):
+        with self._lock:
+            watch = self._watches.pop(os.path.normpath(os.path.abspath(folder_path)), None)
+        if watch is not None:
+            watch.stop_event.set()
+
+    def get(self, folder_path):
+        with self._lock:
+            return self._watches.get(os.path.normpath(os.path.abspath(folder_path)))
+
+@st.cache_resource
+def get_folder_watcher():
+    """프로세스 전체에서 하나만 존재하는 폴더 감시 관리자 (WATCH_FOLDERS 폴더는 서버 시작 때 바로 감시)"""
+    watcher = FolderWatcher()
+    for folder in WATCH_FOLDERS:
+        if os.path.isdir(folder):
+            watcher.start(folder, None, SERVICE_DEFAULT_OPTIONS)
+    return watcher
+
+folder_watcher = get_folder_watcher()
+
+# ----------------------- UI -----------------------
+st.title("📘 엑셀 행 재정렬 안전 비교 (전체열 + 색상)")
+st.caption("기준 파일과 비교 파일을 선택하면, 행 순서가 달라도 전체 열에서 **값 변경**과 **배경색(채우기) 변경**을 잡아냅니다.")
+
+# 대용량 파일 안내
+with st.expander("ℹ️ 사용 안내 및 성능 정보", expanded=False):
+    st.markdown("""
+    ### 📊 처리 제한 설정
+    
+    **기본 설정 (권장):**
+    - 최대 행 수: 100,000행
+    - 최대 열 수: 200열
+    - 페어링: 제한 모드 (빠름)
+    
+    **설정 조정:**
+    - 설정 메뉴에서 최대 행/열 수를 조정할 수 있습니다
+    - '무제한 페어링' 체크 시 모든 행을 정확히 매칭 (느릴 수 있음)
+    
+    ### ⚡ 페어링 알고리즘
+    
+    **제한 모드 (기본):**
+    - 1단계: 정확히 일치하는 행은 해시 기반으로 빠르게 매칭
+    - 2단계: 일치하지 않는 행은 최대 100,000개 조합까지 유사도 비교
+    - 기준 행마다 일치 열이 많은 상위 k개 후보만 유지 (메모리 절약), 최소 일치 열 비율 미만은 제외
+    - 속도: ⚡⚡⚡ 빠름
+    
+    **무제한 모드:**
+    - 모든 가능한 조합을 전부 확인하여 최적의 매칭 찾기
+    - 매우 정확하지만 시간이 오래 걸릴 수 있음
+    - 속도: 🐌 느림 (행이 많을수록 느려짐)
+    
+    ### 💡 권장 사용법
+    
+    - **일반적인 경우:** 기본 설정 사용
+    - **대용량 파일 (10만 행 이상):** 제한 모드 유지
+    - **정확도가 중요한 경우:** 무제한 페어링 사용
+    - **파일이 매우 큰 경우:** 행/열 제한을 조정하여 필요한 범위만 처리
+    - **메모리보다 큰 파일:** '디스크 사용 모드'를 켜면 임시 SQLite 파일에 나눠 저장하며 메모리 예산 안에서 처리
+    """)
+
+with st.expander("⚙️ 설정", expanded=True):
+    col_opt1, col_opt2, col_opt3 = st.columns(3)
+    with col_opt1:
+        trim_spaces = st.checkbox("앞뒤 공백 무시", value=True)
+        case_sensitive = st.checkbox("대소문자 구분", value=True)
+        canonical_numbers = st.checkbox("숫자 형식 통일", value=True, help="1, 1.0, '1', '1,000'처럼 표현만 다른 숫자를 같은 값으로 봅니다")
+        canonical_dates = st.checkbox("날짜 형식 통일", value=True,
+                                      help="시간이 00:00인 날짜/시간과 날짜, 'YYYY-MM-DD' 문자열을 같은 값으로 봅니다. "
+                                           "'YYYY-MM-DD HH:MM:SS', 'HH:MM:SS' 문자열도 날짜/시간·시각 값과 같게 봅니다")
+        canonical_bools = st.checkbox("논리값 형식 통일", value=True, help="'TRUE'/'FALSE' 문자열(CSV 등)과 엑셀 논리값을 같은 값으로 봅니다")
+        collapse_spaces = st.checkbox("연속 공백 하나로", value=False, help="문자열 안의 연속 공백/탭/줄바꿈을 공백 하나로 봅니다")
+        unicode_nfc = st.checkbox("유니코드 정규화 (NFC)", value=True, help="자모가 분리된 한글 등 표현만 다른 유니코드 문자열을 같은 값으로 봅니다")
+    with col_opt2:
+        # 파일 입력 방식 선택
+        input_mode = st.radio("파일 입력 방식", ["로컬 폴더", "파일 업로드"], horizontal=True)
+        include_columns_text = st.text_input("비교할 열", value="", placeholder="예: A, C:F",
+                                             help="지정한 열만 읽고 비교합니다 (비워 두면 모든 열)")
+        ignore_columns_text = st.text_input("무시할 열", value="", placeholder="예: B, H:J",
+                                            help="지정한 열은 읽지 않고 비교에서도 제외합니다")
+        st.write("**행 필터**")
+        filter_col_text = st.text_input("필터 열", value="", placeholder="예: C", help="이 열의 값이 조건에 맞는 행만 읽고 비교합니다")
+        filter_op_label = st.selectbox("조건", list(ROW_FILTER_OPS))
+        filter_value_text = st.text_input("필터 값", value="", placeholder="같음: 서울 / 목록: 서울, 부산 / 범위: 100~200",
+                                          help="비워 두면 필터를 적용하지 않습니다")
+    with col_opt3:
+        # 처리 제한 설정
+        st.write("**처리 제한 설정**")
+        max_rows = st.number_input("최대 행 수", min_value=1000, max_value=10000000, value=100000, step=1000, 
+                                    help="처리할 최대 행 수 (기본: 100,000행, 엑셀은 최대 1,048,576행이며 CSV/TSV는 그 이상도 가능)")
+        max_cols = st.number_input("최대 열 수", min_value=10, max_value=1000, value=200, step=10,
+                                    help="처리할 최대 열 수 (기본: 200열)")
+        if "pending_unlimited_pairing" in st.session_state:
+            st.session_state["unlimited_pairing_input"] = st.session_state.pop("pending_unlimited_pairing")
+        unlimited_pairing = st.checkbox("무제한 페어링", key="unlimited_pairing_input",
+                                        help="체크 시 모든 행을 페어링합니다 (대용량 파일은 느릴 수 있음)")
+        pairing_top_k = st.number_input("행별 후보 수 (k)", min_value=1, max_value=100, value=5, step=1,
+                                        help="유사도 비교 시 기준 행마다 유지할 최대 후보 수 (메모리 사용량 = 행 수 × k)")
+        min_match_ratio = st.slider("최소 일치 열 비율", min_value=0.0, max_value=1.0, value=0.0, step=0.05,
+                                    help="일치하는 열의 비율이 이 값보다 낮은 조합은 변경 후보에서 제외합니다 (0 = 한 열 이상 일치)")
+        spill_mode = st.checkbox("디스크 사용 모드 (대용량)", value=False,
+                                 help="행/후보 쌍을 임시 SQLite 파일에 나눠 저장하여 메모리 사용량을 아래 예산 안으로 유지합니다 (메모리 모드보다 느림)")
+        memory_budget_mb = st.number_input("메모리 예산 (MB)", min_value=64, max_value=16384, value=512, step=64,
+                                           disabled=not spill_mode,
+                                           help="디스크 사용 모드에서 한 번에 메모리에 올릴 청크 크기의 기준")
+        collect_cell_changes = st.checkbox("셀 단위 변경 내역 수집", value=False,
+                                           help="바뀐 셀마다 한 건씩 기록하여 데이터로 내보내기에 포함합니다 (결과가 커지므로 필요할 때만)")
+
+try:
+    column_selection = parse_column_selection(include_columns_text, ignore_columns_text)
+except ValueError as e:
+    st.error(f"❌ {e}")
+    column_selection = None
+try:
+    row_filter = parse_row_filter(filter_col_text, filter_op_label, filter_value_text)
+except ValueError as e:
+    st.error(f"❌ {e}")
+    row_filter = None
+
+norm_options = {
+    "trim_spaces": trim_spaces,
+    "case_sensitive": case_sensitive,
+    "canonical_numbers": canonical_numbers,
+    "canonical_dates": canonical_dates,
+    "canonical_bools": canonical_bools,
+    "collapse_spaces": collapse_spaces,
+    "unicode_nfc": unicode_nfc,
+}
+
+def mark_prefetch_intent(side):
+    # 폴더 방식은 페이지를 열 때 기본으로 선택된 파일까지 읽지 않도록, 사용자가 직접 고른 뒤부터 미리 읽음
+    st.session_state[f"prefetch_{side}"] = True
+
+st.subheader("1️⃣ 기준(이전) 파일 선택")
+
+if input_mode == "로컬 폴더":
+    # 현재 작업 디렉토리를 기본값으로 사용
+    default_folder = os.getcwd()
+    folder_path = st.text_input("📁 폴더 경로", value=default_folder, help="엑셀 파일이 있는 폴더 경로를 입력하세요")
+    
+    if folder_path and os.path.exists(folder_path):
+        excel_files = get_excel_files_in_folder(folder_path)
+        
+        if excel_files:
+            c1, c2 = st.columns(2)
+            with c1:
+                selected_old_file = st.selectbox("기준 파일 선택", options=excel_files, key="old_file_select",
+                                                 on_change=mark_prefetch_intent, args=("old",))
+                file_old = os.path.join(folder_path, selected_old_file) if selected_old_file else None
+            with c2:
+                sheet_old = None
+                if file_old:
+                    try:
+                        old_sheet_names = sheet_names(file_old)
+                        if old_sheet_names:
+                            sheet_old = st.selectbox("시트 선택(기준)", options=old_sheet_names, index=0, key="old_sheet",
+                                                     on_change=mark_prefetch_intent, args=("old",))
+                        else:
+                            st.error("시트를 찾을 수 없습니다.")
+                    except Exception as e:
+                        st.error(f"기준 파일 시트 읽기 실패: {e}")
+        else:
+            st.warning("⚠️ 선택한 폴더에 엑셀 파일이 없습니다.")
+            file_old = None
+            sheet_old = None
+    else:
+        st.warning("⚠️ 유효한 폴더 경로를 입력하세요.")
+        file_old = None
+        sheet_old = None
+else:
+    # 파일 업로드 방식
+    c1, c2 = st.columns(2)
+    with c1:
+        file_old = st.file_uploader("기준 엑셀 파일", type=["xlsx", "csv", "tsv"], key="old_allcols",
+                                    help="CSV/TSV는 값만 비교합니다 (배경색 정보 없음)")
+    with c2:
+        sheet_old = None
+        if file_old:
+            try:
+                old_sheet_names = sheet_names(file_old)
+                if old_sheet_names:
+                    sheet_old = st.selectbox("시트 선택(기준)", options=old_sheet_names, index=0)
+                else:
+                    st.error("시트를 찾을 수 없습니다.")
+            except Exception as e:
+                st.error(f"기준 파일 시트 읽기 실패: {e}")
+
+# 파일을 올리거나 직접 고르는 즉시 백그라운드에서 읽기 시작 (디스크 사용 모드는 저장 시 SQLite로 바로 읽음)
+if file_old and sheet_old and not spill_mode and (input_mode != "로컬 폴더" or st.session_state.get("prefetch_old")):
+    show_prefetch_status(prefetch_sheet(file_old, sheet_old, max_rows, max_cols, column_selection, row_filter))
+
+if st.button("✅ 기준 데이터 저장", type="primary", disabled=not (file_old and sheet_old)):
+    try:
+        with st.spinner("기준 파일을 읽는 중..."):
+            if spill_mode:
+                baseline_key, _, spill_meta = get_or_build_spill_baseline(
+                    file_old, sheet_old, norm_options, max_rows, max_cols,
+                    column_selection=column_selection, row_filter=row_filter
+                )
+                n_baseline_rows = spill_meta["rows"]
+                cols = [get_column_letter(c) for c in selected_columns(column_selection, spill_meta["n_cols"])]
+            else:
+                baseline_key, baseline = get_or_build_baseline(
+                    file_old, sheet_old, norm_options, max_rows, max_cols,
+                    column_selection=column_selection, row_filter=row_filter, use_checkpoint=True
+                )
+                n_baseline_rows = len(baseline["rows"])
+                cols = baseline["columns"]
+            
+            if not n_baseline_rows or not cols:
+                st.error("❌ 기준 파일에 데이터가 없습니다.")
+            else:
+                # 세션에는 공유 캐시의 키만 저장 (데이터 자체는 프로세스 전체에서 한 벌)
+                st.session_state["baseline_key"] = baseline_key
+                st.session_state["norm_options"] = norm_options
                 st.session_state["max_rows"] = max_rows
                 st.session_state["max_cols"] = max_cols
                 st.session_state["unlimited_pairing"] = unlimited_pairing
+                st.session_state["pairing_top_k"] = pairing_top_k
+                st.session_state["min_match_ratio"] = min_match_ratio
+                st.session_state["spill_mode"] = spill_mode
+                st.session_state["memory_budget_mb"] = memory_budget_mb
+                st.session_state["column_selection"] = column_selection
+                st.session_state["row_filter"] = row_filter
                 
                 # 원본 파일 정보 저장 (스타일 복사용)
                 st.session_state["old_file_path"] = file_old
                 st.session_state["old_sheet_name"] = sheet_old
 
-                multiset = Counter([row_tuple(r["norm"], cols) for r in old_rows])
-                mapping = defaultdict(list)
-                for idx, r in enumerate(old_rows):
-                    mapping[row_tuple(r["norm"], cols)].append(idx)
-
-                st.session_state["old_rows_norm_multiset"] = multiset
-                st.session_state["old_rows_by_tuple_indices"] = mapping
-                st.success(f"✅ 기준 데이터 저장 완료: {len(old_rows):,} 행, 사용 열: {len(cols)}개 ({cols[0]}~{cols[-1]})")
+                st.success(f"✅ 기준 데이터 저장 완료: {n_baseline_rows:,} 행, 사용 열: {len(cols)}개 ({cols[0]}~{cols[-1]})")
     except Exception as e:
         st.error(f"❌ 기준 파일 처리 중 오류 발생")
         st.exception(e)
 
+# 정규화 옵션만 바뀐 경우: 캐시된 원본 값으로 기준 데이터를 다시 계산 (파일을 다시 읽지 않음)
+if ("baseline_key" in st.session_state and not st.session_state.get("spill_mode")
+        and st.session_state.get("norm_options") != norm_options):
+    try:
+        started = time.time()
+        with st.spinner("정규화 옵션 변경 → 기준 데이터 다시 계산 중..."):
+            # 저장해 둔 원본 키를 그대로 써서 캐시된 원본 값을 재사용 (캐시에서 빠졌으면 내용 해시를 확인한 뒤 다시 읽음)
+            baseline_key, _ = get_or_build_baseline(
+                st.session_state["old_file_path"], st.session_state["old_sheet_name"], norm_options,
+                st.session_state["max_rows"], st.session_state["max_cols"],
+                key=(st.session_state["baseline_key"][0], norm_options_key(norm_options)),
+                column_selection=st.session_state.get("column_selection"), row_filter=st.session_state.get("row_filter")
+            )
+        st.session_state["baseline_key"] = baseline_key
+        st.session_state["norm_options"] = norm_options
+        st.info(f"🔁 정규화 옵션이 바뀌어 기준 데이터를 다시 계산했습니다 ({time.time() - started:.2f}초). 분석을 다시 실행하면 새 옵션이 적용됩니다.")
+    except StaleSourceError as e:
+        st.error(f"❌ {e}")
+    except Exception as e:
+        st.error("❌ 기준 데이터 재계산 중 오류 발생")
+        st.exception(e)
+
+with st.expander("🗄️ 기준 데이터 캐시 상태", expanded=False):
+    cache_stats = baseline_registry.stats()
+    cs1, cs2, cs3 = st.columns(3)
+    cs1.metric("캐시된 기준 데이터", f"{cache_stats['entries']}개")
+    cs2.metric("메모리 사용량", f"{cache_stats['used_bytes'] / 1024 / 1024:,.1f} / {cache_stats['budget_bytes'] / 1024 / 1024:,.0f} MB")
+    cs3.metric("적중률", f"{cache_stats['hit_rate'] * 100:.1f}%")
+    st.caption(f"적중 {cache_stats['hits']:,}회 · 미적중 {cache_stats['misses']:,}회 · 제거 {cache_stats['evictions']:,}회 (한도는 BASELINE_CACHE_MB 환경 변수로 설정)")
+    if CHECKPOINT_ENABLED:
+        n_checkpoints, checkpoint_bytes = checkpoint_usage()
+        ck1, ck2 = st.columns([3, 1])
+        ck1.caption(f"분석 체크포인트: {n_checkpoints}개 · {checkpoint_bytes / 1024 / 1024:,.1f} MB ({CHECKPOINT_DIR}) · "
+                    f"{CHECKPOINT_KEEP_HOURS:g}시간 지나면 자동 삭제 (CHECKPOINT_KEEP_HOURS 환경 변수)")
+        if ck2.button("🧹 체크포인트 비우기", disabled=not n_checkpoints):
+            checkpoint_writer.flush()  # 아직 쓰는 중인 파일이 비운 뒤에 다시 생기지 않도록
+            prune_checkpoints(max_age_hours=0)
+            st.rerun()
+
 st.subheader("2️⃣ 비교(이후) 파일 선택")
 
 if input_mode == "로컬 폴더":
@@ -681,26 +4366,21 @@ if input_mode == "로컬 폴더":
         if excel_files:
             c3, c4 = st.columns(2)
             with c3:
-                selected_new_file = st.selectbox("비교 파일 선택", options=excel_files, key="new_file_select")
+                selected_new_file = st.selectbox("비교 파일 선택", options=excel_files, key="new_file_select",
+                                                 on_change=mark_prefetch_intent, args=("new",))
                 file_new = os.path.join(folder_path, selected_new_file) if selected_new_file else None
             with c4:
                 sheet_new = None
                 if file_new:
-                    wb2 = None
                     try:
-                        wb2 = load_workbook(file_new, read_only=True, data_only=True)
-                        if wb2 and wb2.sheetnames:
-                            sheet_new = st.selectbox("시트 선택(비교)", options=wb2.sheetnames, index=0, key="new_sheet")
+                        new_sheet_names = sheet_names(file_new)
+                        if new_sheet_names:
+                            sheet_new = st.selectbox("시트 선택(비교)", options=new_sheet_names, index=0, key="new_sheet",
+                                                     on_change=mark_prefetch_intent, args=("new",))
                         else:
                             st.error("시트를 찾을 수 없습니다.")
                     except Exception as e:
                         st.error(f"비교 파일 시트 읽기 실패: {e}")
-                    finally:
-                        if wb2:
-                            try:
-                                wb2.close()
-                            except Exception:
-                                pass
         else:
             file_new = None
             sheet_new = None
@@ -711,157 +4391,309 @@ else:
     # 파일 업로드 방식
     c3, c4 = st.columns(2)
     with c3:
-        file_new = st.file_uploader("비교 엑셀 파일", type=["xlsx"], key="new_allcols")
+        file_new = st.file_uploader("비교 엑셀 파일", type=["xlsx", "csv", "tsv"], key="new_allcols",
+                                    help="CSV/TSV는 값만 비교합니다 (배경색 정보 없음)")
     with c4:
         sheet_new = None
         if file_new:
-            wb2 = None
             try:
-                wb2 = load_workbook(file_new, read_only=True, data_only=True)
-                if wb2 and wb2.sheetnames:
-                    sheet_new = st.selectbox("시트 선택(비교)", options=wb2.sheetnames, index=0)
+                new_sheet_names = sheet_names(file_new)
+                if new_sheet_names:
+                    sheet_new = st.selectbox("시트 선택(비교)", options=new_sheet_names, index=0)
                 else:
                     st.error("시트를 찾을 수 없습니다.")
             except Exception as e:
                 st.error(f"비교 파일 시트 읽기 실패: {e}")
-            finally:
-                if wb2:
-                    try:
-                        wb2.close()
-                    except Exception:
-                        pass
+
+if (file_new and sheet_new and not st.session_state.get("spill_mode", spill_mode)
+        and (input_mode != "로컬 폴더" or st.session_state.get("prefetch_new"))):
+    # 분석에는 기준 데이터 저장 시점의 행/열 제한을 쓰므로 같은 값으로 미리 읽음
+    show_prefetch_status(prefetch_sheet(
+        file_new, sheet_new, st.session_state.get("max_rows", max_rows), st.session_state.get("max_cols", max_cols),
+        st.session_state.get("column_selection", column_selection), st.session_state.get("row_filter", row_filter)
+    ))
+
+analysis_job_id = st.session_state.get("analysis_job_id")
+
+# 분석에는 기준 데이터 저장 시점의 설정값 사용
+analysis_options = {
+    **st.session_state.get("norm_options", norm_options),
+    "max_rows": st.session_state.get("max_rows", 100000),
+    "max_cols": st.session_state.get("max_cols", 200),
+    "unlimited_pairing": st.session_state.get("unlimited_pairing", False),
+    "pairing_top_k": st.session_state.get("pairing_top_k", 5),
+    "min_match_ratio": st.session_state.get("min_match_ratio", 0.0),
+    "spill_mode": st.session_state.get("spill_mode", False),
+    "memory_budget_mb": st.session_state.get("memory_budget_mb", 512),
+    "column_selection": st.session_state.get("column_selection"),
+    "row_filter": st.session_state.get("row_filter"),
+    # 기준 데이터와 무관한 출력 옵션이므로 현재 설정값 사용
+    "collect_cell_changes": collect_cell_changes,
+}
 
 if st.button("🔍 변경 사항 분석 실행", type="primary",
-             disabled=not (file_new and sheet_new and ("old_rows" in st.session_state))):
+             disabled=not (file_new and sheet_new and ("baseline_key" in st.session_state)) or bool(analysis_job_id)):
+    job = job_manager.submit(
+        partial(_execute_job, run_comparison, (
+            st.session_state["old_file_path"], st.session_state["old_sheet_name"], st.session_state["baseline_key"],
+            file_new, sheet_new, analysis_options
+        )),
+        meta={"new_file_path": file_new, "new_sheet_name": sheet_new}
+    )
+    st.session_state["analysis_job_id"] = job.id
+    analysis_job_id = job.id
+
+# 표본 미리보기: 전체 분석 전에 결과 비율과 실행 시간을 몇 초 안에 추정
+if st.button("🔎 빠른 미리보기 (표본)",
+             disabled=not (file_new and sheet_new and ("baseline_key" in st.session_state)) or analysis_options["spill_mode"],
+             help="비교 파일의 일부 행만 기준 데이터와 대조하여 결과 비율과 예상 실행 시간을 추정합니다 (디스크 사용 모드 제외)"):
     try:
-        # 저장된 설정값 사용
-        old_rows = st.session_state["old_rows"]
-        old_fills = st.session_state["old_fills"]
-        columns_old = st.session_state["columns"]
-        old_multiset = st.session_state["old_rows_norm_multiset"]
-        old_tuple_to_indices = st.session_state["old_rows_by_tuple_indices"]
-        saved_trim_spaces = st.session_state.get("trim_spaces", trim_spaces)
-        saved_case_sensitive = st.session_state.get("case_sensitive", case_sensitive)
-        saved_max_rows = st.session_state.get("max_rows", 100000)
-        saved_max_cols = st.session_state.get("max_cols", 200)
-        saved_unlimited_pairing = st.session_state.get("unlimited_pairing", False)
-        
-        # 비교 파일 정보 저장 (스타일 복사용)
-        st.session_state["new_file_path"] = file_new
-        st.session_state["new_sheet_name"] = sheet_new
+        with st.spinner("표본 행 대조 중..."):
+            st.session_state["preview_result"] = preview_comparison(
+                st.session_state["old_file_path"], st.session_state["old_sheet_name"], st.session_state["baseline_key"],
+                file_new, sheet_new, analysis_options
+            )
+    except Exception as e:
+        st.session_state.pop("preview_result", None)
+        st.error(f"❌ 미리보기 실패: {e}")
 
-        # 진행 상황 표시
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        status_text.text("📖 비교 파일을 읽는 중...")
-        progress_bar.progress(10)
-        
-        new_rows, new_fills, cols_new = read_sheet_values_and_fills(
-            file_new, sheet_new, saved_trim_spaces, saved_case_sensitive, saved_max_rows, saved_max_cols
-        )
-        
-        if not new_rows:
-            st.error("❌ 비교 파일에 데이터가 없습니다.")
-            progress_bar.empty()
-            status_text.empty()
+if "preview_result" in st.session_state:
+    preview = st.session_state["preview_result"]
+    with st.expander("🔎 미리보기 결과 (추정)", expanded=True):
+        st.caption(f"{preview['method']} {preview['sample_rows']:,}행 / 비교 파일 {preview['new_rows']:,}행"
+                   f"{'(추정)' if preview['method'] in ('앞부분 표본', '구간 표본') else ''}, "
+                   f"기준 {preview['baseline_rows']:,}행 · {preview['elapsed_s']:.2f}초 소요")
+        if preview["method"] == "앞부분 표본":
+            st.caption(f"⚠️ 시트 앞쪽 {PREVIEW_SCAN_ROWS:,}행에서만 표본을 뽑았습니다. 뒤쪽에 몰린 추가/변경은 덜 반영될 수 있습니다.")
+        st.dataframe(pd.DataFrame([
+            {"구분": name, "표본 비율": f"{p * 100:.1f}%", "95% 신뢰구간": f"{lo * 100:.1f}% ~ {hi * 100:.1f}%"}
+            for name, (p, lo, hi) in preview["fractions"].items()
+        ]), use_container_width=True, hide_index=True)
+        for mode, counts in preview["estimates"].items():
+            st.write(f"예상 건수 ({mode}): " + ", ".join(f"{k} {v:,}건" for k, v in counts.items()))
+        cost = preview["cost"]
+        st.write(f"예상 실행 시간: 제한 모드 약 {cost['제한 모드']:,.1f}초, 무제한 페어링 약 {cost['무제한 페어링']:,.1f}초 "
+                 f"(유사도 비교 조합 {preview['pairs']:,}개, 조합당 {preview['per_pair_us']:.1f}µs)")
+        recommended = preview["recommend_unlimited"]
+        st.info(f"💡 추천: {'무제한 페어링' if recommended else '제한 모드'}"
+                + (" (예상 시간이 예산 안이고 제한 모드로는 일부 조합을 건너뜀)" if recommended else ""))
+        if bool(st.session_state.get("unlimited_pairing", False)) != recommended:
+            if st.button("✅ 추천 페어링 모드로 분석 설정 변경"):
+                # 체크박스는 이미 그려졌으므로 다음 실행에서 위젯 생성 전에 반영
+                st.session_state["unlimited_pairing"] = recommended
+                st.session_state["pending_unlimited_pairing"] = recommended
+                st.rerun()
+
+# 로컬 폴더 모드: 기준 파일 하나를 폴더의 여러 파일과 한 번에 비교
+if input_mode == "로컬 폴더" and folder_path and os.path.isdir(folder_path) and "baseline_key" in st.session_state:
+    with st.expander("📚 폴더의 여러 파일과 한 번에 비교 (일괄 분석)", expanded=False):
+        st.caption(f"병렬 작업 수: {BATCH_WORKERS} (`BATCH_WORKERS` 환경 변수) · "
+                   "각 파일에서 기준 시트와 같은 이름의 시트를, 없으면 첫 시트를 비교합니다.")
+        batch_candidates = [
+            f for f in get_excel_files_in_folder(folder_path)
+            if os.path.join(folder_path, f) != st.session_state.get("old_file_path")
+        ]
+        batch_selected = st.multiselect("비교할 파일", options=batch_candidates, default=batch_candidates, key="batch_files")
+        if st.button("🚀 일괄 분석 실행", disabled=not batch_selected or bool(analysis_job_id)):
+            job = job_manager.submit(
+                partial(_execute_job, run_batch_comparison, (
+                    st.session_state["old_file_path"], st.session_state["old_sheet_name"], st.session_state["baseline_key"],
+                    [os.path.join(folder_path, f) for f in batch_selected], analysis_options
+                )),
+                meta={"new_file_path": None, "new_sheet_name": None, "source": "batch"}
+            )
+            st.session_state["analysis_job_id"] = job.id
+            analysis_job_id = job.id
+
+def show_folder_watch(watch):
+    """감시 상태와 최근 자동 비교 결과를 주기적으로 갱신합니다."""
+    last_scan = datetime.fromtimestamp(watch.last_scan).strftime("%H:%M:%S") if watch.last_scan else "-"
+    st.caption(f"상태: {'비교 중' if watch.status == 'comparing' else '감시 중'} · 마지막 확인 {last_scan} · "
+               f"읽은 버전 {len(watch.versions)}개 · 쓰는 중(대기) {len(watch.pending)}개")
+    if watch.stage:
+        st.caption(watch.stage)
+    if watch.error:
+        st.warning(f"⚠️ 폴더 확인 중 오류: {watch.error}")
+    for path, (_, error) in list(watch.failed.items()):
+        st.warning(f"⚠️ {os.path.basename(path)} 읽기 실패: {error}")
+    diffs = list(watch.diffs)
+    if not diffs:
+        st.info("아직 비교 결과가 없습니다. 버전이 두 개 이상 모이면 자동으로 직전 버전과 비교합니다.")
+        return
+    st.dataframe(pd.DataFrame([{
+        "이전 버전": d["old"]["name"],
+        "새 버전": d["new"]["name"],
+        "동일(재정렬만)": result_count(d["frames"], "df_unchanged"),
+        "변경": result_count(d["frames"], "df_changes"),
+        "제거": result_count(d["frames"], "df_removed"),
+        "추가": result_count(d["frames"], "df_added"),
+        "소요(초)": round(d["elapsed"], 2),
+        "완료 시각": datetime.fromtimestamp(d["finished_at"]).strftime("%m-%d %H:%M:%S"),
+    } for d in reversed(diffs)]), use_container_width=True, hide_index=True)
+    if st.button("🔎 최신 비교 결과 보기", key="watch_show_latest"):
+        # 최신 자동 비교 결과를 일반 분석 결과처럼 연결 (아래 결과 표시/다운로드 재사용)
+        latest = diffs[-1]
+        st.session_state.update(latest["frames"])
+        st.session_state["new_file_path"] = latest["new"]["path"]
+        st.session_state["new_sheet_name"] = latest["new"]["sheet"]
+        st.session_state["watch_old_file_path"] = latest["old"]["path"]
+        st.session_state["watch_old_sheet_name"] = latest["old"]["sheet"]
+        st.session_state["result_source"] = "watch"
+        st.session_state["analysis_messages"] = list(latest["messages"]) + [
+            ("success", f"✅ 폴더 감시 비교 결과: {latest['old']['name']} → {latest['new']['name']}")
+        ]
+        st.rerun(scope="app")
+
+# 로컬 폴더 모드: 폴더를 감시하여 새 버전이 들어오면 백그라운드에서 직전 버전과 자동 비교
+if input_mode == "로컬 폴더" and folder_path and os.path.isdir(folder_path):
+    active_watch = folder_watcher.get(folder_path)
+    with st.expander("👀 폴더 감시 (새 버전 자동 비교)", expanded=active_watch is not None):
+        st.caption(f"{WATCH_INTERVAL_S:g}초마다 폴더를 확인하고, {WATCH_DEBOUNCE_S:g}초 동안 크기/수정 시각이 그대로인 파일만 "
+                   "다 쓴 것으로 보고 읽습니다 (`WATCH_INTERVAL_S`, `WATCH_DEBOUNCE_S` 환경 변수). "
+                   "감시는 브라우저를 닫아도 서버에서 계속되며, 현재 분석 설정과 기준 시트 이름을 사용합니다.")
+        if active_watch is None or active_watch.status == "stopped":
+            if st.button("▶️ 감시 시작"):
+                folder_watcher.start(folder_path, st.session_state.get("old_sheet_name"), analysis_options)
+                st.rerun()
         else:
-            progress_bar.progress(20)
-            
-            # 열 범위: 기준/비교 중 더 넓은 범위를 사용 (기존 columns_old는 유지)
-            all_columns = list(set(columns_old + cols_new))
-            all_columns.sort(key=lambda x: (len(x), x))  # A, B, ... Z, AA, AB ...
-            columns = all_columns
+            if st.button("⏹️ 감시 중지"):
+                folder_watcher.stop(folder_path)
+                st.rerun()
+            st.fragment(run_every=5.0)(show_folder_watch)(active_watch)
 
-            status_text.text("🔄 동일한 행 매칭 중...")
-            progress_bar.progress(30)
-            
-            remaining_old_indices = set(range(len(old_rows)))
-            remaining_new_indices = set(range(len(new_rows)))
-
-            exact_pairs = []
-            temp_multiset = old_multiset.copy()
-            temp_tuple_to_indices = {k: v.copy() for k, v in old_tuple_to_indices.items()}
-
-            for j, nr in enumerate(new_rows):
-                t = row_tuple(nr["norm"], columns)
-                if temp_multiset.get(t, 0) > 0:
-                    i = temp_tuple_to_indices[t].pop(0)
-                    temp_multiset[t] -= 1
-                    exact_pairs.append((i, j))
-                    remaining_old_indices.discard(i)
-                    remaining_new_indices.discard(j)
-
-            progress_bar.progress(50)
-            status_text.text("🔍 변경된 행 매칭 중...")
-            
-            old_left = [old_rows[i] for i in sorted(remaining_old_indices)]
-            new_left = [new_rows[j] for j in sorted(remaining_new_indices)]
-            pairs, leftover_old_idx, leftover_new_idx = best_pairing(new_left, old_left, columns, saved_unlimited_pairing)
+def show_analysis_job():
+    """
+    실행 중인 분석 작업의 진행 상황을 주기적으로 갱신하고, 끝나면 결과를 세션에 연결합니다.
+    """
+    job_id = st.session_state.get("analysis_job_id")
+    job = job_manager.get(job_id) if job_id else None
+    if job is None:
+        st.session_state.pop("analysis_job_id", None)
+        return
 
-            progress_bar.progress(60)
-            status_text.text("📊 변경 내역 생성 중...")
-            
-            best_pairs = []
-            sorted_old_left = sorted(remaining_old_indices)
-            sorted_new_left = sorted(remaining_new_indices)
-            for eq, i, j in sorted([(p[2], p[0], p[1]) for p in pairs], reverse=True):
-                old_idx_global = sorted_old_left[i]
-                new_idx_global = sorted_new_left[j]
-                best_pairs.append((old_idx_global, new_idx_global, eq))
-
-            unchanged_records = [{
-                "기준행": old_rows[i]["_row"],
-                "비교행": new_rows[j]["_row"],
-                "상태": "동일(재정렬만)"
-            } for i, j in exact_pairs]
-
-            progress_bar.progress(70)
-            
-            changes_records = []
-            for i, j, eq in best_pairs:
-                rec = build_diff_record(old_rows[i], new_rows[j], old_fills, new_fills, columns)
-                rec["일치열수"] = eq
-                rec["상태"] = "변경"
-                changes_records.append(rec)
+    if job.status in ("queued", "running"):
+        elapsed = time.time() - job.created_at
+        st.progress(min(job.progress, 100), text=f"{job.stage} (경과 {elapsed:,.0f}초)")
+        if job.cancel_event.is_set():
+            st.caption("⏹️ 취소 요청됨, 현재 단계가 끝나는 대로 중단합니다...")
+        elif st.button("⏹️ 분석 취소", key="cancel_analysis_job"):
+            job.cancel_event.set()
+        return
 
-            progress_bar.progress(80)
-            
-            used_old = set([i for i, _, _ in best_pairs] + [i for i, _ in exact_pairs])
-            used_new = set([j for _, j, _ in best_pairs] + [j for _, j in exact_pairs])
+    # 작업 종료: 결과를 세션에 연결하고 전체 화면을 다시 그림
+    job_manager.pop(job.id)
+    st.session_state.pop("analysis_job_id", None)
+    st.session_state["analysis_messages"] = list(job.messages)
+    if job.status == "done" and job.meta.get("source") == "batch":
+        st.session_state["batch_summary"] = job.result["summary"]
+        st.session_state["batch_results"] = job.result["results"]
+        st.session_state["analysis_messages"].append((
+            "success",
+            f"✅ 일괄 분석 완료: {len(job.result['summary'])}개 파일 ({job.finished_at - job.created_at:,.1f}초)"
+        ))
+    elif job.status == "done":
+        frames = job.result
+        st.session_state.update(frames)
+        # 비교 파일 정보 저장 (스타일 복사용)
+        st.session_state["new_file_path"] = job.meta["new_file_path"]
+        st.session_state["new_sheet_name"] = job.meta["new_sheet_name"]
+        st.session_state["result_source"] = job.meta.get("source", "files")
+        st.session_state["analysis_messages"].append((
+            "success",
+            f"✅ 분석 완료: 동일(재정렬만) {result_count(frames, 'df_unchanged')}건, 변경 {result_count(frames, 'df_changes')}건, "
+            f"제거 {result_count(frames, 'df_removed')}건, 추가 {result_count(frames, 'df_added')}건 "
+            f"({job.finished_at - job.created_at:,.1f}초)"
+        ))
+    elif job.status == "cancelled":
+        st.session_state["analysis_messages"].append(("warning", "⏹️ 분석이 취소되었습니다."))
+    else:
+        st.session_state["analysis_messages"].append(("error", f"❌ 분석 중 오류가 발생했습니다: {job.error}"))
+    st.rerun()
 
-            removed_records = [{"기준행": old_rows[i]["_row"], "상태": "제거됨"} for i in range(len(old_rows)) if i not in used_old]
-            added_records = [{"비교행": new_rows[j]["_row"], "상태": "추가됨"} for j in range(len(new_rows)) if j not in used_new]
+if analysis_job_id:
+    # 작업 중에도 다른 위젯과 이전 결과를 그대로 쓸 수 있도록 이 영역만 주기적으로 갱신
+    st.fragment(run_every=1.0)(show_analysis_job)()
 
-            progress_bar.progress(90)
-            status_text.text("✨ 결과 정리 중...")
-            
-            df_unchanged = pd.DataFrame(unchanged_records)
-            df_changes = pd.DataFrame(changes_records, columns=["기준행","비교행","일치열수","변경요약","상태"])
-            df_removed = pd.DataFrame(removed_records)
-            df_added = pd.DataFrame(added_records)
-            
-            # 세션에 저장
-            st.session_state["df_unchanged"] = df_unchanged
-            st.session_state["df_changes"] = df_changes
-            st.session_state["df_removed"] = df_removed
-            st.session_state["df_added"] = df_added
-            
-            progress_bar.progress(100)
-            status_text.text("✅ 분석 완료!")
-            
-            st.success(f"✅ 분석 완료: 동일(재정렬만) {len(df_unchanged)}건, 변경 {len(df_changes)}건, 제거 {len(df_removed)}건, 추가 {len(df_added)}건")
-            
-            progress_bar.empty()
-            status_text.empty()
-    
-    except Exception as e:
-        if 'progress_bar' in locals():
-            progress_bar.empty()
-        if 'status_text' in locals():
-            status_text.empty()
-        st.error("❌ 분석 중 오류가 발생했습니다.")
-        st.exception(e)
+for kind, msg in st.session_state.get("analysis_messages", []):
+    getattr(st, kind)(msg)
+
+if "batch_summary" in st.session_state:
+    st.subheader("📚 일괄 분석 요약")
+    st.dataframe(st.session_state["batch_summary"], use_container_width=True, hide_index=True)
+    batch_results = st.session_state.get("batch_results", {})
+    if batch_results:
+        bc1, bc2 = st.columns([3, 1])
+        with bc1:
+            drill_file = st.selectbox("상세 결과를 볼 파일", options=list(batch_results), format_func=os.path.basename,
+                                      key="batch_drill_file")
+        with bc2:
+            st.write("")
+            if st.button("🔎 상세 결과 보기", use_container_width=True):
+                # 선택한 파일의 결과를 일반 분석 결과처럼 연결 (아래 결과 표시/다운로드 재사용)
+                st.session_state.update(batch_results[drill_file]["frames"])
+                st.session_state["new_file_path"] = drill_file
+                st.session_state["new_sheet_name"] = batch_results[drill_file]["sheet"]
+                st.session_state["result_source"] = "files"
+                st.rerun()
+
+# ----------------------- 버전 이력 -----------------------
+with st.expander("🗂️ 버전 이력 (같은 보고서의 여러 버전 저장/비교)", expanded=False):
+    st.caption(f"저장 위치: {HISTORY_DB} · 버전마다 행 내용 해시 목록만 저장하고, 새로 나온 행 내용만 추가로 저장합니다.")
+    default_version_name = ""
+    if file_old:
+        default_version_name = os.path.basename(file_old) if isinstance(file_old, str) else getattr(file_old, "name", "")
+    vc1, vc2 = st.columns([3, 1])
+    with vc1:
+        version_name = st.text_input("버전 이름", value=default_version_name, key="version_name")
+    with vc2:
+        save_version_clicked = st.button("💾 기준 파일을 버전으로 저장", disabled=not (file_old and sheet_old), use_container_width=True)
+    if save_version_clicked:
+        try:
+            with st.spinner("버전 저장 중..."):
+                version_id, new_blobs = save_version(file_old, sheet_old, version_name, max_rows, max_cols)
+            st.success(f"✅ 버전 {version_id} 저장 완료 (새로 저장된 행 내용 {new_blobs:,}개)")
+        except Exception as e:
+            st.error("❌ 버전 저장 중 오류 발생")
+            st.exception(e)
+
+    df_versions = list_versions() if os.path.exists(HISTORY_DB) else pd.DataFrame()
+    if df_versions.empty:
+        st.info("저장된 버전이 없습니다.")
+    else:
+        st.dataframe(df_versions, use_container_width=True, hide_index=True)
+        version_labels = {
+            row["버전"]: f'{row["버전"]} · {row["이름"]} ({row["저장 시각"]:%Y-%m-%d %H:%M})'
+            for _, row in df_versions.iterrows()
+        }
+        version_ids = list(version_labels)
+        vd1, vd2 = st.columns(2)
+        with vd1:
+            old_version = st.selectbox("기준 버전", options=version_ids, index=min(1, len(version_ids) - 1),
+                                       format_func=version_labels.get, key="version_old")
+        with vd2:
+            new_version = st.selectbox("비교 버전", options=version_ids, index=0,
+                                       format_func=version_labels.get, key="version_new")
+        if st.button("🔍 버전 비교 실행", disabled=bool(analysis_job_id) or old_version == new_version):
+            # 버전 비교는 저장된 원본 값에 현재 설정을 적용
+            version_options = {
+                **norm_options,
+                "unlimited_pairing": unlimited_pairing,
+                "pairing_top_k": pairing_top_k,
+                "min_match_ratio": min_match_ratio,
+                "column_selection": column_selection,
+                "row_filter": row_filter,
+                "collect_cell_changes": collect_cell_changes,
+            }
+            job = job_manager.submit(
+                partial(_execute_job, diff_versions, (old_version, new_version, version_options)),
+                meta={"new_file_path": None, "new_sheet_name": None, "source": "versions"}
+            )
+            st.session_state["analysis_job_id"] = job.id
+            st.rerun()
+
+        timeline_n = st.number_input("최근 버전 수", min_value=2, max_value=500, value=12, step=1)
+        if st.button("📈 버전별 변경 추이 보기"):
+            st.dataframe(version_timeline(timeline_n), use_container_width=True, hide_index=True)
 
 # ----------------------- 결과 표시 -----------------------
 if "df_unchanged" in st.session_state:
@@ -872,6 +4704,12 @@ if "df_unchanged" in st.session_state:
     df_changes = st.session_state["df_changes"]
     df_removed = st.session_state["df_removed"]
     df_added = st.session_state["df_added"]
+
+    def caption_if_partial(name, df):
+        # 디스크 사용 모드 결과는 표마다 처음 일부만 메모리에 올림
+        total = result_count(st.session_state, name)
+        if total > len(df):
+            st.caption(f"전체 {total:,}건 중 처음 {len(df):,}건만 표시합니다. 전체 내역은 데이터로 내보내기에서 받을 수 있습니다.")
     
     # 필터링 옵션
     with st.expander("🔍 결과 필터링", expanded=False):
@@ -887,6 +4725,7 @@ if "df_unchanged" in st.session_state:
     if show_unchanged:
         st.write("### ✅ 동일(재정렬만)")
         if not df_unchanged.empty:
+            caption_if_partial("df_unchanged", df_unchanged)
             st.dataframe(df_unchanged, use_container_width=True, hide_index=True)
         else:
             st.info("동일한 행이 없습니다.")
@@ -895,6 +4734,7 @@ if "df_unchanged" in st.session_state:
     if show_changes:
         st.write("### 🔄 변경 (값/색상)")
         if not df_changes.empty:
+            caption_if_partial("df_changes", df_changes)
             df_to_show = df_changes.copy()
             if 'search_text' in locals() and search_text:
                 df_to_show = df_to_show[df_to_show["변경요약"].str.contains(search_text, case=False, na=False)]
@@ -907,6 +4747,7 @@ if "df_unchanged" in st.session_state:
     if show_removed:
         st.write("### ❌ 제거됨 (기준에는 있었으나 비교에는 없음)")
         if not df_removed.empty:
+            caption_if_partial("df_removed", df_removed)
             st.dataframe(df_removed, use_container_width=True, hide_index=True)
         else:
             st.info("제거된 행이 없습니다.")
@@ -915,6 +4756,7 @@ if "df_unchanged" in st.session_state:
     if show_added:
         st.write("### ➕ 추가됨 (비교에는 있으나 기준에는 없음)")
         if not df_added.empty:
+            caption_if_partial("df_added", df_added)
             st.dataframe(df_added, use_container_width=True, hide_index=True)
         else:
             st.info("추가된 행이 없습니다.")
@@ -923,8 +4765,6 @@ if "df_unchanged" in st.session_state:
     st.divider()
     st.subheader("💾 결과 다운로드")
     
-    from io import BytesIO
-    
     def create_result_excel_with_styles():
         """
         실제 엑셀 셀과 스타일을 복사하여 결과 파일 생성
@@ -934,9 +4774,13 @@ if "df_unchanged" in st.session_state:
         Sheet4: 원본 기준 엑셀 전체
         """
         try:
-            # 원본 파일 정보 가져오기
-            old_file_path = st.session_state.get("old_file_path")
-            old_sheet_name = st.session_state.get("old_sheet_name")
+            # 원본 파일 정보 가져오기 (폴더 감시 결과는 직전 버전 파일이 기준)
+            if st.session_state.get("result_source") == "watch":
+                old_file_path = st.session_state.get("watch_old_file_path")
+                old_sheet_name = st.session_state.get("watch_old_sheet_name")
+            else:
+                old_file_path = st.session_state.get("old_file_path")
+                old_sheet_name = st.session_state.get("old_sheet_name")
             new_file_path = st.session_state.get("new_file_path")
             new_sheet_name = st.session_state.get("new_sheet_name")
             
@@ -1043,39 +4887,79 @@ if "df_unchanged" in st.session_state:
             st.exception(e)
             return None
     
+    # 데이터 형식 내보내기 (청크 단위로 파일에 기록 후 다운로드)
+    with st.expander("📤 데이터로 내보내기 (CSV / JSON Lines / Parquet)", expanded=False):
+        st.caption(f"동일/변경/제거/추가 행과 셀 단위 변경 내역을 한 파일로 내보냅니다 (구분 열로 종류 표시). 저장 위치: {export_root()} "
+                   f"({EXPORT_KEEP_HOURS:g}시간 지나면 자동 삭제)")
+        if st.session_state.get("df_cell_changes") is not None and st.session_state["df_cell_changes"].empty:
+            st.caption("셀 단위 변경 내역이 필요하면 '셀 단위 변경 내역 수집'을 켜고 분석을 다시 실행하세요.")
+        export_label = st.selectbox("형식", list(EXPORT_FORMATS), key="export_format")
+        if st.button("📤 내보내기 파일 만들기"):
+            export_fmt = EXPORT_FORMATS[export_label]
+            previous = st.session_state.pop("export_path", None)
+            if previous and os.path.exists(previous):
+                os.remove(previous)
+            try:
+                prune_exports()
+                export_path = new_export_path(export_fmt)
+                started = time.time()
+                with st.spinner("내보내기 파일 쓰는 중..."):
+                    n_exported = export_results(
+                        {key: st.session_state.get(key) for key in [k for k, _ in EXPORT_KINDS] + ["result_store"]},
+                        export_fmt, export_path
+                    )
+                st.session_state["export_path"] = export_path
+                st.success(f"✅ {n_exported:,}행 내보내기 완료 ({time.time() - started:,.1f}초)")
+            except Exception as e:
+                st.error(f"❌ 내보내기 실패: {e}")
+        export_path = st.session_state.get("export_path")
+        if export_path and os.path.exists(export_path):
+            # 파일은 다운로드를 준비할 때만 읽음 (다른 조작으로 화면이 다시 그려질 때마다 읽지 않도록)
+            if st.button(f"📦 다운로드 준비 ({os.path.getsize(export_path) / 1024 / 1024:,.1f} MB)"):
+                with open(export_path, "rb") as export_file:
+                    st.download_button("📥 내보내기 파일 다운로드", data=export_file,
+                                       file_name=os.path.basename(export_path), use_container_width=True)
+
     # 스타일 포함 엑셀 다운로드
-    st.info("💡 다운로드 파일에는 원본 엑셀의 **모든 색상과 스타일**이 포함됩니다.")
-    
-    try:
-        with st.spinner("엑셀 파일 생성 중... (스타일 복사 중)"):
-            result_data = create_result_excel_with_styles()
+    if st.session_state.get("result_source") == "versions":
+        st.info("💡 버전 이력 비교 결과는 원본 파일이 없어 스타일 포함 다운로드를 지원하지 않습니다.")
+    elif any(text_delimiter(f) for f in (
+        st.session_state.get("watch_old_file_path" if st.session_state.get("result_source") == "watch" else "old_file_path") or "",
+        st.session_state.get("new_file_path") or "",
+    )):
+        st.info("💡 CSV/TSV 파일은 스타일 정보가 없어 스타일 포함 다운로드를 지원하지 않습니다. 위의 데이터 내보내기를 사용하세요.")
+    else:
+        st.info("💡 다운로드 파일에는 원본 엑셀의 **모든 색상과 스타일**이 포함됩니다.")
+        try:
+            with st.spinner("엑셀 파일 생성 중... (스타일 복사 중)"):
+                result_data = create_result_excel_with_styles()
         
-        if result_data:
-            col_dl1, col_dl2 = st.columns(2)
+            if result_data:
+                col_dl1, col_dl2 = st.columns(2)
             
-            with col_dl1:
-                st.download_button(
-                    "📥 결과 다운로드 (원본 색상 포함)",
-                    data=result_data,
-                    file_name="excel_compare_with_styles.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True,
-                    type="primary"
-                )
+                with col_dl1:
+                    st.download_button(
+                        "📥 결과 다운로드 (원본 색상 포함)",
+                        data=result_data,
+                        file_name="excel_compare_with_styles.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        use_container_width=True,
+                        type="primary"
+                    )
             
-            with col_dl2:
-                st.success(f"""
-                ✅ 다운로드 파일 구성:
-                - Sheet1: 변경된 내용 ({len(df_changes)}건)
-                - Sheet2: 추가된 내용 ({len(df_added)}건)
-                - Sheet3: 삭제된 내용 ({len(df_removed)}건)
-                - Sheet4: 원본 기준 엑셀 (전체)
-                """)
-        else:
-            st.error("결과 파일 생성에 실패했습니다.")
-    except Exception as e:
-        st.error(f"결과 다운로드 준비 중 오류: {e}")
-        st.exception(e)
+                with col_dl2:
+                    st.success(f"""
+                    ✅ 다운로드 파일 구성:
+                    - Sheet1: 변경된 내용 ({len(df_changes)}건)
+                    - Sheet2: 추가된 내용 ({len(df_added)}건)
+                    - Sheet3: 삭제된 내용 ({len(df_removed)}건)
+                    - Sheet4: 원본 기준 엑셀 (전체)
+                    """)
+            else:
+                st.error("결과 파일 생성에 실패했습니다.")
+        except Exception as e:
+            st.error(f"결과 다운로드 준비 중 오류: {e}")
+            st.exception(e)
 
 st.divider()
 st.info("💡 **사용 방법**: 기준 파일을 먼저 저장한 후, 비교 파일을 선택하여 분석을 실행하세요. 행 순서가 달라도 정확히 매칭하며, 모든 사용된 열(값/채우기 존재)을 자동 인식하여 비교합니다.")
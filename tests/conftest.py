@@ -0,0 +1,72 @@
+"""
+app.py는 Streamlit 스크립트이므로 화면(UI) 구역 앞의 정의만 실행해 테스트용 모듈로 불러옵니다.
+체크포인트/버전 이력 등 사용자 폴더를 쓰는 기본 경로는 테스트 전용 임시 폴더로 바꿉니다.
+"""
+import ast
+import os
+import sys
+import tempfile
+import types
+from pathlib import Path
+
+import pytest
+from openpyxl import Workbook
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+UI_BANNER = "# ----------------------- UI -----------------------"
+
+_state_dir = tempfile.mkdtemp(prefix="excel_compare_test-")
+os.environ.setdefault("CHECKPOINT_DIR", os.path.join(_state_dir, "checkpoints"))
+os.environ.setdefault("CHECKPOINT_KEY_FILE", os.path.join(_state_dir, "checkpoint.key"))
+os.environ.setdefault("HISTORY_DB", os.path.join(_state_dir, "history.sqlite"))
+
+def _calls_streamlit(node):
+    return any(isinstance(n, ast.Call) and isinstance(n.func, ast.Attribute)
+               and isinstance(n.func.value, ast.Name) and n.func.value.id == "st" for n in ast.walk(node))
+
+def load_app():
+    """UI 구역 앞의 문장 중 화면 설정(st.* 호출)을 뺀 나머지를 실행한 모듈"""
+    source = APP_PATH.read_text(encoding="utf-8")
+    ui_line = source[:source.index(UI_BANNER)].count("\n") + 1
+    tree = ast.parse(source)
+    tree.body = [n for n in tree.body
+                 if n.lineno < ui_line and (isinstance(n, (ast.FunctionDef, ast.ClassDef)) or not _calls_streamlit(n))]
+    module = types.ModuleType("app")
+    module.__file__ = str(APP_PATH)
+    sys.modules["app"] = module
+    exec(compile(tree, str(APP_PATH), "exec"), module.__dict__)
+    return module
+
+@pytest.fixture(scope="session")
+def app():
+    return load_app()
+
+@pytest.fixture
+def registry(app, monkeypatch):
+    """테스트마다 비어 있는 기준 데이터 저장소"""
+    fresh = app.BaselineRegistry(app.BASELINE_CACHE_MB * 1024 * 1024)
+    monkeypatch.setattr(app, "baseline_registry", fresh)
+    return fresh
+
+def write_xlsx(path, rows):
+    """값 목록의 목록을 첫 시트에 쓴 엑셀 파일을 만듭니다."""
+    wb = Workbook()
+    ws = wb.active
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+    return str(path)
+
+def sample_rows(n=300, seed=0):
+    """기준/비교 파일용 표본 행 (기준, 비교): 비교 쪽은 순서를 섞고 일부 행을 바꾸거나 빼거나 더함"""
+    import random
+    rng = random.Random(seed)
+    old = [[f"item-{i}", i * 10, round(i * 1.5, 2), f"group-{i % 7}"] for i in range(n)]
+    new = [list(r) for r in old]
+    for r in rng.sample(new, n // 10):
+        r[1] += 1
+    for r in rng.sample(new, n // 20):
+        new.remove(r)
+    new += [[f"extra-{i}", -i, 0.5, "group-x"] for i in range(n // 20)]
+    rng.shuffle(new)
+    return old, new
@@ -0,0 +1,75 @@
+"""비교 결과: 디스크 사용 모드와 메모리 모드, 버전 이력 비교가 같은 결과를 내는지와 top-k 후보 선택"""
+import random
+
+import pytest
+
+from conftest import sample_rows, write_xlsx
+
+def _result_sets(frames):
+    """결과 표를 모드와 무관하게 비교할 수 있는 집합으로 바꿉니다."""
+    def pairs(name, *cols):
+        df = frames[name]
+        if df.empty:
+            return set()
+        return {tuple(int(v) if c in ("기준행", "비교행") else v for c, v in zip(cols, row))
+                for row in df[list(cols)].itertuples(index=False)}
+
+    return {
+        "unchanged": pairs("df_unchanged", "기준행", "비교행"),
+        "changes": pairs("df_changes", "기준행", "비교행", "변경요약"),
+        "removed": pairs("df_removed", "기준행"),
+        "added": pairs("df_added", "비교행"),
+    }
+
+@pytest.fixture
+def files(tmp_path):
+    old, new = sample_rows(300)
+    return write_xlsx(tmp_path / "old.xlsx", old), write_xlsx(tmp_path / "new.xlsx", new)
+
+def _compare(app, old_path, new_path, **overrides):
+    options = {**app.service_options({}), **overrides}
+    key = app.prepare_baseline(old_path, None, options)[0]
+    return app.run_comparison(old_path, None, key, new_path, None, options)
+
+@pytest.mark.parametrize("unlimited", [False, True])
+def test_spill_mode_matches_in_memory(app, registry, files, unlimited):
+    in_memory = _result_sets(_compare(app, *files, unlimited_pairing=unlimited))
+    spilled = _result_sets(_compare(app, *files, unlimited_pairing=unlimited, spill_mode=True, memory_budget_mb=1))
+    assert spilled == in_memory
+    assert in_memory["changes"] and in_memory["removed"] and in_memory["added"]
+
+def test_version_diff_matches_direct_compare(app, registry, files, tmp_path):
+    db = str(tmp_path / "history.sqlite")
+    old_id, _ = app.save_version(files[0], None, "v1", 1000, 20, path=db)
+    new_id, _ = app.save_version(files[1], None, "v2", 1000, 20, path=db)
+    options = {**app.service_options({}), "column_selection": None, "row_filter": None}
+    diffed = _result_sets(app.diff_versions(old_id, new_id, options, path=db))
+    assert diffed == _result_sets(_compare(app, *files))
+    conn = app.open_history_store(db)
+    try:
+        assert {kind for (kind,) in conn.execute("SELECT DISTINCT typeof(orig) FROM row_values")} == {"text"}
+    finally:
+        conn.close()
+
+def _brute_force_top_k(old_vals, new_vals, top_k, min_eq):
+    best = {}
+    for i, ov in enumerate(old_vals):
+        eqs = sorted((sum(a == b for a, b in zip(ov, nv)) for nv in new_vals), reverse=True)
+        best[i] = [eq for eq in eqs if eq >= min_eq][:top_k]
+    return best
+
+@pytest.mark.parametrize("top_k,min_eq", [(1, 1), (3, 1), (5, 3)])
+def test_top_k_candidates_keep_the_best_matches(app, top_k, min_eq):
+    rng = random.Random(top_k * 10 + min_eq)
+    old_vals = [tuple(rng.randrange(3) for _ in range(6)) for _ in range(40)]
+    new_vals = [tuple(rng.randrange(3) for _ in range(6)) for _ in range(50)]
+    found = app.top_k_candidates(old_vals, new_vals, list(range(40)), list(range(50)), 6, top_k=top_k, min_eq=min_eq)
+    by_old = {}
+    for eq, i, _ in found:
+        by_old.setdefault(i, []).append(eq)
+    expected = _brute_force_top_k(old_vals, new_vals, top_k, min_eq)
+    assert {i: sorted(eqs, reverse=True) for i, eqs in by_old.items()} == {i: eqs for i, eqs in expected.items() if eqs}
+
+def test_top_k_below_one_is_treated_as_one(app):
+    old_vals, new_vals = [(1, 2, 3)], [(1, 2, 3), (1, 2, 0)]
+    assert app.top_k_candidates(old_vals, new_vals, [0], [0, 1], 3, top_k=0) == [(3, 0, 0)]
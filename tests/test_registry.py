@@ -0,0 +1,118 @@
+"""기준 데이터 공유 저장소: LRU 제거, 원본 고정, 내용 해시 확인, 단일 계산"""
+import threading
+import time
+
+import pytest
+
+from conftest import sample_rows, write_xlsx
+
+def test_lru_eviction_within_budget(app):
+    registry = app.BaselineRegistry(100)
+    registry.put("a", {"nbytes": 40})
+    registry.put("b", {"nbytes": 40})
+    registry.get("a")
+    registry.put("c", {"nbytes": 40})
+    assert "a" in registry and "c" in registry and "b" not in registry
+    stats = registry.stats()
+    assert stats["used_bytes"] == 80 and stats["evictions"] == 1
+
+def test_oversized_entry_is_not_stored(app):
+    registry = app.BaselineRegistry(100)
+    registry.put("a", {"nbytes": 40})
+    assert registry.put("big", {"nbytes": 101}) is False
+    assert "a" in registry and registry.stats()["used_bytes"] == 40
+
+def test_raw_entry_is_pinned_while_a_derived_entry_shares_it(app):
+    registry = app.BaselineRegistry(1000)
+    raw = {"nbytes": 500}
+    registry.put("raw", raw)
+    registry.put("derived", {"nbytes": 300, "shared": ("raw", raw)})
+    registry.put("other", {"nbytes": 300})
+    # 가장 오래된 원본 항목 대신 파생 항목이 먼저 빠지고, 그 뒤에야 원본 항목이 풀림
+    assert "raw" in registry and "derived" not in registry
+    registry.put("more", {"nbytes": 400})
+    assert "raw" not in registry
+    assert registry.stats()["used_bytes"] <= 1000
+
+def test_shared_raw_size_is_charged_when_raw_entry_is_not_cached(app):
+    registry = app.BaselineRegistry(1000)
+    registry.put("derived", {"nbytes": 100, "shared": ("raw", {"nbytes": 500})})
+    assert registry.stats()["used_bytes"] == 600
+
+def test_waiters_share_one_computation(app):
+    registry = app.BaselineRegistry(1000)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"nbytes": 1, "value": 42}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get_or_compute("k", compute)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert sorted(computed for _, computed in results) == [False, False, False, True]
+    assert all(value["value"] == 42 for value, _ in results)
+
+def test_waiter_takes_over_when_owner_is_cancelled(app):
+    registry = app.BaselineRegistry(1000)
+    started = threading.Event()
+
+    def cancelled():
+        started.set()
+        time.sleep(0.2)
+        raise app.AnalysisCancelled()
+
+    errors = []
+
+    def owner():
+        try:
+            registry.get_or_compute("k", cancelled)
+        except app.AnalysisCancelled as e:
+            errors.append(e)
+
+    t = threading.Thread(target=owner)
+    t.start()
+    started.wait()
+    value, computed = registry.get_or_compute("k", lambda: {"nbytes": 1, "value": "waiter"})
+    t.join()
+    assert errors and computed and value["value"] == "waiter"
+
+def test_stored_key_rejects_changed_source(app, registry, tmp_path, monkeypatch):
+    def evict_all():
+        monkeypatch.setattr(app, "baseline_registry", app.BaselineRegistry(registry.budget_bytes))
+
+    old, new = sample_rows(50)
+    path = write_xlsx(tmp_path / "base.xlsx", old)
+    options = app.service_options({})
+    key, baseline = app.get_or_build_baseline(path, None, options, 1000, 20)
+
+    # 캐시에서 빠진 뒤 같은 내용이면 저장해 둔 키로 다시 만듦
+    evict_all()
+    _, rebuilt = app.get_or_build_baseline(path, None, options, 1000, 20, key=key)
+    assert len(rebuilt["rows"]) == len(baseline["rows"])
+
+    write_xlsx(path, new)
+    evict_all()
+    with pytest.raises(app.StaleSourceError):
+        app.get_or_build_baseline(path, None, options, 1000, 20, key=key)
+
+def test_rederive_reuses_unaffected_columns(app, tmp_path):
+    old, _ = sample_rows(200)
+    rows = [{"_row": i + 1, "orig": {c: v for c, v in zip("ABCD", r)}} for i, r in enumerate(old)]
+    raw = {"rows": rows, "fills": {}, "columns": list("ABCD")}
+    options = app.normalization_options({})
+    first = app.baseline_from_raw(raw, options)
+    changed = {**options, "case_sensitive": False}
+    reused = app.baseline_from_raw(raw, changed, previous=first)
+    fresh = app.baseline_from_raw(raw, changed)
+    assert [r["norm"] for r in reused["rows"]] == [r["norm"] for r in fresh["rows"]]
+    assert reused["multiset"] == fresh["multiset"]
+    # 숫자 열(B, C)은 대소문자 옵션의 영향을 받지 않으므로 값 목록을 그대로 씀
+    assert reused["norm_columns"]["B"] is first["norm_columns"]["B"]
+    assert app.baseline_digest_tree(reused).root == app.baseline_digest_tree(fresh).root
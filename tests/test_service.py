@@ -0,0 +1,58 @@
+"""HTTP 서비스: 옵션 확인과 시간 초과 작업의 요청 자리"""
+import threading
+import time
+
+import pytest
+
+@pytest.mark.parametrize("options", [
+    {"max_rows": "abc"},
+    {"max_rows": 0},
+    {"max_cols": 2.5},
+    {"pairing_top_k": 0},
+    {"pairing_top_k": 101},
+    {"min_match_ratio": 1.5},
+    {"trim_spaces": "yes"},
+    {"row_filter": "x"},
+    {"row_filter": {"column": "A", "op": "zz", "value": "1"}},
+    {"row_filter": {"column": "A", "value": None}},
+    {"unknown": 1},
+])
+def test_invalid_options_are_rejected(app, options):
+    with pytest.raises(app.ServiceError) as error:
+        app.service_options(options)
+    assert error.value.status == 400
+
+def test_valid_options(app):
+    options = app.service_options({"max_rows": 10, "min_match_ratio": 1, "row_filter": {"column": "b", "value": 5}})
+    assert options["max_rows"] == 10 and options["row_filter"] == (2, "eq", ("5",))
+
+@pytest.mark.parametrize("limit", ["x", -1, True])
+def test_invalid_limit_is_rejected(app, limit):
+    service = app.CompareService(app.JobManager(1))
+    with pytest.raises(app.ServiceError) as error:
+        service.compare({"limit": limit})
+    assert error.value.status == 400
+
+def test_timed_out_job_keeps_its_slot_until_it_stops(app):
+    service = app.CompareService(app.JobManager(2), queue_limit=1, timeout=0.1)
+    release = threading.Event()
+    cleaned = []
+
+    def blocking(report=None, cancel_event=None):
+        release.wait()  # 취소를 확인하지 못하는 작업 (예: 파일 읽기 중)
+        return None
+
+    with pytest.raises(app.ServiceError) as error:
+        service.run(blocking, (), cleaned.append)
+    assert error.value.status == 504
+    with pytest.raises(app.ServiceError) as error:
+        service.run(blocking, ())
+    assert error.value.status == 503
+    assert cleaned == []
+
+    release.set()
+    deadline = time.time() + 5
+    while service.metrics.in_flight and time.time() < deadline:
+        time.sleep(0.01)
+    assert cleaned == [False]
+    assert service.run(lambda report=None, cancel_event=None: 7, ())[0] == 7
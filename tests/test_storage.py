@@ -0,0 +1,62 @@
+"""파일에 남는 데이터: 체크포인트 HMAC 확인, CSV 인코딩 판별, 내보내기 파일 정리"""
+import os
+import time
+
+import pytest
+
+@pytest.fixture
+def checkpoint_root(tmp_path):
+    return str(tmp_path / "checkpoints")
+
+def _saved(app, checkpoint, stage, value):
+    checkpoint.save(stage, value)
+    app.checkpoint_writer.flush()
+    return checkpoint._file(stage)
+
+def test_checkpoint_round_trip(app, checkpoint_root):
+    checkpoint = app.AnalysisCheckpoint(("run", 1), b"k" * 32, root=checkpoint_root)
+    _saved(app, checkpoint, "exact", {"pairs": [(1, 2)]})
+    assert checkpoint.load("exact") == {"pairs": [(1, 2)]}
+    assert oct(os.stat(checkpoint._file("exact")).st_mode & 0o777) == "0o600"
+
+def test_checkpoint_rejects_tampered_or_foreign_files(app, checkpoint_root):
+    checkpoint = app.AnalysisCheckpoint(("run", 1), b"k" * 32, root=checkpoint_root)
+    path = _saved(app, checkpoint, "exact", [1, 2, 3])
+    assert app.AnalysisCheckpoint(("run", 1), b"x" * 32, root=checkpoint_root).load("exact") is None
+
+    # 같은 실행의 다른 단계 이름으로 옮겨 넣은 파일도 읽지 않음
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(checkpoint._file("frames"), "wb") as f:
+        f.write(data)
+    assert checkpoint.load("frames") is None
+
+    with open(path, "wb") as f:
+        f.write(data[:-1] + bytes([data[-1] ^ 1]))
+    assert checkpoint.load("exact") is None
+
+def test_csv_encoding_checks_the_whole_file(app, tmp_path):
+    # 앞부분은 ASCII뿐이고 뒤쪽에만 CP949 한글이 있는 파일
+    lines = [f"row{i},{i}" for i in range(20000)] + ["마지막,행"]
+    cp949 = tmp_path / "cp949.csv"
+    cp949.write_bytes("\n".join(lines).encode("cp949"))
+    utf8 = tmp_path / "utf8.csv"
+    utf8.write_text("\n".join(lines), encoding="utf-8")
+    with open(cp949, "rb") as f:
+        assert app._text_encoding(f) == "cp949"
+    with open(utf8, "rb") as f:
+        assert app._text_encoding(f) == "utf-8-sig"
+    rows, _, _ = app.read_text_raw(str(cp949), max_rows_limit=100000)
+    assert rows[-1]["orig"]["A"] == "마지막"
+
+def test_prune_exports_only_removes_this_process_files(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "EXPORT_DIR", str(tmp_path / "exports"))
+    ours = app.new_export_path("csv")
+    others = os.path.join(app.export_root(), "excel_compare_other_1234.csv")
+    old = time.time() - 10 * 24 * 3600
+    for path in (ours, others):
+        open(path, "w").close()
+        os.utime(path, (old, old))
+    assert oct(os.stat(app.export_root()).st_mode & 0o777) == "0o700"
+    assert app.prune_exports() == 1
+    assert not os.path.exists(ours) and os.path.exists(others)